@@ -0,0 +1,141 @@
+import gzip
+import random
+from datetime import datetime, timedelta
+from typing import Callable, Dict, Iterator, NamedTuple
+
+START = datetime(2020, 4, 28, 5, 58, 34)
+NODE = "emr-logs/j-1BENCHMARK0000/node/i-0a1b2c3d4e5f60718"
+
+LEVELS = ["INFO"] * 8 + ["WARN", "ERROR"]
+
+CLASSES = [
+    "StatusTransitService$StatusTransitRunnable",
+    "PauseTransitService",
+    "CallableQueueService",
+    "SecurityManager",
+    "FsHistoryProvider",
+    "InteractiveSession$",
+    "LineBufferedStream",
+    "ResourceManager",
+    "RMAppManager",
+    "CapacityScheduler",
+]
+
+MESSAGES = [
+    "Released lock for [org.apache.oozie.service.StatusTransitService]",
+    "Acquired lock for [org.apache.oozie.service.StatusTransitService]",
+    "Running coord status service from last instance time =  2020-04-28T05:57Z",
+    "SecurityManager: authentication disabled; ui acls disabled; users  with view permissions: Set(spark)",
+    "Exception encountered when attempting to load application log",
+    "Enable HiveContext but no hive-site.xml found under classpath or user request.",
+    "Scheduled Metric snapshot period at 300 second(s).",
+    "Application application_1587973983473_0002 failed 2 times due to AM Container exited with exitCode: 1",
+    "registered UNIX signal handlers for [TERM, HUP, INT]",
+    "Storing info for app: application_1587973983473_0002",
+]
+
+STACK_FRAMES = [
+    "\tat org.apache.oozie.service.StatusTransitService.run(StatusTransitService.java:520)",
+    "\tat org.apache.hadoop.yarn.server.resourcemanager.RMAppManager.submitApplication(RMAppManager.java:322)",
+    "\tat java.util.concurrent.ThreadPoolExecutor.runWorker(ThreadPoolExecutor.java:1149)",
+    "java.io.FileNotFoundException: File does not exist: hdfs:/var/log/spark/apps/application_1587973983473_0002",
+    "Caused by: java.lang.IllegalStateException: Session is in state dead",
+]
+
+
+class LogType(NamedTuple):
+    """
+    How to generate the logs of one of the EMR log types configured in input_files.json.
+    """
+
+    key: str
+    line: Callable[[random.Random, datetime], str]
+
+
+def _level(rng: random.Random) -> str:
+    return rng.choice(LEVELS)
+
+
+def _oozie(rng: random.Random, timestamp: datetime) -> str:
+    return (
+        f"{timestamp:%Y-%m-%d %H:%M:%S},{timestamp.microsecond // 1000:03d}  {_level(rng)} "
+        f"{rng.choice(CLASSES)}:{rng.randint(1, 999)} - SERVER[ip-10-202-31-224.eu-west-2.compute.internal] "
+        f"USER[-] GROUP[-] TOKEN[-] APP[-] JOB[-] ACTION[-] {rng.choice(MESSAGES)}"
+    )
+
+
+def _spark(rng: random.Random, timestamp: datetime) -> str:
+    return f"{timestamp:%y/%m/%d %H:%M:%S} {_level(rng)} {rng.choice(CLASSES)}: {rng.choice(MESSAGES)}"
+
+
+def _livy_request(rng: random.Random, timestamp: datetime) -> str:
+    method, status = rng.choice([("GET", 200), ("GET", 404), ("POST", 201)])
+    return (
+        f"10.202.24.{rng.randint(1, 254)} - - [{timestamp:%d/%b/%Y:%H:%M:%S} +0000] "
+        f'"{method} //dame-classic-emr-master:8998/sessions/{rng.randint(0, 99)} HTTP/1.1" {status} '
+        f"{rng.randint(100, 9999)} "
+    )
+
+
+def _yarn(rng: random.Random, timestamp: datetime) -> str:
+    return (
+        f"{timestamp:%Y-%m-%d %H:%M:%S},{timestamp.microsecond // 1000:03d} {_level(rng)} "
+        f"org.apache.hadoop.yarn.server.resourcemanager.{rng.choice(CLASSES)} "
+        f"({rng.choice(['main', 'IPC Server handler 3 on 8032', 'AsyncDispatcher event handler'])}): "
+        f"{rng.choice(MESSAGES)}"
+    )
+
+
+LOG_TYPES: Dict[str, LogType] = {
+    "oozie": LogType(f"{NODE}/applications/oozie/oozie.log.2020-04-28-05.gz", _oozie),
+    "spark-history": LogType(
+        f"{NODE}/applications/spark/spark-history-server.out.1.gz", _spark
+    ),
+    "livy": LogType(f"{NODE}/applications/livy/livy-livy-server.out.1.gz", _spark),
+    "livy-requests": LogType(
+        f"{NODE}/applications/livy/2020_04_28.request.log.gz", _livy_request
+    ),
+    "yarn-resource-manager": LogType(
+        f"{NODE}/applications/hadoop-yarn/yarn-yarn-resourcemanager-ip-10-202-31-224.log.2020-04-28-05.gz",
+        _yarn,
+    ),
+}
+
+
+def generate_lines(
+    log_type: str, size: int, error_rate: float = 0.0, seed: int = 0
+) -> Iterator[str]:
+    """
+    Generates synthetic log lines of a type, in the format its grok definition in s3_log_shipper/groks/emr expects.
+    The same arguments always generate the same lines.
+    :param log_type: The type of log, one of LOG_TYPES
+    :param size: The number of characters of log to generate, excluding newlines
+    :param error_rate: The fraction of lines which are stack trace lines the grok doesn't match
+    :param seed: Seeds the random choices
+    :return: The log lines, without newlines
+    """
+    line = LOG_TYPES[log_type].line
+    rng = random.Random(seed)
+    timestamp = START
+    generated = 0
+
+    while generated < size:
+        if rng.random() < error_rate:
+            text = rng.choice(STACK_FRAMES)
+        else:
+            timestamp += timedelta(milliseconds=rng.randint(0, 2000))
+            text = line(rng, timestamp)
+
+        generated += len(text)
+        yield text
+
+
+def generate_log(
+    log_type: str, size: int, error_rate: float = 0.0, seed: int = 0
+) -> bytes:
+    """
+    Generates a gzipped synthetic log file, as EMR writes to S3.
+    :return: The gzipped log file
+    """
+    text = "\n".join(generate_lines(log_type, size, error_rate, seed)) + "\n"
+    return gzip.compress(text.encode("utf-8"))
@@ -0,0 +1,83 @@
+from collections import defaultdict
+from typing import Any, Dict, List, Optional, Tuple
+
+
+class MemoryPipeline:
+    """
+    Queues commands for a `MemoryRedis`, and runs them on execute as a redis pipeline would.
+    """
+
+    def __init__(self, redis: "MemoryRedis") -> None:
+        self.redis: "MemoryRedis" = redis
+        self._commands: List[Tuple[str, tuple, dict]] = []
+
+    def __getattr__(self, name: str):
+        command = getattr(self.redis, name)
+
+        def queue(*args, **kwargs) -> "MemoryPipeline":
+            self._commands.append((command.__name__, args, kwargs))
+            return self
+
+        return queue
+
+    def execute(self, raise_on_error: bool = True) -> List[Any]:
+        commands = self._commands
+        self._commands = []
+        return [
+            getattr(self.redis, name)(*args, **kwargs)
+            for name, args, kwargs in commands
+        ]
+
+
+class MemoryRedis:
+    """
+    Stands in for the redis client used by the shipper, keeping everything in memory, so benchmarks measure the
+    shipper rather than the network. Values are kept as they are given, with no expiry.
+    """
+
+    def __init__(self) -> None:
+        self.lists: Dict[str, List[Any]] = defaultdict(list)
+        self.values: Dict[str, Any] = {}
+        self.pushed_bytes: int = 0
+
+    def pipeline(self, transaction: bool = True) -> MemoryPipeline:
+        return MemoryPipeline(self)
+
+    def rpush(self, name: str, *values: Any) -> int:
+        pushed = self.lists[name]
+        pushed.extend(values)
+        self.pushed_bytes += sum(len(value) for value in values)
+        return len(pushed)
+
+    def llen(self, name: str) -> int:
+        return len(self.lists.get(name, ()))
+
+    def info(self, section: Optional[str] = None) -> dict:
+        return {"used_memory": self.pushed_bytes}
+
+    def get(self, name: str) -> Any:
+        return self.values.get(name)
+
+    def set(
+        self,
+        name: str,
+        value: Any,
+        ex: Optional[int] = None,
+        nx: bool = False,
+    ) -> Optional[bool]:
+        if nx and name in self.values:
+            return None
+        self.values[name] = value
+        return True
+
+    def delete(self, *names: str) -> int:
+        deleted = 0
+        for name in names:
+            deleted += self.values.pop(name, None) is not None
+            deleted += self.lists.pop(name, None) is not None
+        return deleted
+
+    def clear(self) -> None:
+        self.lists.clear()
+        self.values.clear()
+        self.pushed_bytes = 0
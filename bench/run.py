@@ -0,0 +1,316 @@
+"""
+Benchmarks the stages of shipping synthetic EMR logs, end to end against a moto S3 bucket and an in-memory redis.
+
+    python -m bench.run --size-mb 10 --error-rate 0.01 --output bench_output.json
+    python -m bench.run --compare bench_output.json
+
+Throughput is reported for each log type and stage, as lines and MB (of uncompressed log) per second, together with
+the peak RSS of the process while the stage ran.
+"""
+import argparse
+import gc
+import gzip
+import json
+import logging
+import os
+import platform
+import resource
+import subprocess
+import sys
+import time
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple
+
+import boto3
+from moto import mock_s3
+
+from bench.generator import LOG_TYPES, NODE, generate_lines
+from bench.memory_redis import MemoryRedis
+from s3_log_shipper.checkpoints import CheckpointStore
+from s3_log_shipper.parsers import ParserManager
+from s3_log_shipper.shipper import RedisLogShipper
+
+BUCKET = "bench-logs"
+ROOT = Path(__file__).resolve().parent.parent
+DEFAULT_CONFIG_FILE = ROOT / "input_files.json"
+DEFAULT_OUTPUT = "bench_output.json"
+PATH_LOOKUPS = 10000
+
+
+def reset_peak_rss() -> None:
+    """
+    Resets the peak RSS of the process, on Linux, so it can be measured for each stage.
+    """
+    try:
+        with open("/proc/self/clear_refs", "w") as clear_refs:
+            clear_refs.write("5")
+    except OSError:
+        pass
+
+
+def peak_rss_mb() -> float:
+    """
+    :return: The peak RSS of the process since it was last reset, or since it started where it can't be reset
+    """
+    try:
+        with open("/proc/self/status") as status:
+            for line in status:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+
+    # ru_maxrss is in kilobytes on Linux, and bytes on macOS
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return max_rss / (1024 * 1024) if sys.platform == "darwin" else max_rss / 1024
+
+
+def measure(
+    log_type: str,
+    stage: str,
+    run: Callable[[], None],
+    lines: int,
+    size: int,
+    repeat: int,
+) -> dict:
+    """
+    Times the best of `repeat` runs of a stage.
+    :param log_type: The type of log the stage ran over
+    :param stage: The name of the stage
+    :param run: Runs the stage once
+    :param lines: The number of lines the stage processes in each run
+    :param size: The number of bytes the stage processes in each run
+    :param repeat: The number of times to run the stage
+    :return: The stage's result
+    """
+    gc.collect()
+    reset_peak_rss()
+
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        run()
+        best = min(best, time.perf_counter() - start)
+
+    return {
+        "type": log_type,
+        "stage": stage,
+        "lines": lines,
+        "bytes": size,
+        "seconds": round(best, 6),
+        "lines_per_sec": round(lines / best, 1),
+        "mb_per_sec": round(size / best / (1024 * 1024), 3),
+        "peak_rss_mb": round(peak_rss_mb(), 1),
+    }
+
+
+def bench_type(
+    log_type: str,
+    parser_manager: ParserManager,
+    s3_client,
+    size: int,
+    error_rate: float,
+    seed: int,
+    repeat: int,
+) -> List[dict]:
+    """
+    Benchmarks each stage over a single synthetic log file of a type.
+    :return: The result of each stage
+    """
+    key = LOG_TYPES[log_type].key
+    lines = list(generate_lines(log_type, size, error_rate, seed))
+    text = "\n".join(lines) + "\n"
+    body = text.encode("utf-8")
+    s3_client.put_object(Bucket=BUCKET, Key=key, Body=gzip.compress(body))
+
+    path = f"{BUCKET}/{key}"
+    maybe_parser = parser_manager.get_parser(path)
+    if maybe_parser is None:
+        raise ValueError(f"No parser matches the generated {log_type} log {path}")
+    parser, _ = maybe_parser
+
+    # Spread the lookups over many nodes, as a day of EMR logs would be
+    paths = [
+        path.replace(NODE, f"{NODE[:-6]}{n % 1000:06d}") for n in range(PATH_LOOKUPS)
+    ]
+
+    def match_paths() -> None:
+        for p in paths:
+            parser_manager.get_parser(p)
+
+    def parse_log() -> None:
+        for line in lines:
+            parser.parse_log(line)
+
+    def parse_many() -> None:
+        for _ in parser.parse_many(text):
+            pass
+
+    redis = MemoryRedis()
+    shipper = RedisLogShipper(
+        redis, parser_manager, s3_client, checkpoints=CheckpointStore(redis)
+    )
+
+    def ship() -> None:
+        redis.clear()
+        shipper.ship(BUCKET, key, "bench")
+
+    path_bytes = sum(len(p) for p in paths)
+    return [
+        measure(log_type, "match_path", match_paths, len(paths), path_bytes, repeat),
+        measure(log_type, "parse_log", parse_log, len(lines), len(body), repeat),
+        measure(log_type, "parse_many", parse_many, len(lines), len(body), repeat),
+        measure(log_type, "ship", ship, len(lines), len(body), repeat),
+    ]
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return (
+            subprocess.check_output(
+                ["git", "rev-parse", "HEAD"], cwd=ROOT, stderr=subprocess.DEVNULL
+            )
+            .decode()
+            .strip()
+        )
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(args: argparse.Namespace) -> dict:
+    # moto only needs credentials to be present
+    os.environ.setdefault("AWS_ACCESS_KEY_ID", "bench")
+    os.environ.setdefault("AWS_SECRET_ACCESS_KEY", "bench")
+    os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+
+    results: List[dict] = []
+    with mock_s3():
+        s3_client = boto3.client("s3", region_name="us-east-1")
+        s3_client.create_bucket(Bucket=BUCKET)
+
+        for log_type in args.types:
+            parser_manager = ParserManager(config_file=Path(args.config))
+            results += bench_type(
+                log_type,
+                parser_manager,
+                s3_client,
+                int(args.size_mb * 1024 * 1024),
+                args.error_rate,
+                args.seed,
+                args.repeat,
+            )
+
+    return {
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "size_mb": args.size_mb,
+        "error_rate": args.error_rate,
+        "seed": args.seed,
+        "repeat": args.repeat,
+        "results": results,
+    }
+
+
+def compare(baseline: dict, current: dict, tolerance: float) -> List[str]:
+    """
+    Prints the change in throughput of each stage against a baseline run.
+    :param baseline: The results of the baseline run
+    :param current: The results of this run
+    :param tolerance: The fraction of throughput a stage may lose before it counts as a regression
+    :return: The stages which regressed
+    """
+    before: Dict[Tuple[str, str], dict] = {
+        (result["type"], result["stage"]): result for result in baseline["results"]
+    }
+
+    regressions: List[str] = []
+    for result in current["results"]:
+        name = f"{result['type']}/{result['stage']}"
+        old = before.get((result["type"], result["stage"]))
+        if old is None:
+            print(f"{name:40} {result['lines_per_sec']:>14,.0f} lines/s (new)")
+            continue
+
+        ratio = result["lines_per_sec"] / old["lines_per_sec"]
+        rss = result["peak_rss_mb"] - old["peak_rss_mb"]
+        print(
+            f"{name:40} {result['lines_per_sec']:>14,.0f} lines/s {ratio:>7.2f}x {rss:>+8.1f}MB peak RSS"
+        )
+        if ratio < 1 - tolerance:
+            regressions.append(name)
+
+    return regressions
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(
+        description="Benchmark shipping synthetic EMR logs"
+    )
+    parser.add_argument(
+        "--size-mb",
+        type=float,
+        default=5,
+        help="The size of each uncompressed log file",
+    )
+    parser.add_argument(
+        "--error-rate",
+        type=float,
+        default=0.01,
+        help="The fraction of lines the groks don't match",
+    )
+    parser.add_argument(
+        "--types",
+        nargs="+",
+        choices=sorted(LOG_TYPES),
+        default=sorted(LOG_TYPES),
+        help="The log types to benchmark",
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--repeat", type=int, default=3, help="Report the best of this many runs"
+    )
+    parser.add_argument("--config", default=str(DEFAULT_CONFIG_FILE))
+    parser.add_argument("--output", default=DEFAULT_OUTPUT)
+    parser.add_argument(
+        "--compare", help="A previous output file to compare throughput against"
+    )
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.1,
+        help="The fraction of throughput a stage may lose against the baseline before failing",
+    )
+    args = parser.parse_args(argv)
+
+    # Every unmatched line is logged as an error, which would swamp the output
+    logging.getLogger("s3_log_shipper").setLevel(logging.CRITICAL)
+
+    # The baseline is read first, as it may be the file this run is written to
+    baseline: Optional[dict] = None
+    if args.compare:
+        with open(args.compare) as baseline_file:
+            baseline = json.load(baseline_file)
+
+    report = run(args)
+
+    with open(args.output, "w") as output:
+        json.dump(report, output, indent=2)
+
+    if baseline is not None:
+        regressions = compare(baseline, report, args.tolerance)
+        if regressions:
+            print(f"Throughput regressed for {', '.join(regressions)}")
+            return 1
+    else:
+        for result in report["results"]:
+            print(
+                f"{result['type'] + '/' + result['stage']:40} {result['lines_per_sec']:>14,.0f} lines/s "
+                f"{result['mb_per_sec']:>9.2f} MB/s {result['peak_rss_mb']:>8.1f}MB peak RSS"
+            )
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,20 +1,88 @@
+import json
 import logging
+import math
 import os
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from functools import lru_cache
 from pathlib import Path
+from typing import List, Tuple, Callable, Optional, Union
 
 import aws_lambda_logging
 import boto3
 import redis
 
+from s3_log_shipper.backpressure import (
+    FlowControl,
+    SpillStore,
+    DEFAULT_MAX_WAIT_MS,
+    DEFAULT_SPILL_PREFIX,
+)
+from s3_log_shipper.bundle import bundle_file_for
+from s3_log_shipper.checkpoints import CheckpointStore, DEFAULT_CHECKPOINT_TTL
+from s3_log_shipper.dedupe import (
+    DuplicateFilter,
+    DEFAULT_DEDUPE_TTL,
+    DEFAULT_DEDUPE_CACHE_SIZE,
+)
+from s3_log_shipper.metrics import (
+    EmfFormatter,
+    ShipMetrics,
+    DEFAULT_SAMPLE_EVERY,
+    metrics_log,
+    process_uptime,
+)
+from s3_log_shipper.parallel import (
+    ParsePool,
+    DEFAULT_PARALLEL_MIN_BYTES,
+    default_workers,
+)
 from s3_log_shipper.parsers import ParserManager
-from s3_log_shipper.s3_event_models import S3Event
-from s3_log_shipper.shipper import RedisLogShipper
+from s3_log_shipper.pipeline import DEFAULT_READ_AHEAD
+from s3_log_shipper.s3_event_models import (
+    ObjectRecord,
+    is_sqs_event,
+    message_object_records,
+    object_records,
+)
+from s3_log_shipper.serialisers import make_serialiser
+from s3_log_shipper.sharding import RedisShards, ROUND_ROBIN, parse_endpoints
+from s3_log_shipper.shipper import (
+    RedisLogShipper,
+    DEFAULT_BATCH_SIZE,
+    DEFAULT_BATCH_BYTES,
+    DEFAULT_STREAM_MAXLEN,
+)
+from s3_log_shipper.unmatched import (
+    DeadLetterStore,
+    DEFAULT_DEAD_LETTER_PREFIX,
+    DEFAULT_SAMPLE_SIZE,
+)
 
 log: logging.Logger = logging.getLogger(__name__)
 
+DEFAULT_SHIP_CONCURRENCY = 4
+DEFAULT_DEADLINE_MARGIN_MS = 10000
+DEFAULT_INIT_BUDGET_MS = 1000
+
+
+class RecordsFailedError(Exception):
+    """
+    Raised once all records in an event have been attempted, when one or more of them failed to ship.
+    """
+
+    def __init__(self, failures: List[Tuple[str, Exception]]) -> None:
+        summary = "; ".join(f"{path}: {error!r}" for path, error in failures)
+        super().__init__(f"Failed to ship {len(failures)} record(s): {summary}")
+        self.failures: List[Tuple[str, Exception]] = failures
+
 
+@lru_cache(maxsize=None)
 def get_parser_manager() -> ParserManager:
-    return ParserManager(config_file=get_config_file())
+    config_file = get_config_file()
+    return ParserManager(
+        config_file=config_file, bundle_file=get_bundle_file(config_file)
+    )
 
 
 def get_config_file() -> Path:
@@ -28,6 +96,16 @@ def get_config_file() -> Path:
     return file
 
 
+def get_bundle_file(config_file: Path) -> Optional[Path]:
+    path = os.environ.get("PATTERN_BUNDLE")
+    if path is not None:
+        return Path(path)
+
+    # Packaged beside the config by `make package`, but not built for local runs
+    default = bundle_file_for(config_file)
+    return default if default.is_file() else None
+
+
 def get_output_redis_host_from_environment():
     try:
         return os.environ["REDIS_HOST"]
@@ -42,24 +120,454 @@ def get_output_redis_port_from_environment():
         raise Exception("env variable is not found: {}".format(e))
 
 
-S3_CLIENT = boto3.client("s3")
-PARSER_MANAGER = get_parser_manager()
-REDIS = redis.StrictRedis(
-    host=get_output_redis_host_from_environment(),
-    port=int(get_output_redis_port_from_environment()),
-    db=0,
+def get_int_from_environment(name: str, default: int) -> int:
+    value = os.environ.get(name)
+    if value is None:
+        return default
+    try:
+        return int(value)
+    except ValueError:
+        raise Exception(f"env variable {name} must be an integer. Found: {value}")
+
+
+def get_flow_control(
+    redis_endpoint: Union[redis.StrictRedis, List[redis.StrictRedis]]
+) -> Optional[FlowControl]:
+    soft_limit = get_int_from_environment("BACKPRESSURE_SOFT_LIMIT", 0)
+    hard_limit = get_int_from_environment("BACKPRESSURE_HARD_LIMIT", 0)
+    if not soft_limit and not hard_limit:
+        return None
+    return FlowControl(
+        redis_endpoint,
+        soft_limit=soft_limit,
+        hard_limit=hard_limit,
+        metric=os.environ.get("BACKPRESSURE_METRIC", "length"),
+        list_key=os.environ.get("REDIS_KEY", "logstash"),
+        max_wait_ms=get_int_from_environment(
+            "BACKPRESSURE_MAX_WAIT_MS", DEFAULT_MAX_WAIT_MS
+        ),
+        stream=os.environ.get("REDIS_OUTPUT", "list") == "stream",
+    )
+
+
+def get_spill_store(s3_client) -> Optional[SpillStore]:
+    bucket = os.environ.get("SPILL_BUCKET")
+    if not bucket:
+        return None
+    return SpillStore(
+        s3_client, bucket, os.environ.get("SPILL_PREFIX", DEFAULT_SPILL_PREFIX)
+    )
+
+
+def get_dead_letter_store(s3_client) -> Optional[DeadLetterStore]:
+    bucket = os.environ.get("DEAD_LETTER_BUCKET")
+    if not bucket:
+        return None
+    return DeadLetterStore(
+        s3_client,
+        bucket,
+        os.environ.get("DEAD_LETTER_PREFIX", DEFAULT_DEAD_LETTER_PREFIX),
+    )
+
+
+def get_bool_from_environment(name: str, default: bool) -> bool:
+    value = os.environ.get(name)
+    if value is None:
+        return default
+    return value.strip().lower() in ("1", "true", "yes")
+
+
+SHIP_CONCURRENCY: int = get_int_from_environment(
+    "SHIP_CONCURRENCY", DEFAULT_SHIP_CONCURRENCY
 )
-SHIPPER: RedisLogShipper = RedisLogShipper(REDIS, PARSER_MANAGER, S3_CLIENT)
+DEADLINE_MARGIN_MS: int = get_int_from_environment(
+    "DEADLINE_MARGIN_MS", DEFAULT_DEADLINE_MARGIN_MS
+)
+EMIT_METRICS: bool = get_bool_from_environment("EMIT_METRICS", True)
+INIT_BUDGET_MS: int = get_int_from_environment("INIT_BUDGET_MS", DEFAULT_INIT_BUDGET_MS)
+
+
+# The clients below are built the first time they are used rather than at import, so a short invocation only pays for
+# what it needs. The S3 client and the redis connection pool are thread safe and shared by all shipping workers.
+@lru_cache(maxsize=None)
+def get_s3_client():
+    return boto3.client("s3")
+
+
+def get_redis_endpoints() -> List[Tuple[str, int]]:
+    endpoints = os.environ.get("REDIS_ENDPOINTS")
+    if endpoints:
+        return parse_endpoints(endpoints)
+    return [
+        (
+            get_output_redis_host_from_environment(),
+            int(get_output_redis_port_from_environment()),
+        )
+    ]
+
+
+# Checkpoints and duplicate claims are kept on the first endpoint, whichever shard the records go to
+@lru_cache(maxsize=None)
+def get_redis() -> redis.StrictRedis:
+    host, port = get_redis_endpoints()[0]
+    return redis.StrictRedis(host=host, port=port, db=0)
+
+
+@lru_cache(maxsize=None)
+def get_shards() -> Optional[RedisShards]:
+    endpoints = get_redis_endpoints()
+    if len(endpoints) < 2:
+        return None
+
+    shard_by = os.environ.get("REDIS_SHARD_BY", ROUND_ROBIN)
+    return RedisShards(
+        [get_redis()]
+        + [
+            redis.StrictRedis(host=host, port=port, db=0)
+            for host, port in endpoints[1:]
+        ],
+        [f"{host}:{port}" for host, port in endpoints],
+        shard_by=None
+        if shard_by == ROUND_ROBIN
+        else [field.strip() for field in shard_by.split(",")],
+    )
+
+
+@lru_cache(maxsize=None)
+def get_parse_pool() -> Optional[ParsePool]:
+    """
+    Forks the parse workers, which must happen while no other threads are running.
+    :return: The parse pool, or None with fewer than 2 workers
+    """
+    workers = get_int_from_environment("PARSE_WORKERS", default_workers())
+    if workers < 2:
+        return None
+
+    return ParsePool(
+        get_parser_manager(),
+        get_shipper().serialiser,
+        workers,
+        get_int_from_environment("METRICS_SAMPLE_EVERY", DEFAULT_SAMPLE_EVERY),
+    )
+
+
+@lru_cache(maxsize=None)
+def get_shipper() -> RedisLogShipper:
+    shards = get_shards()
+    serialiser = make_serialiser(
+        os.environ.get("SERIALISER", "json"),
+        sort_keys=get_bool_from_environment("SORT_KEYS", False),
+        as_bytes=get_bool_from_environment("SERIALISE_TO_BYTES", False),
+    )
+    return RedisLogShipper(
+        get_redis(),
+        get_parser_manager(),
+        get_s3_client(),
+        batch_size=get_int_from_environment("REDIS_BATCH_SIZE", DEFAULT_BATCH_SIZE),
+        batch_bytes=get_int_from_environment("REDIS_BATCH_BYTES", DEFAULT_BATCH_BYTES),
+        serialiser=serialiser,
+        checkpoints=CheckpointStore(
+            get_redis(),
+            ttl=get_int_from_environment("CHECKPOINT_TTL", DEFAULT_CHECKPOINT_TTL),
+        ),
+        flow_control=get_flow_control(shards.clients if shards else get_redis()),
+        spills=get_spill_store(get_s3_client()),
+        emit_metrics=EMIT_METRICS,
+        metrics_sample_every=get_int_from_environment(
+            "METRICS_SAMPLE_EVERY", DEFAULT_SAMPLE_EVERY
+        ),
+        output=os.environ.get("REDIS_OUTPUT", "list"),
+        output_key=os.environ.get("REDIS_KEY", "logstash"),
+        stream_maxlen=get_int_from_environment(
+            "REDIS_STREAM_MAXLEN", DEFAULT_STREAM_MAXLEN
+        ),
+        shards=shards,
+        dead_letters=get_dead_letter_store(get_s3_client()),
+        unmatched_sample=get_int_from_environment(
+            "UNMATCHED_SAMPLE", DEFAULT_SAMPLE_SIZE
+        ),
+        read_ahead=get_int_from_environment("READ_AHEAD", DEFAULT_READ_AHEAD),
+        range_size=get_int_from_environment("RANGE_GET_BYTES", 0),
+        parallel_min_bytes=get_int_from_environment(
+            "PARALLEL_PARSE_BYTES", DEFAULT_PARALLEL_MIN_BYTES
+        ),
+    )
+
+
+@lru_cache(maxsize=None)
+def get_duplicate_filter() -> DuplicateFilter:
+    return DuplicateFilter(
+        get_redis(),
+        ttl=get_int_from_environment("DEDUPE_TTL", DEFAULT_DEDUPE_TTL),
+        cache_size=get_int_from_environment(
+            "DEDUPE_CACHE_SIZE", DEFAULT_DEDUPE_CACHE_SIZE
+        ),
+    )
+
 
+def report_init(lazy_init_seconds: float) -> None:
+    """
+    Reports how long the lambda took to start, on its first invocation.
+    :param lazy_init_seconds: How long the first invocation spent building the clients it needed
+    """
+    metrics = ShipMetrics()
+    if INIT_SECONDS is not None:
+        metrics.add_time("init", INIT_SECONDS)
+    metrics.add_time("lazy_init", lazy_init_seconds)
+    metrics.count("cold_start")
 
-def log_handler(event: dict, context) -> None:
-    aws_lambda_logging.setup(level="INFO")
+    total_ms = ((INIT_SECONDS or 0.0) + lazy_init_seconds) * 1000
+    if INIT_BUDGET_MS and total_ms > INIT_BUDGET_MS:
+        log.warning(
+            f"Took {total_ms:.0f}ms to start, over the budget of {INIT_BUDGET_MS}ms"
+        )
+
+    if EMIT_METRICS:
+        metrics_log.info(metrics.emf({}))
+
+
+def log_handler(event: dict, context) -> Optional[dict]:
+    # Metrics are logged in CloudWatch embedded metric format, which must be the whole of the log line
+    aws_lambda_logging.setup(level="INFO", formatter_cls=EmfFormatter)
     log.info(event)
-    s3_event: S3Event = S3Event.from_dict(event)
 
-    for record in s3_event.records:
-        bucket = record.s3.bucket.name
-        key = record.s3.object.key
+    global cold_start
+    if cold_start:
+        cold_start = False
+        started = time.perf_counter()
+        get_shipper()
+        get_duplicate_filter()
+        report_init(time.perf_counter() - started)
+
+    if is_sqs_event(event):
+        return ship_sqs_messages(event, context)
+
+    ship_s3_event(event, context)
+    return None
+
+
+def deadline(context) -> Callable[[], bool]:
+    def should_stop() -> bool:
+        return context.get_remaining_time_in_millis() < DEADLINE_MARGIN_MS
+
+    return should_stop
+
+
+def claim(records: List[ObjectRecord], context) -> List[int]:
+    """
+    Claims the objects of an event's records for shipping, skipping those already shipped or being shipped.
+    Each claim lasts as long as this invocation could still be shipping the object, so it expires if the invocation
+    times out or is killed part way.
+    :return: The indexes of the records claimed
+    """
+    duplicate_filter = get_duplicate_filter()
+    ttl = math.ceil(context.get_remaining_time_in_millis() / 1000)
+    claimed = [
+        i
+        for i, record in enumerate(records)
+        if duplicate_filter.claim(
+            record.bucket, record.key, record.e_tag, record.sequencer, ttl
+        )
+    ]
+
+    skipped = len(records) - len(claimed)
+    if skipped:
+        log.info(
+            f"Skipped {skipped} duplicate record(s), {duplicate_filter.skipped} since start up"
+        )
+    return claimed
+
+
+def settle(
+    objects: List[Tuple[str, str, Optional[str]]],
+    incomplete: List[int],
+    failures: List[Tuple[int, Exception]],
+) -> None:
+    """
+    Remembers the objects shipped in full, so later notifications for them are skipped, and releases the claims on
+    the rest, so a retry or continuation of the event ships them.
+    """
+    duplicate_filter = get_duplicate_filter()
+    unfinished = set(incomplete).union(i for i, _ in failures)
+    for i, obj in enumerate(objects):
+        if i in unfinished:
+            duplicate_filter.release(*obj)
+        else:
+            duplicate_filter.shipped(*obj)
+
+
+def ship_claimed(
+    objects: List[Tuple[str, str, Optional[str]]], sizes: List[int], context
+) -> Tuple[List[int], List[Tuple[int, Exception]]]:
+    """
+    Ships claimed objects, and settles their claims before anything else can fail.
+    :return: The indexes of the objects that were only partly shipped, and the index and error of each object that
+    failed to ship
+    """
+    try:
+        incomplete, failures = ship_all(objects, deadline(context), sizes)
+    except BaseException:
+        # None of the objects are known to be shipped
+        for obj in objects:
+            get_duplicate_filter().release(*obj)
+        raise
+
+    settle(objects, incomplete, failures)
+    return incomplete, failures
+
+
+def ship_s3_event(event: dict, context) -> None:
+    event_records = object_records(event)
+    # A continuation claims its records like any other event, as a retry of the event it continues may be shipping
+    # them too
+    records = claim(event_records, context)
+
+    objects = [
+        (event_records[i].bucket, event_records[i].key, event_records[i].e_tag)
+        for i in records
+    ]
+
+    # The claims on incomplete objects are released before the continuation is sent, so if sending it fails, a
+    # retry of the event ships them from their checkpoints
+    incomplete, failures = ship_claimed(
+        objects, [event_records[i].size for i in records], context
+    )
+
+    if incomplete:
+        continue_in_new_invocation(
+            context,
+            {"Records": [event["Records"][records[i]] for i in incomplete]},
+        )
+
+    if failures:
+        # Let a retry of the event ship the objects that failed
+        raise RecordsFailedError(
+            [(f"{objects[i][0]}/{objects[i][1]}", e) for i, e in failures]
+        )
+
+
+def ship_sqs_messages(event: dict, context) -> dict:
+    """
+    Ships the objects of the S3 events in a batch of SQS messages, sent by S3 directly or through SNS.
+    Objects which fail to ship, or are only partly shipped before the lambda runs out of time, are released so SQS
+    redelivers their messages, and shipping resumes from the objects' checkpoints.
+    :return: The messages to retry, as a partial batch response
+    """
+    failed_messages: List[str] = []
+    event_records: List[ObjectRecord] = []
+    message_ids: List[str] = []
+
+    for message in event["Records"]:
+        try:
+            records = message_object_records(message)
+        except (KeyError, ValueError):
+            log.exception(
+                f"Failed to read S3 event from message {message.get('messageId')}"
+            )
+            failed_messages.append(message["messageId"])
+            continue
+
+        event_records += records
+        message_ids += [message["messageId"]] * len(records)
+
+    records = claim(event_records, context)
+    objects = [
+        (event_records[i].bucket, event_records[i].key, event_records[i].e_tag)
+        for i in records
+    ]
+
+    incomplete, failures = ship_claimed(
+        objects, [event_records[i].size for i in records], context
+    )
+
+    retried = sorted(incomplete + [i for i, _ in failures])
+    for i in retried:
+        failed_messages.append(message_ids[records[i]])
+
+    if incomplete:
+        log.info(f"Out of time, retrying {len(incomplete)} record(s) from SQS")
+    if failures:
+        log.error(
+            f"Failed to ship {len(failures)} record(s): "
+            + "; ".join(f"{objects[i][0]}/{objects[i][1]}: {e!r}" for i, e in failures)
+        )
+
+    return {
+        "batchItemFailures": [
+            {"itemIdentifier": message_id}
+            for message_id in dict.fromkeys(failed_messages)
+        ]
+    }
+
+
+def ship_all(
+    objects: List[Tuple[str, str, Optional[str]]],
+    should_stop: Optional[Callable[[], bool]] = None,
+    sizes: Optional[List[int]] = None,
+) -> Tuple[List[int], List[Tuple[int, Exception]]]:
+    """
+    Ships each object concurrently on a bounded pool of worker threads.
+    :param objects: The bucket, key and eTag of each object to ship
+    :param should_stop: Checked by each worker as it ships; once it returns True, workers checkpoint and stop
+    :param sizes: The size of each object, which decides whether it is parsed in parallel
+    :return: The indexes of the objects that were only partly shipped, and the index and error of each object that
+    failed to ship
+    """
+    incomplete: List[int] = []
+    failures: List[Tuple[int, Exception]] = []
+
+    shipper = get_shipper()
+    if (
+        shipper.parse_pool is None
+        and sizes
+        and max(sizes) >= shipper.parallel_min_bytes
+    ):
+        # Only started once an object is large enough to need it, before the shipping threads are started
+        shipper.parse_pool = get_parse_pool()
+
+    workers = max(1, min(SHIP_CONCURRENCY, len(objects)))
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = {}
+        for i, (bucket, key, e_tag) in enumerate(objects):
+            log.info(f"Processing {bucket}/{key}")
+            future = pool.submit(
+                shipper.ship,
+                bucket,
+                key,
+                e_tag,
+                should_stop,
+                size=sizes[i] if sizes else None,
+            )
+            futures[future] = i
+
+        for future in as_completed(futures):
+            i = futures[future]
+            bucket, key, _ = objects[i]
+            try:
+                if not future.result().complete:
+                    incomplete.append(i)
+            except Exception as e:
+                log.exception(f"Failed to ship {bucket}/{key}")
+                failures.append((i, e))
+
+    return sorted(incomplete), sorted(failures, key=lambda failure: failure[0])
+
+
+def continue_in_new_invocation(context, event: dict) -> None:
+    """
+    Asynchronously invokes this lambda again to finish shipping the records in the event from their checkpoints.
+    """
+    log.info(
+        f"Out of time, continuing {len(event['Records'])} record(s) in a new invocation"
+    )
+    boto3.client("lambda").invoke(
+        FunctionName=context.invoked_function_arn,
+        InvocationType="Event",
+        Payload=json.dumps(event).encode("utf-8"),
+    )
+
+
+cold_start = True
 
-        log.info(f"Processing {bucket}/{key}")
-        SHIPPER.ship(bucket, key)
+# How long the lambda's init phase took, from the start of its process to the end of importing this module
+INIT_SECONDS: Optional[float] = process_uptime()
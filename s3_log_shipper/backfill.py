@@ -0,0 +1,630 @@
+"""
+Ships the logs under an S3 prefix, or in a local directory, to redis in bulk, such as to replay them after an outage
+of elasticache or logstash.
+
+    python -m s3_log_shipper.backfill s3://bucket/emr-logs/ --manifest backfill.jsonl --rate 50000
+    python -m s3_log_shipper.backfill /data/emr-logs --bucket bucket --manifest backfill.jsonl
+"""
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import queue
+import signal
+import sys
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from dataclasses import dataclass
+from multiprocessing.context import BaseContext
+from pathlib import Path
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+import boto3
+import redis
+from botocore.client import BaseClient
+
+from s3_log_shipper.backpressure import FlowControl, RateLimiter
+from s3_log_shipper.bundle import bundle_file_for
+from s3_log_shipper.checkpoints import CheckpointStore
+from s3_log_shipper.parallel import ParsePool, DEFAULT_PARALLEL_MIN_BYTES
+from s3_log_shipper.parsers import ParserManager
+from s3_log_shipper.serialisers import make_serialiser
+from s3_log_shipper.shipper import RedisLogShipper, ShipResult
+
+log: logging.Logger = logging.getLogger(__name__)
+
+DEFAULT_CONCURRENCY = 8
+
+# Left on the idle queue of the ship workers once they have all died
+_NO_WORKERS = -1
+
+# How often progress is logged
+PROGRESS_SECONDS = 30
+
+
+@dataclass(frozen=True)
+class SourceObject:
+    """
+    An S3 object, or a local file standing in for one, to be shipped.
+    """
+
+    bucket: str
+    key: str
+    e_tag: str
+    size: int
+
+
+def list_s3(
+    s3_client: BaseClient, bucket: str, prefix: str = ""
+) -> Iterator[SourceObject]:
+    """
+    :param s3_client: The S3 client to list with
+    :param bucket: The bucket to list
+    :param prefix: The prefix of the keys to list
+    :return: Every object under the prefix, in key order
+    """
+    paginator = s3_client.get_paginator("list_objects_v2")
+    for page in paginator.paginate(Bucket=bucket, Prefix=prefix):
+        for obj in page.get("Contents", []):
+            yield SourceObject(bucket, obj["Key"], obj["ETag"].strip('"'), obj["Size"])
+
+
+class LocalObjects:
+    """
+    Stands in for the S3 client of the shipper, serving the files under a directory as the objects of a bucket, so
+    logs copied out of S3 can be shipped as if they were still there. Keys are the paths of the files relative to the
+    directory, which the parsers' path groks match after the bucket name.
+    """
+
+    def __init__(self, root: Path, bucket: str) -> None:
+        """
+        :param root: The directory to serve
+        :param bucket: The bucket the files were copied from
+        """
+        self.root: Path = root
+        self.bucket: str = bucket
+
+    def list(self, prefix: str = "") -> Iterator[SourceObject]:
+        """
+        :param prefix: The prefix of the keys to list
+        :return: Every file under the directory, in key order. The eTag of each is made from its size and modified
+        time, so a file which changes is shipped again.
+        """
+        for directory, directories, files in os.walk(self.root):
+            directories.sort()
+            for name in sorted(files):
+                path = Path(directory) / name
+                key = path.relative_to(self.root).as_posix()
+                if not key.startswith(prefix):
+                    continue
+                stat = path.stat()
+                yield SourceObject(
+                    self.bucket,
+                    key,
+                    f"{stat.st_size:x}-{stat.st_mtime_ns:x}",
+                    stat.st_size,
+                )
+
+    def get_object(self, Bucket: str, Key: str) -> dict:
+        if Bucket != self.bucket:
+            raise ValueError(
+                f"Expected objects of bucket {self.bucket}. Found: {Bucket}"
+            )
+        # Closed by the shipper once read
+        return {"Body": open(self.root / Key, "rb")}
+
+
+class Manifest:
+    """
+    Records each object shipped in full as a line of JSON, so a backfill which is stopped, or fails part way, can be
+    run again and skip the objects already shipped. Objects only partly shipped resume from their checkpoints.
+    """
+
+    def __init__(self, path: Path) -> None:
+        """
+        :param path: The manifest file, which is created if it doesn't exist, and appended to if it does
+        """
+        self.path: Path = path
+        self._shipped: Set[Tuple[str, str, str]] = set()
+        self._lock = threading.Lock()
+
+        if path.exists():
+            with open(path, "rt", encoding="utf-8") as manifest:
+                for line in manifest:
+                    if not line.strip():
+                        continue
+                    entry = json.loads(line)
+                    self._shipped.add((entry["bucket"], entry["key"], entry["eTag"]))
+
+        self._file = open(path, "at", encoding="utf-8")
+
+    def __len__(self) -> int:
+        return len(self._shipped)
+
+    def shipped(self, obj: SourceObject) -> bool:
+        return (obj.bucket, obj.key, obj.e_tag) in self._shipped
+
+    def record(self, obj: SourceObject, result: ShipResult) -> None:
+        entry = {
+            "bucket": obj.bucket,
+            "key": obj.key,
+            "eTag": obj.e_tag,
+            "lines": result.lines,
+            "written": result.written,
+            "spilled": result.spilled,
+        }
+        with self._lock:
+            self._shipped.add((obj.bucket, obj.key, obj.e_tag))
+            # Flushed after every object, so it survives the backfill being killed
+            self._file.write(json.dumps(entry) + "\n")
+            self._file.flush()
+
+    def close(self) -> None:
+        self._file.close()
+
+
+def _ship_objects(connection, shipper: RedisLogShipper, stopping) -> None:
+    # Interrupting the backfill interrupts every process in its group. The parent stops the workers instead, once
+    # the objects they are shipping are checkpointed.
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+    while True:
+        try:
+            message = connection.recv()
+        except EOFError:
+            return
+        if message is None:
+            return
+
+        bucket, key, e_tag, size = message
+        try:
+            result = shipper.ship(bucket, key, e_tag, stopping.is_set, size=size)
+        except Exception as e:
+            # Not every exception can be pickled back
+            connection.send(RuntimeError(f"Failed to ship {bucket}/{key}: {e!r}"))
+            continue
+        connection.send(result)
+
+
+class ShipWorkers:
+    """
+    Worker processes which each ship one object at a time with a copy of the shipper, so the many small objects of a
+    backfill are parsed on every CPU rather than on one under the GIL. Each worker is sent objects over a pipe of its
+    own, like the parse pool's.
+    The workers are forked before this process starts any threads or opens any connections, so they hold no locks,
+    and open connections of their own. For the same reason a worker which dies can't be replaced. It is dropped, and
+    only once every worker has died do the objects left fail.
+    """
+
+    def __init__(
+        self, shipper: RedisLogShipper, processes: int, context: BaseContext
+    ) -> None:
+        """
+        :param shipper: Ships the objects. Its parse pool, if any, isn't used by the workers.
+        :param processes: The number of worker processes
+        :param context: A fork context
+        """
+        if processes < 1:
+            raise ValueError(
+                f"Ship workers need at least 1 process. Found: {processes}"
+            )
+
+        self._stopping = context.Event()
+        self._connections: List = []
+        self._processes: List = []
+        self._idle: "queue.Queue[int]" = queue.Queue()
+        self._lock = threading.Lock()
+        self._alive: int = processes
+        for i in range(processes):
+            parent, child = context.Pipe()
+            process = context.Process(
+                target=_ship_objects,
+                args=(child, shipper, self._stopping),
+                name=f"ship-{i}",
+                daemon=True,
+            )
+            process.start()
+            child.close()
+            self._connections.append(parent)
+            self._processes.append(process)
+            self._idle.put(i)
+
+    @property
+    def processes(self) -> int:
+        """
+        :return: The number of workers which haven't died
+        """
+        return self._alive
+
+    def ship(
+        self,
+        bucket: str,
+        key: str,
+        e_tag: Optional[str] = None,
+        should_stop: Optional[Callable[[], bool]] = None,
+        size: Optional[int] = None,
+    ) -> ShipResult:
+        """
+        Ships an object on the next idle worker, waiting for one when they are all busy.
+        :param bucket: The bucket of the object
+        :param key: The key of the object
+        :param e_tag: The eTag of the object
+        :param should_stop: Ignored. The workers stop at their next checkpoint once stopped.
+        :param size: The size of the object
+        :return: The outcome of shipping the object
+        :raises RuntimeError: If the object couldn't be shipped, or the worker died, or every worker had died
+        """
+        worker = self._idle.get()
+        if worker == _NO_WORKERS:
+            # Left for every other object waiting on a worker
+            self._idle.put(worker)
+            raise RuntimeError(f"Every ship worker died before shipping {bucket}/{key}")
+
+        died = False
+        try:
+            self._connections[worker].send((bucket, key, e_tag, size))
+            result = self._connections[worker].recv()
+        except (EOFError, OSError) as e:
+            died = True
+            raise RuntimeError(
+                f"Ship worker {worker} died shipping {bucket}/{key}: {e!r}"
+            ) from e
+        finally:
+            if died:
+                self._drop(worker)
+            else:
+                self._idle.put(worker)
+
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    def _drop(self, worker: int) -> None:
+        self._connections[worker].close()
+        with self._lock:
+            self._alive -= 1
+            alive = self._alive
+            if not alive:
+                self._idle.put(_NO_WORKERS)
+        log.warning(f"Ship worker {worker} died, leaving {alive} to ship the rest")
+
+    def stop(self) -> None:
+        """
+        Stops the objects being shipped at their next checkpoint.
+        """
+        self._stopping.set()
+
+    def close(self) -> None:
+        """
+        Stops the workers, once the objects they are shipping are shipped.
+        """
+        for connection in self._connections:
+            try:
+                connection.send(None)
+            except OSError:
+                pass
+        for process in self._processes:
+            process.join()
+
+
+@dataclass
+class BackfillResult:
+    """
+    The outcome of a backfill.
+    """
+
+    shipped: int = 0
+    written: int = 0
+    lines: int = 0
+    unparsed: int = 0
+    skipped: int = 0
+    incomplete: int = 0
+    failed: int = 0
+
+
+class Backfill:
+    """
+    Ships many objects concurrently, skipping those no parser matches before downloading them, and those the
+    manifest records as shipped already.
+    With ship workers, objects are shipped by the workers, but for those large enough for the shipper's parse pool,
+    which are shipped by this process.
+    """
+
+    def __init__(
+        self,
+        shipper: RedisLogShipper,
+        manifest: Optional[Manifest] = None,
+        concurrency: int = DEFAULT_CONCURRENCY,
+        workers: Optional[ShipWorkers] = None,
+    ) -> None:
+        """
+        :param shipper: Ships each object
+        :param manifest: Where to record the objects shipped, and which to skip, if anywhere
+        :param concurrency: The number of objects shipped at once
+        :param workers: The processes shipping objects, if any, rather than this process' threads
+        """
+        if concurrency < 1:
+            raise ValueError(f"Concurrency must be positive. Found: {concurrency}")
+
+        self.shipper: RedisLogShipper = shipper
+        self.manifest: Optional[Manifest] = manifest
+        self.concurrency: int = concurrency
+        self.workers: Optional[ShipWorkers] = workers
+        self._stopping = threading.Event()
+
+    def stop(self) -> None:
+        """
+        Stops the objects being shipped at their next checkpoint, and starts no more.
+        """
+        self._stopping.set()
+        if self.workers is not None:
+            self.workers.stop()
+
+    def shipper_of(self, obj: SourceObject) -> Callable[..., ShipResult]:
+        """
+        :param obj: An object to ship
+        :return: The ship method of the workers, or of the shipper for an object its parse pool parses
+        """
+        if self.workers is None or (
+            self.shipper.parse_pool is not None
+            and obj.size >= self.shipper.parallel_min_bytes
+        ):
+            return self.shipper.ship
+        return self.workers.ship
+
+    def to_ship(
+        self, objects: Iterable[SourceObject], result: BackfillResult
+    ) -> Iterator[SourceObject]:
+        for obj in objects:
+            if (
+                self.shipper.parser_manager.get_parser(f"{obj.bucket}/{obj.key}")
+                is None
+            ):
+                result.unparsed += 1
+                continue
+            if self.manifest is not None and self.manifest.shipped(obj):
+                result.skipped += 1
+                continue
+            yield obj
+
+    def run(self, objects: Iterable[SourceObject]) -> BackfillResult:
+        """
+        :param objects: The objects to ship, which are listed as they are needed rather than all up front
+        :return: How many objects and lines were shipped
+        :raises KeyboardInterrupt: Once the objects being shipped have stopped, when interrupted
+        """
+        result = BackfillResult()
+        started = time.monotonic()
+        reported = started
+
+        with ThreadPoolExecutor(
+            max_workers=self.concurrency, thread_name_prefix="backfill"
+        ) as pool:
+            pending: Dict[Future, SourceObject] = {}
+            remaining = self.to_ship(objects, result)
+
+            try:
+                while True:
+                    # At most two objects a worker are waiting, however many are listed
+                    while (
+                        len(pending) < self.concurrency * 2
+                        and not self._stopping.is_set()
+                    ):
+                        obj = next(remaining, None)
+                        if obj is None:
+                            break
+                        future = pool.submit(
+                            self.shipper_of(obj),
+                            obj.bucket,
+                            obj.key,
+                            obj.e_tag,
+                            self._stopping.is_set,
+                            size=obj.size,
+                        )
+                        pending[future] = obj
+
+                    if not pending:
+                        break
+
+                    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        self.completed(pending.pop(future), future, result)
+
+                    if time.monotonic() - reported >= PROGRESS_SECONDS:
+                        reported = time.monotonic()
+                        self.report(result, reported - started)
+            except KeyboardInterrupt:
+                # The pool waits for the objects being shipped, which stop at their next block, leaving checkpoints
+                log.warning("Stopping, once the objects being shipped are checkpointed")
+                self.stop()
+                for future in pending:
+                    future.cancel()
+                raise
+
+        self.report(result, time.monotonic() - started)
+        return result
+
+    def completed(
+        self, obj: SourceObject, future: Future, result: BackfillResult
+    ) -> None:
+        try:
+            shipped: ShipResult = future.result()
+        except Exception:
+            log.exception(f"Failed to ship {obj.bucket}/{obj.key}")
+            result.failed += 1
+            return
+
+        result.written += shipped.written
+        result.lines += shipped.lines
+        if not shipped.complete:
+            result.incomplete += 1
+            return
+
+        result.shipped += 1
+        if self.manifest is not None:
+            self.manifest.record(obj, shipped)
+
+    @staticmethod
+    def report(result: BackfillResult, seconds: float) -> None:
+        log.info(
+            f"Shipped {result.shipped} objects, writing {result.written} lines "
+            f"({result.written / max(seconds, 0.001):.0f}/s), in {seconds:.0f}s. Skipped {result.skipped} shipped "
+            f"before and {result.unparsed} without a parser. {result.incomplete} stopped part way, "
+            f"{result.failed} failed."
+        )
+
+
+def parse_source(source: str) -> Tuple[Optional[str], str]:
+    """
+    :param source: An S3 URL or a local directory
+    :return: The bucket and prefix of an S3 URL, or None and the directory
+    """
+    if source.startswith("s3://"):
+        bucket, _, prefix = source.replace("s3://", "", 1).partition("/")
+        return bucket, prefix
+    return None, source
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(
+        description="Ship the logs under an S3 prefix, or in a local directory, to redis"
+    )
+    parser.add_argument(
+        "source", help="An S3 prefix, as s3://bucket/prefix, or a local directory"
+    )
+    parser.add_argument(
+        "--bucket",
+        help="The bucket a local directory was copied from, which path groks match. Defaults to the directory's name.",
+    )
+    parser.add_argument(
+        "--config", default="input_files.json", help="The parser config file"
+    )
+    parser.add_argument(
+        "--manifest", help="Records the objects shipped, and skips them when run again"
+    )
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        default=os.cpu_count() or 1,
+        help="The number of objects shipped at once, each by a process of its own. Defaults to the number of CPUs.",
+    )
+    parser.add_argument(
+        "--rate",
+        type=float,
+        default=0,
+        help="The most records written to redis per second, across all objects",
+    )
+    parser.add_argument(
+        "--soft-limit",
+        type=int,
+        default=0,
+        help="Backs off while the redis list or stream is longer than this, as BACKPRESSURE_SOFT_LIMIT",
+    )
+    parser.add_argument(
+        "--redis-host", default=os.environ.get("REDIS_HOST", "localhost")
+    )
+    parser.add_argument(
+        "--redis-port", type=int, default=int(os.environ.get("REDIS_PORT", "6379"))
+    )
+    parser.add_argument("--redis-key", default=os.environ.get("REDIS_KEY", "logstash"))
+    parser.add_argument(
+        "--output",
+        default=os.environ.get("REDIS_OUTPUT", "list"),
+        help="list or stream",
+    )
+    parser.add_argument("--serialiser", default=os.environ.get("SERIALISER", "json"))
+    parser.add_argument(
+        "--parse-workers",
+        type=int,
+        default=os.cpu_count() or 1,
+        help="How many processes parse large objects, one object at a time, as well as the objects shipped at once. "
+        "Fewer than 2 turns them off. Defaults to the number of CPUs.",
+    )
+    parser.add_argument(
+        "--parallel-parse-bytes",
+        type=int,
+        default=DEFAULT_PARALLEL_MIN_BYTES,
+        help="Objects of at least this many bytes are parsed by the parse workers",
+    )
+    args = parser.parse_args(argv)
+
+    bucket, prefix = parse_source(args.source)
+    if bucket is None and not Path(prefix).is_dir():
+        parser.error(f"Expected a directory or an s3:// prefix. Found: {args.source}")
+    if args.concurrency < 1:
+        parser.error(f"Expected a positive concurrency. Found: {args.concurrency}")
+
+    logging.basicConfig(
+        level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s %(message)s"
+    )
+
+    config_file = Path(args.config)
+    bundle_file = bundle_file_for(config_file)
+    parser_manager = ParserManager(
+        config_file, bundle_file=bundle_file if bundle_file.is_file() else None
+    )
+
+    if bucket is None:
+        root = Path(prefix)
+        local = LocalObjects(root, args.bucket or root.absolute().name)
+        s3_client = local
+        objects = local.list()
+    else:
+        s3_client = boto3.client("s3")
+        objects = list_s3(s3_client, bucket, prefix)
+
+    redis_endpoint = redis.StrictRedis(host=args.redis_host, port=args.redis_port)
+    serialiser = make_serialiser(args.serialiser)
+    context = multiprocessing.get_context("fork")
+
+    shipper = RedisLogShipper(
+        redis_endpoint,
+        parser_manager,
+        s3_client,
+        serialiser=serialiser,
+        checkpoints=CheckpointStore(redis_endpoint),
+        flow_control=FlowControl(
+            redis_endpoint,
+            soft_limit=args.soft_limit,
+            list_key=args.redis_key,
+            stream=args.output == "stream",
+        )
+        if args.soft_limit
+        else None,
+        output=args.output,
+        output_key=args.redis_key,
+        parallel_min_bytes=args.parallel_parse_bytes,
+        # Shared by the workers
+        rate_limit=RateLimiter(args.rate, context=context) if args.rate else None,
+    )
+
+    # Both are forked before any shipping threads are started, the workers before the parse pool, which only this
+    # process uses
+    workers = ShipWorkers(shipper, args.concurrency, context)
+    if args.parse_workers >= 2:
+        shipper.parse_pool = ParsePool(parser_manager, serialiser, args.parse_workers)
+
+    manifest = Manifest(Path(args.manifest)) if args.manifest else None
+    if manifest is not None and len(manifest):
+        log.info(f"Skipping the {len(manifest)} objects in {manifest.path}")
+
+    # The workers, and a thread of this process for an object the parse pool parses
+    concurrency = args.concurrency + (1 if shipper.parse_pool is not None else 0)
+    try:
+        result = Backfill(shipper, manifest, concurrency, workers).run(objects)
+    except KeyboardInterrupt:
+        return 130
+    finally:
+        if manifest is not None:
+            manifest.close()
+        workers.close()
+        if shipper.parse_pool is not None:
+            shipper.parse_pool.close()
+
+    return 1 if result.failed or result.incomplete else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,253 @@
+import gzip
+import logging
+import tempfile
+import threading
+import time
+from multiprocessing.context import BaseContext
+from typing import Callable, List, MutableSequence, Optional, Sequence, Union
+
+from botocore.client import BaseClient
+from redis import StrictRedis
+
+from s3_log_shipper.serialisers import Record
+
+log: logging.Logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_WAIT_MS = 30 * 1000
+DEFAULT_INITIAL_BACKOFF_MS = 100
+DEFAULT_MAX_BACKOFF_MS = 5 * 1000
+DEFAULT_SPILL_PREFIX = "s3-log-shipper-spill/"
+
+METRICS = ("length", "memory")
+
+
+class FlowControl:
+    """
+    Watches how far logstash has fallen behind, by sampling the length of the redis list or stream (or the memory
+    redis uses) between batches. Above the soft limit shipping backs off until logstash catches up; above the hard
+    limit it must stop writing to redis altogether, before the node runs out of memory and evicts or refuses writes.
+    """
+
+    def __init__(
+        self,
+        redis_endpoint: Union[StrictRedis, Sequence[StrictRedis]],
+        soft_limit: int = 0,
+        hard_limit: int = 0,
+        metric: str = "length",
+        list_key: str = "logstash",
+        max_wait_ms: int = DEFAULT_MAX_WAIT_MS,
+        initial_backoff_ms: int = DEFAULT_INITIAL_BACKOFF_MS,
+        max_backoff_ms: int = DEFAULT_MAX_BACKOFF_MS,
+        sleep: Callable[[float], None] = time.sleep,
+        stream: bool = False,
+    ) -> None:
+        """
+        :param redis_endpoint: The redis client to sample, or the client of each shard, of which the deepest counts
+        :param soft_limit: The depth above which shipping backs off, or 0 for no soft limit
+        :param hard_limit: The depth above which shipping stops writing to redis, or 0 for no hard limit
+        :param metric: "length" to sample the length of the list, or "memory" for the bytes of memory redis uses
+        :param list_key: The redis list, or stream, logstash reads from
+        :param max_wait_ms: The longest shipping backs off for at a time, before carrying on regardless
+        :param initial_backoff_ms: The first pause when over the soft limit, doubled on each pause after
+        :param max_backoff_ms: The longest single pause
+        :param sleep: Pauses for a number of seconds
+        :param stream: Whether logstash reads from a stream rather than a list
+        """
+        if metric not in METRICS:
+            raise ValueError(
+                f"Unknown backpressure metric {metric}. Expected one of {', '.join(METRICS)}."
+            )
+        if soft_limit < 0 or hard_limit < 0 or (0 < hard_limit < soft_limit):
+            raise ValueError(
+                f"Backpressure limits must be positive, and the soft limit below the hard limit. "
+                f"Found: {soft_limit}, {hard_limit}"
+            )
+
+        self.redis_endpoints: List[StrictRedis] = (
+            list(redis_endpoint)
+            if isinstance(redis_endpoint, (list, tuple))
+            else [redis_endpoint]
+        )
+        self.soft_limit: int = soft_limit
+        self.hard_limit: int = hard_limit
+        self.metric: str = metric
+        self.list_key: str = list_key
+        self.max_wait_ms: int = max_wait_ms
+        self.initial_backoff_ms: int = initial_backoff_ms
+        self.max_backoff_ms: int = max_backoff_ms
+        self.sleep: Callable[[float], None] = sleep
+        self.stream: bool = stream
+
+    def depth(self) -> int:
+        """
+        :return: The current length of the list or stream, or bytes of memory used by redis, on the deepest shard
+        """
+        return max(self.shard_depth(endpoint) for endpoint in self.redis_endpoints)
+
+    def shard_depth(self, redis_endpoint: StrictRedis) -> int:
+        if self.metric == "length" and self.stream:
+            return int(redis_endpoint.xlen(self.list_key))
+        if self.metric == "length":
+            return int(redis_endpoint.llen(self.list_key))
+        return int(redis_endpoint.info("memory")["used_memory"])
+
+    def over_hard_limit(self, depth: int) -> bool:
+        return 0 < self.hard_limit <= depth
+
+    def admit(self, should_stop: Optional[Callable[[], bool]] = None) -> bool:
+        """
+        Waits, backing off exponentially, while redis is over the soft limit.
+        Gives up waiting after `max_wait_ms`, or once `should_stop` returns True.
+        :param should_stop: Checked before each pause
+        :return: False if redis is over the hard limit, and no more records should be written to it
+        """
+        depth = self.depth()
+        if self.over_hard_limit(depth):
+            return False
+
+        waited = 0
+        backoff = self.initial_backoff_ms
+        while 0 < self.soft_limit <= depth and waited < self.max_wait_ms:
+            if should_stop is not None and should_stop():
+                break
+
+            self.sleep(backoff / 1000)
+            waited += backoff
+            backoff = min(backoff * 2, self.max_backoff_ms)
+
+            depth = self.depth()
+            if self.over_hard_limit(depth):
+                return False
+
+        if waited:
+            log.warning(
+                f"Backed off for {waited}ms with redis {self.metric} at {depth}, over the soft limit of "
+                f"{self.soft_limit}"
+            )
+
+        return True
+
+
+class RateLimiter:
+    """
+    Limits how many records are written per second, across every thread writing them. A thread writing a batch takes
+    its records from the allowance even when that overdraws it, then waits until the allowance is paid back, so
+    batches larger than a second's worth are still written, and every thread waits its turn.
+    Built with a multiprocessing context, the allowance is shared with the processes forked from this one as well.
+    """
+
+    def __init__(
+        self,
+        rate: float,
+        clock: Callable[[], float] = time.monotonic,
+        sleep: Callable[[float], None] = time.sleep,
+        context: Optional[BaseContext] = None,
+    ) -> None:
+        """
+        :param rate: The records written per second
+        :param clock: Returns the time in seconds, the same in every process
+        :param sleep: Pauses for a number of seconds
+        :param context: The multiprocessing context of the processes sharing the limit, if any
+        """
+        if rate <= 0:
+            raise ValueError(f"Rate limit must be positive. Found: {rate}")
+
+        self.rate: float = rate
+        self.clock: Callable[[], float] = clock
+        self.sleep: Callable[[float], None] = sleep
+        # Up to a second's worth of records may be written at once, after a pause. Holds the allowance, then the
+        # time it was last updated.
+        self._state: MutableSequence[float]
+        if context is None:
+            self._lock = threading.Lock()
+            self._state = [rate, clock()]
+        else:
+            self._lock = context.Lock()
+            self._state = context.RawArray("d", [rate, clock()])
+
+    def acquire(self, records: int) -> float:
+        """
+        Waits until a number of records may be written.
+        :param records: The number of records about to be written
+        :return: The seconds waited
+        """
+        with self._lock:
+            allowance, updated = self._state
+            now = self.clock()
+            allowance = min(self.rate, allowance + (now - updated) * self.rate)
+            allowance -= records
+            self._state[0] = allowance
+            self._state[1] = now
+            wait = -allowance / self.rate if allowance < 0 else 0.0
+
+        if wait:
+            self.sleep(wait)
+        return wait
+
+
+class SpillWriter:
+    """
+    Writes records as gzipped newline delimited JSON to a temporary file, which is uploaded to S3 when closed.
+    """
+
+    def __init__(self, s3_client: BaseClient, bucket: str, key: str) -> None:
+        self.s3_client: BaseClient = s3_client
+        self.bucket: str = bucket
+        self.key: str = key
+        self.written: int = 0
+        self._file = tempfile.TemporaryFile()
+        self._gzip = gzip.GzipFile(fileobj=self._file, mode="wb")
+
+    def write(self, record: Record) -> None:
+        self._gzip.write(
+            record if isinstance(record, bytes) else record.encode("utf-8")
+        )
+        self._gzip.write(b"\n")
+        self.written += 1
+
+    def close(self) -> None:
+        """
+        Uploads the records written to S3.
+        """
+        self._gzip.close()
+        self._file.seek(0)
+        try:
+            self.s3_client.upload_fileobj(self._file, self.bucket, self.key)
+        finally:
+            self._file.close()
+
+    def discard(self) -> None:
+        self._gzip.close()
+        self._file.close()
+
+
+class SpillStore:
+    """
+    Stages the records of S3 objects that couldn't be written to redis under a prefix in S3, to be replayed once
+    logstash has caught up.
+    """
+
+    def __init__(
+        self, s3_client: BaseClient, bucket: str, prefix: str = DEFAULT_SPILL_PREFIX
+    ) -> None:
+        """
+        :param s3_client: The S3 client to upload with
+        :param bucket: The bucket to stage records in
+        :param prefix: The prefix of the staged objects
+        """
+        self.s3_client: BaseClient = s3_client
+        self.bucket: str = bucket
+        self.prefix: str = prefix
+
+    def spill(self, bucket: str, key: str, from_line: int) -> SpillWriter:
+        """
+        :param bucket: The bucket of the object being shipped
+        :param key: The key of the object being shipped
+        :param from_line: The line of the object the first spilled record comes from
+        :return: A writer for the object's remaining records
+        """
+        return SpillWriter(
+            self.s3_client,
+            self.bucket,
+            f"{self.prefix}{bucket}/{key}.{from_line}.ndjson.gz",
+        )
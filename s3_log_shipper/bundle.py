@@ -0,0 +1,193 @@
+"""
+Builds the pattern bundle for a parser config, which the lambda loads in place of expanding every grok with pygrok.
+
+    python -m s3_log_shipper.bundle input_files.json
+    python -m s3_log_shipper.bundle input_files.json --check
+"""
+import argparse
+import hashlib
+import json
+import logging
+import os
+import sys
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, List, Optional, Pattern
+
+from s3_log_shipper.optimiser import compile_regex
+
+log: logging.Logger = logging.getLogger(__name__)
+
+BUNDLE_VERSION = 1
+
+
+def bundle_file_for(config_file: Path) -> Path:
+    """
+    :return: Where the bundle for a config file is written by default, e.g. input_files.bundle.json
+    """
+    return config_file.with_suffix(".bundle.json")
+
+
+def source_checksum(config: bytes, groks_dir: str) -> str:
+    """
+    Checksums the sources of a bundle: the parser config, and the extra grok patterns it uses.
+    pygrok's own patterns are left out, so checking a bundle doesn't read them. They only change with pygrok's
+    version, which poetry.lock pins.
+    :param config: The contents of the parser config file
+    :param groks_dir: The directory of extra grok patterns
+    :return: The hex digest of the sources
+    """
+    digest = hashlib.sha256()
+    digest.update(config)
+    for name in sorted(os.listdir(groks_dir)):
+        with open(os.path.join(groks_dir, name), "rb") as patterns:
+            digest.update(name.encode("utf-8"))
+            digest.update(b"\0")
+            digest.update(patterns.read())
+    return digest.hexdigest()
+
+
+class CompiledGrok:
+    """
+    Stands in for a pygrok Grok, built from the regex pygrok expanded it into when the bundle was built.
+    """
+
+    def __init__(self, pattern: str, regex: str, type_mapper: Dict[str, str]) -> None:
+        """
+        :param pattern: The grok expression
+        :param regex: The regex the expression expands into
+        :param type_mapper: The type each converted capture is converted to, as pygrok maps %{PATTERN:name:type}
+        """
+        self.pattern: str = pattern
+        self.regex_obj: Pattern = compile_regex(regex)
+        self.type_mapper: Dict[str, str] = type_mapper
+
+    def match(self, text: str) -> Optional[dict]:
+        # As pygrok does, which searches rather than matching from the start
+        match = self.regex_obj.search(text)
+        if match is None:
+            return None
+
+        matches = match.groupdict()
+        for key, type_name in self.type_mapper.items():
+            value = matches.get(key)
+            if value is not None and type_name == "int":
+                matches[key] = int(value)
+            elif value is not None and type_name == "float":
+                matches[key] = float(value)
+        return matches
+
+
+@dataclass
+class PatternBundle:
+    """
+    Every grok of a parser config, fully expanded into regexes ahead of time, together with a checksum of the config
+    and grok patterns it was expanded from.
+    """
+
+    checksum: str
+    # The regex and types of each path grok expression, by expression
+    groks: Dict[str, dict]
+    # The log grok expression, regex (optimised where it could be) and types of each parser, by type
+    parsers: Dict[str, dict]
+
+    def grok(self, expression: str) -> Optional[CompiledGrok]:
+        """
+        :param expression: A path grok expression
+        :return: The grok, or None if the bundle doesn't have it
+        """
+        entry = self.groks.get(expression)
+        if entry is None:
+            return None
+        return CompiledGrok(expression, entry["regex"], entry["types"])
+
+    def log_grok(self, type: str, expression: str) -> Optional[CompiledGrok]:
+        """
+        :param type: The parser's type
+        :param expression: The parser's log grok expression
+        :return: The log grok, or None if the bundle doesn't have it
+        """
+        entry = self.parsers.get(type)
+        if entry is None or entry["grok"] != expression:
+            return None
+        return CompiledGrok(expression, entry["regex"], entry["types"])
+
+    def save(self, bundle_file: Path) -> None:
+        with open(bundle_file.as_posix(), "w") as bf:
+            json.dump(
+                {
+                    "version": BUNDLE_VERSION,
+                    "checksum": self.checksum,
+                    "groks": self.groks,
+                    "parsers": self.parsers,
+                },
+                bf,
+                indent=2,
+                sort_keys=True,
+            )
+
+    @staticmethod
+    def load(bundle_file: Path, checksum: str) -> "PatternBundle":
+        """
+        :param bundle_file: The bundle to load
+        :param checksum: The checksum of the config and grok patterns being used
+        :return: The bundle
+        :raises ValueError: If the bundle was built by another version, or from other sources
+        """
+        with open(bundle_file.as_posix(), "rb") as bf:
+            content: dict = json.load(bf)
+
+        if content.get("version") != BUNDLE_VERSION:
+            raise ValueError(
+                f"Pattern bundle {bundle_file} is version {content.get('version')}. Expected {BUNDLE_VERSION}."
+            )
+        if content.get("checksum") != checksum:
+            raise ValueError(
+                f"Pattern bundle {bundle_file} was built from a different parser config or grok patterns"
+            )
+
+        return PatternBundle(checksum, content["groks"], content["parsers"])
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    # parsers imports this module to load bundles, so is only imported to build one
+    from s3_log_shipper.parsers import ParserManager
+
+    parser = argparse.ArgumentParser(
+        description="Expand the groks of a parser config into a pattern bundle"
+    )
+    parser.add_argument("config", help="The parser config file")
+    parser.add_argument(
+        "--output",
+        help="Where to write the bundle. Defaults to <config>.bundle.json, beside the config.",
+    )
+    parser.add_argument(
+        "--check",
+        action="store_true",
+        help="Fail if the bundle is missing or out of date, rather than writing it",
+    )
+    args = parser.parse_args(argv)
+
+    config_file = Path(args.config)
+    bundle_file = Path(args.output) if args.output else bundle_file_for(config_file)
+    parser_manager = ParserManager(config_file)
+
+    if args.check:
+        try:
+            PatternBundle.load(bundle_file, parser_manager.checksum)
+        except (OSError, ValueError) as e:
+            print(f"Pattern bundle is out of date: {e}")
+            return 1
+        print(f"{bundle_file} is up to date")
+        return 0
+
+    bundle = parser_manager.build_bundle()
+    bundle.save(bundle_file)
+    print(
+        f"Wrote {len(bundle.parsers)} parsers and {len(bundle.groks)} path groks to {bundle_file}"
+    )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,55 @@
+from redis import StrictRedis
+
+DEFAULT_CHECKPOINT_TTL = 24 * 60 * 60
+
+
+class Checkpoint:
+    """
+    The number of lines of a single S3 object that have been shipped.
+    """
+
+    def __init__(self, redis_endpoint: StrictRedis, key: str, ttl: int) -> None:
+        self.redis_endpoint: StrictRedis = redis_endpoint
+        self.key: str = key
+        self.ttl: int = ttl
+
+    def get(self) -> int:
+        """
+        :return: The number of lines of the object already shipped
+        """
+        value = self.redis_endpoint.get(self.key)
+        return int(value) if value is not None else 0
+
+    def save(self, lines: int) -> None:
+        self.redis_endpoint.set(self.key, lines, ex=self.ttl)
+
+    def clear(self) -> None:
+        self.redis_endpoint.delete(self.key)
+
+
+class CheckpointStore:
+    """
+    Records in redis how many lines of an S3 object have been shipped, so an invocation that stops part way through a
+    file can be resumed from there rather than shipping the whole object again.
+    Checkpoints are keyed on the object's eTag, so a new version of an object is always shipped from the start.
+    """
+
+    def __init__(
+        self,
+        redis_endpoint: StrictRedis,
+        ttl: int = DEFAULT_CHECKPOINT_TTL,
+        prefix: str = "s3-log-shipper:checkpoint",
+    ) -> None:
+        """
+        :param redis_endpoint: The redis client to keep checkpoints in
+        :param ttl: The number of seconds a checkpoint is kept for after it was last updated
+        :param prefix: The prefix of the checkpoint keys
+        """
+        self.redis_endpoint: StrictRedis = redis_endpoint
+        self.ttl: int = ttl
+        self.prefix: str = prefix
+
+    def checkpoint(self, bucket: str, key: str, e_tag: str) -> Checkpoint:
+        return Checkpoint(
+            self.redis_endpoint, f"{self.prefix}:{bucket}/{key}:{e_tag}", self.ttl
+        )
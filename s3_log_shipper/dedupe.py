@@ -0,0 +1,115 @@
+import threading
+from collections import OrderedDict
+from typing import Optional
+
+from redis import StrictRedis
+
+DEFAULT_DEDUPE_TTL = 24 * 60 * 60
+DEFAULT_DEDUPE_CACHE_SIZE = 1024
+# The longest a lambda can run for
+DEFAULT_CLAIM_TTL = 15 * 60
+
+SHIPPED = "shipped"
+
+
+class DuplicateFilter:
+    """
+    Suppresses repeated S3 notifications for the same object version, which S3 delivers at least once.
+    Each bucket/key/eTag is claimed with an atomic SET NX in redis, so only one invocation ships it. A claim only lasts
+    as long as the invocation shipping the object could, so an object whose invocation timed out or was killed is
+    shipped by the retry. Once the object is shipped in full, the claim is replaced with a marker kept for `ttl`.
+    Shipped versions are also remembered in process, so a warm container skips them without a round trip to redis.
+    An object without an eTag could be any version of its key, so is always shipped, and never claimed.
+    """
+
+    def __init__(
+        self,
+        redis_endpoint: StrictRedis,
+        ttl: int = DEFAULT_DEDUPE_TTL,
+        cache_size: int = DEFAULT_DEDUPE_CACHE_SIZE,
+        prefix: str = "s3-log-shipper:shipped",
+        claim_ttl: int = DEFAULT_CLAIM_TTL,
+    ) -> None:
+        """
+        :param redis_endpoint: The redis client to keep claims in
+        :param ttl: The number of seconds a shipped object version is remembered for
+        :param cache_size: The number of shipped object versions remembered in process
+        :param prefix: The prefix of the claim keys
+        :param claim_ttl: The number of seconds a claim lasts for, unless the claim gives its own
+        """
+        self.redis_endpoint: StrictRedis = redis_endpoint
+        self.ttl: int = ttl
+        self.claim_ttl: int = claim_ttl
+        self.cache_size: int = cache_size
+        self.prefix: str = prefix
+        self.skipped: int = 0
+        self._recent: "OrderedDict[str, None]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _key(self, bucket: str, key: str, e_tag: str) -> str:
+        return f"{self.prefix}:{bucket}/{key}:{e_tag}"
+
+    def claim(
+        self,
+        bucket: str,
+        key: str,
+        e_tag: Optional[str],
+        sequencer: str,
+        ttl: Optional[int] = None,
+    ) -> bool:
+        """
+        Claims an object version for shipping, until it is shipped or released, or the claim expires.
+        :param ttl: The number of seconds the claim lasts for, such as the time left for the invocation to run
+        :return: True if the object should be shipped, False if it is a duplicate
+        """
+        if e_tag is None:
+            return True
+
+        claim_key = self._key(bucket, key, e_tag)
+
+        with self._lock:
+            if claim_key in self._recent:
+                self._recent.move_to_end(claim_key)
+                self.skipped += 1
+                return False
+
+        claimed = self.redis_endpoint.set(
+            claim_key, sequencer, nx=True, ex=max(1, ttl or self.claim_ttl)
+        )
+
+        if not claimed:
+            with self._lock:
+                self.skipped += 1
+            return False
+
+        return True
+
+    def shipped(self, bucket: str, key: str, e_tag: Optional[str]) -> None:
+        """
+        Remembers that an object version was shipped in full, so later notifications for it are skipped.
+        """
+        if e_tag is None:
+            return
+
+        claim_key = self._key(bucket, key, e_tag)
+
+        self.redis_endpoint.set(claim_key, SHIPPED, ex=self.ttl)
+
+        with self._lock:
+            self._recent[claim_key] = None
+            if len(self._recent) > self.cache_size:
+                self._recent.popitem(last=False)
+
+    def release(self, bucket: str, key: str, e_tag: Optional[str]) -> None:
+        """
+        Gives up the claim on an object version, so a retry can ship it.
+        """
+        if e_tag is None:
+            return
+
+        claim_key = self._key(bucket, key, e_tag)
+
+        with self._lock:
+            self._recent.pop(claim_key, None)
+
+        self.redis_endpoint.delete(claim_key)
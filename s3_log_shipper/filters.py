@@ -0,0 +1,145 @@
+import re
+from typing import Any, Collection, FrozenSet, List, Optional, Pattern, Sequence, Tuple
+
+# Log levels, as they appear in the EMR logs, which may be filtered on
+LEVELS = (
+    "TRACE",
+    "DEBUG",
+    "INFO",
+    "NOTICE",
+    "WARN",
+    "WARNING",
+    "ERROR",
+    "SEVERE",
+    "FATAL",
+    "CRITICAL",
+)
+
+# The level of a log line is looked for within this many characters of its start, after the timestamp
+LEVEL_WINDOW = 120
+
+_LEVEL = re.compile(r"\b(%s)\b" % "|".join(sorted(LEVELS, key=len, reverse=True)))
+
+# Fields which are always shipped, whatever the projection
+ALWAYS_SHIPPED = frozenset(["@timestamp", "type"])
+
+
+class LineFilter:
+    """
+    The drop rules and field projection of a log type, configured as the `filter` of its entry in the config file.
+    Lines are dropped with cheap checks on the raw line, before they are grokked, so dropped lines cost no grok match,
+    timestamp conversion or encoding.
+    """
+
+    def __init__(
+        self,
+        levels: Optional[Collection[str]] = None,
+        deny: Sequence[str] = (),
+        deny_regex: Sequence[str] = (),
+        fields: Optional[Collection[str]] = None,
+    ) -> None:
+        """
+        :param levels: The levels to ship. A line is dropped when the first level in it is any other, and shipped when
+        it has no level, e.g. a stack trace line.
+        :param deny: Lines containing any of these strings are dropped
+        :param deny_regex: Lines matching any of these regexes, anywhere in the line, are dropped
+        :param fields: The fields to ship, or None to ship every field. `@timestamp` and `type` are always shipped.
+        """
+        unknown = set(levels or ()) - set(LEVELS)
+        if unknown:
+            raise ValueError(
+                f"Unknown log levels {sorted(unknown)}. Expected some of {', '.join(LEVELS)}."
+            )
+
+        self.levels: Optional[FrozenSet[str]] = (
+            None if levels is None else frozenset(levels)
+        )
+        self.deny: List[str] = list(deny)
+        self.deny_regex: Optional[Pattern] = (
+            re.compile("|".join(f"(?:{regex})" for regex in deny_regex))
+            if deny_regex
+            else None
+        )
+        self.fields: Optional[FrozenSet[str]] = (
+            None if fields is None else frozenset(fields) | ALWAYS_SHIPPED
+        )
+
+    @staticmethod
+    def from_config(config: Optional[Any]) -> Optional["LineFilter"]:
+        """
+        :param config: The `filter` of a file entry in the config file, if it has one
+        :return: The filter, or None if there is nothing to filter
+        """
+        if not config:
+            return None
+        if not isinstance(config, dict):
+            raise ValueError(f"File entry filter must be an object. Found: {config}")
+
+        unknown = set(config) - {"levels", "deny", "deny_regex", "fields"}
+        if unknown:
+            raise ValueError(f"Unknown file entry filter keys {sorted(unknown)}")
+
+        return LineFilter(
+            config.get("levels"),
+            config.get("deny", ()),
+            config.get("deny_regex", ()),
+            config.get("fields"),
+        )
+
+    def captures(self) -> Optional[FrozenSet[str]]:
+        """
+        :return: The grok captures the projected fields come from, or None if every capture is shipped
+        """
+        if self.fields is None:
+            return None
+        return self.fields | {"timestamp"}
+
+    def keep(self, line: str, deny: Optional[Sequence[str]] = None) -> bool:
+        """
+        :param line: A raw log line
+        :param deny: The deny list to check, if not all of it
+        :return: Whether the line should be grokked and shipped
+        """
+        if self.levels is not None:
+            level = _LEVEL.search(line, 0, LEVEL_WINDOW)
+            if level is not None and level.group(1) not in self.levels:
+                return False
+
+        for denied in self.deny if deny is None else deny:
+            if denied in line:
+                return False
+
+        return self.deny_regex is None or self.deny_regex.search(line) is None
+
+    def apply(self, block: str) -> Tuple[str, int]:
+        """
+        Drops the lines of a block of log lines that shouldn't be shipped.
+        :param block: Newline separated log lines
+        :return: The lines to ship, newline separated, and the number of lines dropped
+        """
+        # Only the denied strings found somewhere in the block need looking for in each line
+        deny = [denied for denied in self.deny if denied in block]
+        if self.levels is None and not deny and self.deny_regex is None:
+            return block, 0
+
+        # Split on newlines alone, as lines are counted, rather than every line boundary splitlines knows
+        lines = block.split("\n")
+        ending = ""
+        if not lines[-1]:
+            lines.pop()
+            ending = "\n"
+
+        kept = [line for line in lines if self.keep(line, deny)]
+        dropped = len(lines) - len(kept)
+        if not dropped:
+            return block, 0
+        return ("\n".join(kept) + ending if kept else ""), dropped
+
+    def project(self, fields: dict) -> dict:
+        """
+        :param fields: The fields of a log line, or matched from a log path
+        :return: Only the fields to ship
+        """
+        if self.fields is None:
+            return fields
+        return {key: value for key, value in fields.items() if key in self.fields}
@@ -0,0 +1,229 @@
+import json
+import logging
+import os
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from typing import Any, BinaryIO, Callable, Dict, Iterator, Optional, TypeVar, Union
+
+from aws_lambda_logging import JsonFormatter
+
+metrics_log: logging.Logger = logging.getLogger(__name__)
+
+DEFAULT_SAMPLE_EVERY = 100
+DEFAULT_NAMESPACE = "S3LogShipper"
+
+# Stages whose timer runs while a nested stage is also being timed, and so include its time
+NESTED_STAGES = {"inflate": ("download",), "grok": ("timestamp",)}
+
+T = TypeVar("T")
+R = TypeVar("R")
+
+
+class ShipMetrics:
+    """
+    Accumulates where the time went while shipping a single S3 object, and how much was shipped.
+    Stages run once per block or batch are always timed. Stages run once per line are timed on every `sample_every`th
+    line, and the sampled time scaled up to every line, which keeps the overhead low enough to leave on.
+    """
+
+    def __init__(
+        self,
+        sample_every: int = DEFAULT_SAMPLE_EVERY,
+        clock: Callable[[], float] = time.perf_counter,
+    ) -> None:
+        """
+        :param sample_every: How often per line stages are timed
+        :param clock: Returns the time in seconds
+        """
+        if sample_every < 1:
+            raise ValueError(
+                f"Metrics sample rate must be positive. Found: {sample_every}"
+            )
+
+        self.sample_every: int = sample_every
+        self.clock: Callable[[], float] = clock
+        self.counts: Dict[str, int] = defaultdict(int)
+        self._seconds: Dict[str, float] = defaultdict(float)
+        self._calls: Dict[str, int] = defaultdict(int)
+        self._samples: Dict[str, int] = defaultdict(int)
+
+    @contextmanager
+    def timer(self, stage: str) -> Iterator[None]:
+        start = self.clock()
+        try:
+            yield
+        finally:
+            self.add_time(stage, self.clock() - start)
+
+    def add_time(self, stage: str, seconds: float) -> None:
+        self._seconds[stage] += seconds
+
+    def count(self, name: str, value: int = 1) -> None:
+        self.counts[name] += value
+
+    def sampled(self, stage: str, fn: Callable[[T], R]) -> Callable[[T], R]:
+        """
+        Wraps a function run once per line, so it is timed on every `sample_every`th call, starting with the first.
+        :param stage: The stage the function's time is accounted to
+        :param fn: The function to time
+        :return: The wrapped function
+        """
+        every = self.sample_every
+        clock = self.clock
+        calls = self._calls
+        samples = self._samples
+        seconds = self._seconds
+
+        def timed(arg: T) -> R:
+            calls[stage] += 1
+            if (calls[stage] - 1) % every:
+                return fn(arg)
+
+            start = clock()
+            result = fn(arg)
+            seconds[stage] += clock() - start
+            samples[stage] += 1
+            return result
+
+        return timed
+
+    def merge(self, other: "ShipMetrics") -> None:
+        """
+        Adds the time and counts of another part of the same shipment, such as a block parsed in another process.
+        :param other: The metrics to add
+        """
+        for stage, seconds in other._seconds.items():
+            self._seconds[stage] += seconds
+        for stage, calls in other._calls.items():
+            self._calls[stage] += calls
+        for stage, samples in other._samples.items():
+            self._samples[stage] += samples
+        for name, value in other.counts.items():
+            self.counts[name] += value
+
+    def timings(self) -> Dict[str, float]:
+        """
+        :return: The seconds spent in each stage, excluding the time of any nested stage, with sampled stages scaled
+        up to every call
+        """
+        timings = {
+            stage: seconds * self._calls[stage] / self._samples[stage]
+            if self._samples[stage]
+            else seconds
+            for stage, seconds in self._seconds.items()
+        }
+
+        for stage, nested in NESTED_STAGES.items():
+            if stage in timings:
+                inner = sum(timings.get(n, 0.0) for n in nested)
+                timings[stage] = max(0.0, timings[stage] - inner)
+
+        return timings
+
+    def emf(
+        self,
+        dimensions: Dict[str, str],
+        properties: Optional[Dict[str, Any]] = None,
+        namespace: str = DEFAULT_NAMESPACE,
+    ) -> dict:
+        """
+        Builds a CloudWatch embedded metric format record of the metrics.
+        :param dimensions: The dimensions of every metric
+        :param properties: Other fields of the record, which can be queried but aren't metrics
+        :param namespace: The CloudWatch namespace of the metrics
+        :return: The record, to be logged as a single line of JSON
+        """
+        values: Dict[str, Union[int, float]] = {}
+        units: Dict[str, str] = {}
+
+        for stage, seconds in self.timings().items():
+            name = f"{_metric_name(stage)}Time"
+            values[name] = round(seconds * 1000, 3)
+            units[name] = "Milliseconds"
+
+        for counter, value in self.counts.items():
+            name = _metric_name(counter)
+            values[name] = value
+            units[name] = "Bytes" if counter.startswith("bytes") else "Count"
+
+        record: Dict[str, Any] = {
+            "_aws": {
+                "Timestamp": int(time.time() * 1000),
+                "CloudWatchMetrics": [
+                    {
+                        "Namespace": namespace,
+                        "Dimensions": [list(dimensions)],
+                        "Metrics": [
+                            {"Name": name, "Unit": unit} for name, unit in units.items()
+                        ],
+                    }
+                ],
+            }
+        }
+        record.update(properties or {})
+        record.update(dimensions)
+        record.update(values)
+        return record
+
+
+def _metric_name(name: str) -> str:
+    return "".join(part.title() for part in name.split("_"))
+
+
+class TimedReader:
+    """
+    Wraps a stream, timing its reads as a stage and optionally counting the bytes read.
+    """
+
+    def __init__(
+        self,
+        stream: BinaryIO,
+        metrics: ShipMetrics,
+        stage: str,
+        counter: Optional[str] = None,
+    ) -> None:
+        self.stream = stream
+        self.metrics: ShipMetrics = metrics
+        self.stage: str = stage
+        self.counter: Optional[str] = counter
+
+    def read(self, size: int = -1):
+        with self.metrics.timer(self.stage):
+            data = self.stream.read(size)
+
+        if self.counter is not None:
+            self.metrics.count(self.counter, len(data))
+        return data
+
+    def __getattr__(self, name: str):
+        return getattr(self.stream, name)
+
+
+def process_uptime() -> Optional[float]:
+    """
+    :return: The seconds since this process started, to the nearest clock tick, or None where /proc isn't available
+    """
+    try:
+        with open("/proc/self/stat") as stat:
+            # The fields after the parenthesised command name, which may contain spaces, start with the state
+            fields = stat.read().rpartition(")")[2].split()
+        with open("/proc/uptime") as uptime:
+            system_uptime = float(uptime.read().split()[0])
+        started = int(fields[19]) / os.sysconf("SC_CLK_TCK")
+    except (OSError, ValueError, IndexError):
+        return None
+
+    return max(0.0, system_uptime - started)
+
+
+class EmfFormatter(JsonFormatter):
+    """
+    Formats log records as aws_lambda_logging does, except for embedded metric format records, which CloudWatch only
+    recognises when they are the whole of the log line rather than nested in its message.
+    """
+
+    def format(self, record: logging.LogRecord) -> str:
+        if isinstance(record.msg, dict) and "_aws" in record.msg:
+            return json.dumps(record.msg, default=self.default_json_formatter)
+        return super().format(record)
@@ -0,0 +1,130 @@
+import re
+from typing import Any, Iterable, Iterator, Optional, Pattern
+
+DEFAULT_MAX_BYTES = 256 * 1024
+
+# Joins the lines of an event into one line, for the filter and grok, and is turned back into newlines once grokked.
+# Unlike a newline, `.` and `[^\n]` match it, and unlike most control characters, `\s` doesn't.
+SEPARATOR = "\x00"
+# Escapes the separator, and itself, where the log has them, so they are shipped as they were rather than as newlines
+ESCAPE = "\x01"
+_ESCAPES = {ESCAPE: f"{ESCAPE}e", SEPARATOR: f"{ESCAPE}0"}
+_ESCAPED: Pattern = re.compile(f"{ESCAPE}([e0])")
+_UNESCAPES = {"e": ESCAPE, "0": SEPARATOR}
+
+
+def unjoin(text: str) -> str:
+    """
+    :param text: Text from a block of joined events
+    :return: The text, with the newlines between the lines of each event, and any separators in the log, put back
+    """
+    if SEPARATOR in text:
+        text = text.replace(SEPARATOR, "\n")
+    if ESCAPE in text:
+        text = _ESCAPED.sub(lambda escaped: _UNESCAPES[escaped.group(1)], text)
+    return text
+
+
+class MultilineAssembler:
+    """
+    Assembles the lines of a multiline event, such as a Java exception and its stack trace, into a single event, so it
+    is filtered, grokked and shipped as one record rather than a grok failure per continuation line.
+    An event is a line matching the `start` regex of its type, e.g. a line starting with a timestamp, and every line
+    after it up to the next such line.
+    """
+
+    def __init__(self, start: str, max_bytes: int = DEFAULT_MAX_BYTES) -> None:
+        """
+        :param start: A regex matching the start of the first line of each event
+        :param max_bytes: The most characters of an event held back from one block to the next, waiting for the rest
+        of the event. Longer events are cut, and the remainder shipped as events of their own.
+        """
+        if max_bytes < 1:
+            raise ValueError(
+                f"Multiline max bytes must be positive. Found: {max_bytes}"
+            )
+
+        self.start: Pattern = re.compile(start, re.MULTILINE)
+        self.max_bytes: int = max_bytes
+        # A newline followed by anything but the start of an event, other than the newline ending the block
+        self._continuation: Pattern = re.compile(
+            f"\\n(?!\\Z)(?!(?:{start}))", re.MULTILINE
+        )
+
+    @staticmethod
+    def from_config(config: Optional[Any]) -> Optional["MultilineAssembler"]:
+        """
+        :param config: The `multiline` of a file entry in the config file, if it has one
+        :return: The assembler, or None if the type's events are single lines
+        """
+        if not config:
+            return None
+        if not isinstance(config, dict) or "start" not in config:
+            raise ValueError(
+                f"File entry multiline must be an object with a 'start' regex. Found: {config}"
+            )
+
+        unknown = set(config) - {"start", "max_bytes"}
+        if unknown:
+            raise ValueError(f"Unknown file entry multiline keys {sorted(unknown)}")
+
+        return MultilineAssembler(
+            config["start"], config.get("max_bytes", DEFAULT_MAX_BYTES)
+        )
+
+    def blocks(self, blocks: Iterable[str]) -> Iterator[str]:
+        """
+        Recuts blocks of whole lines so that no event is split between two blocks. The last event of each block is
+        carried over to the next, as more of its lines may follow, unless it grows longer than `max_bytes`.
+        :param blocks: Blocks of whole lines, as read
+        :return: Blocks of whole events
+        """
+        carried = ""
+        for block in blocks:
+            if carried:
+                block = carried + block
+
+            cut = self._last_event_start(block)
+            if cut == 0 and len(block) <= self.max_bytes:
+                carried = block
+                continue
+
+            if cut == 0 or len(block) - cut > self.max_bytes:
+                cut = len(block)
+
+            carried = block[cut:]
+            yield block[:cut]
+
+        if carried:
+            yield carried
+
+    def _last_event_start(self, block: str) -> int:
+        # Most events are a line or a short trace, so look back from the end of the block line by line
+        end = len(block) - 1 if block.endswith("\n") else len(block)
+        newline = block.rfind("\n", 0, end)
+        while newline != -1:
+            if self.start.match(block, newline + 1):
+                return newline + 1
+            newline = block.rfind("\n", 0, newline)
+        return 0
+
+    def join(self, block: str) -> str:
+        """
+        :param block: A block of whole events
+        :return: The block with each event on a line of its own, its lines joined by `SEPARATOR`
+        """
+        if SEPARATOR in block or ESCAPE in block:
+            for character, escaped in _ESCAPES.items():
+                block = block.replace(character, escaped)
+        return self._continuation.sub(SEPARATOR, block)
+
+    @staticmethod
+    def restore(fields: dict) -> dict:
+        """
+        :param fields: The fields grokked from a joined event
+        :return: The fields, with the newlines between the lines of the event put back
+        """
+        for key, value in fields.items():
+            if type(value) is str and (SEPARATOR in value or ESCAPE in value):
+                fields[key] = unjoin(value)
+        return fields
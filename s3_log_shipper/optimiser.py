@@ -0,0 +1,182 @@
+import re
+from typing import Collection, Iterable, List, Optional, Pattern
+
+try:
+    import regex as regex_module
+except ImportError:
+    regex_module = None
+
+# Characters that can't start a fixed delimiter following a leading GREEDYDATA capture
+_NOT_LITERAL = set(".^$*+?{}[]()|")
+
+
+def _group_starts(regex: str) -> List[int]:
+    """
+    Lists the positions of the opening parentheses of the groups in a regex, ignoring escapes and character classes.
+    """
+    starts: List[int] = []
+    in_class = False
+    i = 0
+    while i < len(regex):
+        c = regex[i]
+        if c == "\\":
+            i += 2
+            continue
+        if in_class:
+            if c == "]":
+                in_class = False
+        elif c == "[":
+            in_class = True
+            # A closing bracket straight after the opening one (or a negation) is a literal
+            if regex.startswith("]", i + 1):
+                i += 1
+            elif regex.startswith("^]", i + 1):
+                i += 2
+        elif c == "(":
+            starts.append(i)
+        i += 1
+    return starts
+
+
+def drop_unused_groups(regex: str, keep: Optional[Collection[str]] = None) -> str:
+    """
+    Turns capturing groups which can't be seen in a grok match into non-capturing groups, so the regex engine
+    doesn't have to track them. That is every unnamed group, and any named group not listed in `keep`.
+    :param regex: The expanded grok regex
+    :param keep: The named groups to keep, or None to keep all of them
+    :return: The rewritten regex
+    """
+    # Back references need their group numbers and names left alone
+    if re.search(r"\\[1-9]|\(\?P=|\\g<|\\k<", regex):
+        return regex
+
+    rewritten: List[str] = []
+    last = 0
+    for start in _group_starts(regex):
+        if regex.startswith("?P<", start + 1) or (
+            regex.startswith("?<", start + 1) and regex[start + 3] not in "=!"
+        ):
+            name_start = regex.index("<", start) + 1
+            name_end = regex.index(">", name_start)
+            if keep is None or regex[name_start:name_end] in keep:
+                continue
+            prefix_end = name_end + 1
+        elif regex.startswith("?", start + 1):
+            continue
+        else:
+            prefix_end = start + 1
+
+        rewritten.append(regex[last:start])
+        rewritten.append("(?:")
+        last = prefix_end
+
+    rewritten.append(regex[last:])
+    return "".join(rewritten)
+
+
+def lazy_leading_greedydata(regex: str, lazy: bool = True) -> str:
+    """
+    Rewrites a regex starting with a GREEDYDATA capture in front of a fixed delimiter, e.g. `(?P<timestamp>.*)\\s`,
+    so the capture is lazy and anchored to the start of the line. The greedy form runs to the end of the line and
+    backtracks one character at a time looking for the delimiter, and unanchored search retries that from every
+    position of a line which doesn't match. A leading DATA capture, which is lazy already, is only anchored.
+    A lazy capture ends at the first delimiter the rest of the regex matches after, where a greedy one ends at the
+    last, such as a level word inside the message. Anchoring alone never changes the match on a line.
+    :param regex: The expanded grok regex
+    :param lazy: Whether to make a GREEDYDATA capture lazy, or only anchor it
+    :return: The rewritten regex, or the original if it doesn't start with a GREEDYDATA or DATA capture
+    """
+    match = re.match(r"((?:\((?:\?:)?)*)(\(\?P<\w+>\.\*)(\??)\)", regex)
+    if match is None:
+        return regex
+
+    end = match.end()
+    rest = regex[end:]
+    if not rest or rest[0] in _NOT_LITERAL:
+        return regex
+    if rest[0] == "\\" and rest[1:2] not in ("s", "t") and rest[1:2].isalnum():
+        return regex
+
+    capture = f"{match.group(2)}?)" if lazy or match.group(3) else f"{match.group(2)})"
+    return f"^{match.group(1)}{capture}{rest}"
+
+
+def compile_regex(pattern: str) -> Pattern:
+    """
+    Compiles a regex with the standard library, which matches the EMR groks around twice as fast as the regex module.
+    Falls back to the regex module, as pygrok does, for syntax the standard library doesn't support.
+    """
+    try:
+        return re.compile(pattern)
+    except re.error:
+        if regex_module is None:
+            raise
+        return regex_module.compile(pattern)
+
+
+def optimise_regex(
+    regex: str, keep: Optional[Collection[str]] = None, lazy: bool = True
+) -> str:
+    """
+    Rewrites an expanded grok regex into one which the regex engine can match faster.
+    :param regex: The expanded grok regex
+    :param keep: The named groups to keep, or None to keep all of them
+    :param lazy: Whether to make a leading GREEDYDATA capture lazy, which may change what it captures
+    :return: The optimised regex
+    """
+    return lazy_leading_greedydata(drop_unused_groups(regex, keep), lazy)
+
+
+def mismatches(
+    original: Pattern, optimised: Pattern, samples: Iterable[str]
+) -> List[str]:
+    """
+    Checks an optimised regex produces the same fields as the original on a corpus of sample lines.
+    :param original: The regex as compiled by pygrok
+    :param optimised: The optimised regex
+    :param samples: Sample log lines, both matching and not matching the original regex
+    :return: The sample lines on which the two regexes disagree
+    """
+    different: List[str] = []
+    for sample in samples:
+        expected = original.search(sample)
+        actual = optimised.search(sample)
+        # Named groups dropped by the optimiser aren't expected to match
+        expected_fields = (
+            None
+            if expected is None
+            else {
+                key: value
+                for key, value in expected.groupdict().items()
+                if key in optimised.groupindex
+            }
+        )
+        actual_fields = None if actual is None else actual.groupdict()
+        if expected_fields != actual_fields:
+            different.append(sample)
+    return different
+
+
+def compile_optimised(
+    original: Pattern, samples: Iterable[str], keep: Optional[Collection[str]] = None
+) -> Optional[Pattern]:
+    """
+    Optimises a compiled grok regex, provided the result agrees with it on every sample line. A leading GREEDYDATA
+    capture is only made lazy if that agrees too, so the samples should include lines where the delimiter after it
+    occurs again, such as a level word inside the message. Otherwise it is only anchored.
+    :param original: The regex as compiled by pygrok
+    :param samples: Sample log lines to check the optimised regex against
+    :param keep: The named groups to keep, or None to keep all of them
+    :return: The compiled optimised regex, or None if it can't be optimised or disagrees with the original
+    """
+    samples = list(samples)
+    for lazy in (True, False):
+        optimised_regex = optimise_regex(original.pattern, keep, lazy)
+        if optimised_regex == original.pattern and isinstance(original, re.Pattern):
+            return None
+
+        optimised = compile_regex(optimised_regex)
+        if not mismatches(original, optimised, samples):
+            return optimised
+
+    return None
@@ -0,0 +1,272 @@
+import multiprocessing
+import os
+import signal
+import threading
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Callable, Deque, Iterable, Iterator, List, Optional, Tuple, TypeVar
+
+from s3_log_shipper.metrics import ShipMetrics, DEFAULT_SAMPLE_EVERY
+from s3_log_shipper.multiline import unjoin
+from s3_log_shipper.parsers import Parser, ParserManager
+from s3_log_shipper.serialisers import Record, Serialiser
+
+DEFAULT_PARALLEL_MIN_BYTES = 32 * 1024 * 1024
+
+# A lambda has at most 6 vCPUs
+MAX_DEFAULT_WORKERS = 6
+
+T = TypeVar("T")
+
+
+@dataclass
+class ParsedBlock:
+    """
+    The records of a block of log lines, already encoded for redis, and the lines which couldn't be grokked.
+    """
+
+    records: List[Record]
+    unmatched: List[str]
+    dropped: int = 0
+    metrics: Optional[ShipMetrics] = field(default=None, compare=False, repr=False)
+
+
+def line_at(block: str, offset: int) -> str:
+    end = block.find("\n", offset)
+    return block[offset:] if end == -1 else block[offset:end]
+
+
+def parse_block(
+    parser: Parser,
+    block: str,
+    encode: Callable[[dict], Record],
+    convert_timestamp: Callable[[str], str],
+    metrics: ShipMetrics,
+) -> ParsedBlock:
+    """
+    Assembles, filters, groks and encodes a block of log lines.
+    :param parser: The parser of the lines
+    :param block: Newline separated log lines
+    :param encode: Encodes the fields of a line as a record
+    :param convert_timestamp: Converts the timestamp of a line
+    :param metrics: Times each stage
+    :return: The records and unmatched lines of the block, in order
+    """
+    if parser.multiline is not None:
+        with metrics.timer("multiline"):
+            block = parser.multiline.join(block)
+
+    dropped = 0
+    if parser.line_filter is not None:
+        with metrics.timer("filter"):
+            block, dropped = parser.prefilter(block)
+
+    with metrics.timer("grok"):
+        parsed = list(parser.parse_many(block, convert_timestamp))
+
+    records: List[Record] = []
+    unmatched: List[str] = []
+    for offset, log_groks in parsed:
+        if log_groks is None:
+            line = line_at(block, offset)
+            unmatched.append(line if parser.multiline is None else unjoin(line))
+        else:
+            records.append(encode(log_groks))
+
+    return ParsedBlock(records, unmatched, dropped)
+
+
+def default_workers() -> int:
+    """
+    :return: The number of CPUs this process may run on, up to the most a lambda has
+    """
+    try:
+        cpus = len(os.sched_getaffinity(0))
+    except AttributeError:
+        cpus = os.cpu_count() or 1
+    return min(cpus, MAX_DEFAULT_WORKERS)
+
+
+def _work(
+    connection,
+    parser_manager: ParserManager,
+    serialiser: Serialiser,
+    sample_every: int,
+) -> None:
+    # Interrupting the backfill interrupts every process in its group. The pool is closed by its parent instead.
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+    while True:
+        try:
+            message = connection.recv()
+        except EOFError:
+            return
+        if message is None:
+            return
+
+        log_path, block = message
+        try:
+            parser, path_groks = parser_manager.get_parser(log_path)
+            metrics = ShipMetrics(sample_every)
+            result = parse_block(
+                parser,
+                block,
+                metrics.sampled("encode", serialiser.bind(path_groks)),
+                metrics.sampled("timestamp", parser.timestamp_converter),
+                metrics,
+            )
+            result.metrics = metrics
+        except Exception as e:
+            # Not every exception can be pickled back
+            connection.send(
+                RuntimeError(f"Failed to parse a block of {log_path}: {e!r}")
+            )
+            continue
+        connection.send(result)
+
+
+class ParsePool:
+    """
+    Worker processes which grok and encode blocks of log lines on every CPU, rather than on one under the GIL.
+    The workers are forked once, when the pool is built, and kept for the life of the lambda instance. They are
+    built while no other threads are running, so they hold no locks, and inherit every parser, built beforehand,
+    without building them again.
+    Lambda has no /dev/shm, which multiprocessing's queues and locks need, so each worker is sent blocks over a pipe
+    of its own. Each worker parses one block at a time, and the blocks are handed out in turn, so their results are
+    received in the order of the blocks.
+    One object is parsed by the pool at a time. Other objects are parsed on the thread shipping them.
+    """
+
+    def __init__(
+        self,
+        parser_manager: ParserManager,
+        serialiser: Serialiser,
+        workers: int,
+        sample_every: int = DEFAULT_SAMPLE_EVERY,
+    ) -> None:
+        """
+        :param parser_manager: The parsers the workers parse with
+        :param serialiser: Encodes the records
+        :param workers: The number of worker processes, at least 2
+        :param sample_every: How often per line stages are timed
+        """
+        if workers < 2:
+            raise ValueError(f"A parse pool needs at least 2 workers. Found: {workers}")
+
+        parser_manager.build()
+
+        context = multiprocessing.get_context("fork")
+        self._connections: List = []
+        self._processes: List = []
+        for i in range(workers):
+            parent, child = context.Pipe()
+            process = context.Process(
+                target=_work,
+                args=(child, parser_manager, serialiser, sample_every),
+                name=f"parse-{i}",
+                daemon=True,
+            )
+            process.start()
+            child.close()
+            self._connections.append(parent)
+            self._processes.append(process)
+
+        self._lock = threading.Lock()
+        self.broken: bool = False
+
+    @property
+    def workers(self) -> int:
+        return len(self._processes)
+
+    def reserve(self) -> bool:
+        """
+        :return: Whether the pool was reserved for an object, which must release it once parsed
+        """
+        return not self.broken and self._lock.acquire(blocking=False)
+
+    def release(self) -> None:
+        self._lock.release()
+
+    def parse(
+        self,
+        log_path: str,
+        blocks: Iterable[Tuple[T, str]],
+        metrics: Optional[ShipMetrics] = None,
+    ) -> Iterator[Tuple[T, ParsedBlock]]:
+        """
+        :param log_path: The bucket and key of the object, which chooses its parser
+        :param blocks: The blocks to parse, each with a tag which is returned with its result
+        :param metrics: Times waiting on the workers, and accumulates the stages they timed
+        :return: The result of each block, in order
+        :raises RuntimeError: If a block couldn't be parsed, or a worker died
+        """
+        blocks = iter(blocks)
+        pending: Deque[Tuple[T, int]] = deque()
+        next_worker = 0
+
+        def send() -> None:
+            nonlocal next_worker
+            tagged = next(blocks, None)
+            if tagged is None:
+                return
+            tag, block = tagged
+            try:
+                self._connections[next_worker].send((log_path, block))
+            except OSError as e:
+                self.broken = True
+                raise RuntimeError(f"Parse worker {next_worker} died: {e!r}") from e
+            pending.append((tag, next_worker))
+            next_worker = (next_worker + 1) % self.workers
+
+        try:
+            while len(pending) < self.workers:
+                before = len(pending)
+                send()
+                if len(pending) == before:
+                    break
+
+            while pending:
+                tag, worker = pending[0]
+                result = self._receive(worker, metrics)
+                pending.popleft()
+
+                # The worker just received from is the next in turn
+                send()
+
+                if isinstance(result, Exception):
+                    raise result
+                if metrics is not None and result.metrics is not None:
+                    metrics.merge(result.metrics)
+                yield tag, result
+        finally:
+            # Results still to come are received, leaving the pipes ready for the next object
+            for _, worker in pending:
+                try:
+                    self._receive(worker)
+                except RuntimeError:
+                    pass
+
+    def _receive(self, worker: int, metrics: Optional[ShipMetrics] = None):
+        try:
+            if metrics is None:
+                return self._connections[worker].recv()
+            with metrics.timer("parse_wait"):
+                return self._connections[worker].recv()
+        except (EOFError, OSError) as e:
+            self.broken = True
+            raise RuntimeError(f"Parse worker {worker} died: {e!r}") from e
+
+    def close(self) -> None:
+        """
+        Stops the workers.
+        """
+        self.broken = True
+        for connection in self._connections:
+            try:
+                connection.send(None)
+            except OSError:
+                pass
+        for process in self._processes:
+            process.join(timeout=1)
+            if process.is_alive():
+                process.terminate()
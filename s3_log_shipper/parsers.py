@@ -1,13 +1,67 @@
 import json
+import logging
 import os
-from dataclasses import dataclass
-from datetime import datetime
+import re
+import threading
+from dataclasses import dataclass, field
+from functools import lru_cache
 from pathlib import Path
-from typing import Optional, List, Tuple
+from typing import Optional, List, Tuple, Dict, Pattern, Iterator, Callable, Union
 
 from pygrok import Grok
 
 import s3_log_shipper
+from s3_log_shipper.bundle import CompiledGrok, PatternBundle, source_checksum
+from s3_log_shipper.filters import LineFilter
+from s3_log_shipper.multiline import MultilineAssembler
+from s3_log_shipper.optimiser import compile_optimised, compile_regex, mismatches
+from s3_log_shipper.timestamps import TimestampConverter
+
+log: logging.Logger = logging.getLogger(__name__)
+
+# A grok built by pygrok, or loaded from a pattern bundle
+AnyGrok = Union[Grok, CompiledGrok]
+
+
+def make_grok(
+    expression: str, groks_dir: str, bundle: Optional[PatternBundle] = None
+) -> AnyGrok:
+    """
+    Builds a grok from the pattern bundle, or with pygrok when there is no bundle or it doesn't have the expression.
+    :param expression: The grok expression
+    :param groks_dir: A directory to find additional grok patterns
+    :param bundle: The pattern bundle, if one was loaded
+    :return: The grok
+    """
+    if bundle is not None:
+        grok = bundle.grok(expression)
+        if grok is not None:
+            return grok
+    return Grok(expression, custom_patterns_dir=groks_dir)
+
+
+class LazyGrok:
+    """
+    A grok which is only built the first time it is matched, as pygrok reads every pattern file to build one.
+    """
+
+    def __init__(
+        self, expression: str, groks_dir: str, bundle: Optional[PatternBundle] = None
+    ) -> None:
+        """
+        :param expression: The grok expression
+        :param groks_dir: A directory to find additional grok patterns
+        :param bundle: The pattern bundle, if one was loaded
+        """
+        self.pattern: str = expression
+        self._groks_dir: str = groks_dir
+        self._bundle: Optional[PatternBundle] = bundle
+        self._grok: Optional[AnyGrok] = None
+
+    def match(self, text: str) -> Optional[dict]:
+        if self._grok is None:
+            self._grok = make_grok(self.pattern, self._groks_dir, self._bundle)
+        return self._grok.match(text)
 
 
 @dataclass
@@ -17,9 +71,23 @@ class Parser:
     """
 
     type: str
-    log_grok: Grok
-    path_groks: List[Grok]
+    log_grok: AnyGrok
+    path_groks: List[Union[AnyGrok, LazyGrok]]
     strptime_pattern: str
+    timestamp_converter: TimestampConverter = field(
+        default=None, compare=False, repr=False  # type: ignore
+    )
+    line_filter: Optional[LineFilter] = field(default=None, compare=False, repr=False)
+    multiline: Optional[MultilineAssembler] = field(
+        default=None, compare=False, repr=False
+    )
+    _multiline_regex: Optional[Pattern] = field(
+        default=None, init=False, compare=False, repr=False
+    )
+
+    def __post_init__(self) -> None:
+        if self.timestamp_converter is None:
+            self.timestamp_converter = TimestampConverter(self.strptime_pattern)
 
     def match_path(self, log_path: str) -> Optional[dict]:
         """
@@ -34,12 +102,34 @@ class Parser:
 
         dicts = [i for i in results if i]
 
-        return {key: value for d in dicts for key, value in d.items()}
+        return self.project({key: value for d in dicts for key, value in d.items()})
 
-    def parse_log(self, log_entry: str) -> Optional[dict]:
+    def project(self, fields: dict) -> dict:
+        """
+        :param fields: The fields of a log line, or matched from a log path
+        :return: Only the fields configured to be shipped
+        """
+        return fields if self.line_filter is None else self.line_filter.project(fields)
+
+    def prefilter(self, buffer: str) -> Tuple[str, int]:
+        """
+        Drops the lines of a buffer of log entries which the drop rules say shouldn't be shipped, before grokking it.
+        :param buffer: newline separated log entries
+        :return: The entries to grok, and the number of entries dropped
+        """
+        return (
+            (buffer, 0) if self.line_filter is None else self.line_filter.apply(buffer)
+        )
+
+    def parse_log(
+        self,
+        log_entry: str,
+        convert_timestamp: Optional[Callable[[str], str]] = None,
+    ) -> Optional[dict]:
         """
         Attempts to parse the log entry using the log grok expression
         :param log_entry: the log entry to test
+        :param convert_timestamp: Converts the timestamp in place of the parser's own converter, e.g. to time it
         :return: A dictionary of the matches if any found, else None
         """
         match = self.log_grok.match(log_entry)
@@ -47,17 +137,306 @@ class Parser:
         if match is None:
             return None
 
+        return self._normalise(match, convert_timestamp)
+
+    def parse_many(
+        self,
+        buffer: str,
+        convert_timestamp: Optional[Callable[[str], str]] = None,
+    ) -> Iterator[Tuple[int, Optional[dict]]]:
+        """
+        Parses every line in a buffer of log entries with a single multiline regex scan, rather than a match per line.
+        :param buffer: newline separated log entries
+        :param convert_timestamp: Converts the timestamp in place of the parser's own converter, e.g. to time it
+        :return: The offset of each line in the buffer, in order, with a dictionary of its matches or None if it
+        doesn't match
+        """
+        regex = self._multiline_regex
+        if regex is None:
+            regex = self._multiline_regex = self._compile_multiline()
+
+        pos = 0
+        end = len(buffer)
+
+        while pos < end:
+            for match in regex.finditer(buffer, pos):
+                start = match.start()
+
+                # Every line skipped over by the scan failed to match
+                while pos < start:
+                    yield pos, None
+                    pos = buffer.index("\n", pos) + 1
+
+                line_end = buffer.find("\n", start)
+                if line_end == -1:
+                    line_end = end
+
+                if match.end() > line_end:
+                    # Matched across a newline, which a single line can't, so match the line alone and rescan after it
+                    next_line = line_end + 1
+                    yield start, self.parse_log(
+                        buffer[start:next_line], convert_timestamp
+                    )
+                    pos = next_line
+                    break
+
+                yield start, self._normalise(
+                    self._convert_types(match.groupdict()), convert_timestamp
+                )
+                pos = line_end + 1
+            else:
+                while pos < end:
+                    yield pos, None
+                    pos = buffer.find("\n", pos) + 1 or end
+
+    def _compile_multiline(self) -> Pattern:
+        pattern: str = self.log_grok.regex_obj.pattern
+        if not pattern.startswith("^"):
+            # Finds the leftmost match in each line, as an unanchored search of the line would
+            pattern = f"^[^\\n]*?(?:{pattern})"
+        return compile_regex(f"(?m){pattern}")
+
+    def _convert_types(self, match: dict) -> dict:
+        # As pygrok does for %{PATTERN:name:type}
+        for key, type_name in self.log_grok.type_mapper.items():
+            value = match.get(key)
+            if value is not None and type_name == "int":
+                match[key] = int(value)
+            elif value is not None and type_name == "float":
+                match[key] = float(value)
+        return match
+
+    def _normalise(
+        self, match: dict, convert_timestamp: Optional[Callable[[str], str]] = None
+    ) -> dict:
         if "timestamp" in match:
-            match["timestamp"] = datetime.strptime(
-                match["timestamp"], self.strptime_pattern
-            ).isoformat()
+            convert = convert_timestamp or self.timestamp_converter
+            match["timestamp"] = convert(match["timestamp"])
 
             # Rename for elasticsearch
             match["@timestamp"] = match.pop("timestamp")
 
         match["type"] = self.type
 
-        return match
+        if self.multiline is not None:
+            match = self.multiline.restore(match)
+
+        return self.project(match)
+
+
+def _top_level(regex: str) -> List[Tuple[int, str]]:
+    """
+    Lists the unescaped characters of a regex or grok expression that aren't nested in a group, class or reference.
+    """
+    depth = 0
+    top_level: List[Tuple[int, str]] = list()
+    i = 0
+    while i < len(regex):
+        c = regex[i]
+        if c == "\\":
+            # An escaped slash is still a path separator
+            if depth == 0 and regex.startswith("/", i + 1):
+                top_level.append((i + 1, "/"))
+            i += 2
+            continue
+        if c in "([{":
+            depth += 1
+        elif c in ")]}":
+            depth -= 1
+        elif depth == 0:
+            top_level.append((i, c))
+        i += 1
+
+    return top_level if depth == 0 else [(-1, "|")]
+
+
+def split_path_grok(grok: str) -> Optional[Tuple[str, str]]:
+    """
+    Splits a path grok into the part matching the directory of a path and the part matching its basename.
+    :param grok: A path grok expression
+    :return: A tuple of the directory grok and the basename regex, or None if the grok can't be split safely
+    """
+    top_level = _top_level(grok)
+
+    if any(c == "|" for _, c in top_level):
+        return None
+
+    slashes = [i for i, c in top_level if c == "/"]
+    if not slashes:
+        return None
+
+    directory = grok[: slashes[-1]]
+    basename_start = slashes[-1] + 1
+    basename = grok[basename_start:]
+
+    if directory.endswith("\\"):
+        directory = directory[:-1]
+
+    # Captures in the basename, or a basename that might span directories, can only be matched on the whole path
+    if "%{" in basename or "/" in basename or not directory:
+        return None
+
+    return directory, basename
+
+
+def literal_suffix(regex: str) -> str:
+    """
+    Finds the literal text that any match of a regex must end with.
+    :param regex: The regex to inspect
+    :return: The literal suffix, which may be empty
+    """
+    if any(c == "|" for _, c in _top_level(regex)):
+        return ""
+
+    suffix: List[str] = []
+    i = len(regex) - 1
+    while i >= 0:
+        c = regex[i]
+        escaped = i > 0 and regex[i - 1] == "\\" and (i < 2 or regex[i - 2] != "\\")
+        if escaped and not c.isalnum():
+            suffix.append(c)
+            i -= 2
+        elif not escaped and (c.isalnum() or c in "-_/ ,:@=<>!'\"%&~`"):
+            suffix.append(c)
+            i -= 1
+        else:
+            break
+
+    return "".join(reversed(suffix))
+
+
+class PathIndex:
+    """
+    A dispatch index over the parsers' path groks, built once up front.
+    Path groks are split into a cheap basename regex and a directory grok. Directory groks are shared between parsers,
+    prefiltered on their literal suffix, and their matches are cached per directory. Repeated keys from the same
+    cluster/node therefore skip directory matching entirely.
+    A basename regex may match across slashes, as `oozie.log.*.gz` does `oozie.log.1.gz/x`, so every ancestor of a
+    path ending with the literal suffix is tried, deepest first, as the whole grok would.
+    pygrok reads every pattern file to build a grok, so groks are only built the first time they are tried.
+    """
+
+    def __init__(
+        self,
+        path_groks: List[List[str]],
+        groks_dir: str,
+        cache_size: int,
+        bundle: Optional[PatternBundle] = None,
+    ) -> None:
+        """
+        :param path_groks: The path grok expressions of each parser
+        :param groks_dir: A directory to find additional grok patterns
+        :param cache_size: The number of directories to cache matches for
+        :param bundle: The pattern bundle to load groks from, rather than building them with pygrok
+        """
+        self._groks_dir: str = groks_dir
+        self._bundle: Optional[PatternBundle] = bundle
+        self._groks: Dict[str, AnyGrok] = dict()
+        self._directory_suffixes: Dict[str, str] = dict()
+        self._entries: List[List[Tuple[str, Optional[str], Optional[Pattern]]]] = list()
+
+        for expressions in path_groks:
+            matchers: List[Tuple[str, Optional[str], Optional[Pattern]]] = list()
+            for expression in expressions:
+                split = split_path_grok(expression)
+                if split is None:
+                    matchers.append((expression, None, None))
+                    continue
+
+                directory, basename = split
+                if directory not in self._directory_suffixes:
+                    # With the slash after it, which the directory grok itself doesn't match
+                    self._directory_suffixes[
+                        directory
+                    ] = f"{literal_suffix(directory)}/"
+                matchers.append((expression, directory, re.compile(basename)))
+            self._entries.append(matchers)
+
+        self._directory_matches = lru_cache(maxsize=cache_size)(
+            self._new_directory_matches
+        )
+
+    @staticmethod
+    def _new_directory_matches(directory: str) -> Dict[str, Optional[dict]]:
+        # Populated lazily, as only directory groks whose basename matched are ever tried.
+        return dict()
+
+    def expressions(self) -> List[str]:
+        """
+        :return: Every path grok expression, and the directory grok of each one that was split
+        """
+        expressions: List[str] = list()
+        for matchers in self._entries:
+            for expression, directory_grok, _ in matchers:
+                expressions.append(expression)
+                if directory_grok is not None:
+                    expressions.append(f"{directory_grok}$")
+        return list(dict.fromkeys(expressions))
+
+    def build(self) -> None:
+        """
+        Builds every grok the index could try, rather than the first time each one is tried.
+        """
+        for matchers in self._entries:
+            for expression, directory_grok, _ in matchers:
+                self._grok(
+                    expression if directory_grok is None else f"{directory_grok}$"
+                )
+
+    def _grok(self, expression: str) -> AnyGrok:
+        grok = self._groks.get(expression)
+        if grok is None:
+            grok = self._groks[expression] = make_grok(
+                expression, self._groks_dir, self._bundle
+            )
+        return grok
+
+    def _match_directory(self, directory_grok: str, directory: str) -> Optional[dict]:
+        matches = self._directory_matches(directory)
+        if directory_grok not in matches:
+            grok = self._grok(f"{directory_grok}$")
+            matches[directory_grok] = grok.match(directory)
+        return matches[directory_grok]
+
+    def _match_split(
+        self, directory_grok: str, basename_regex: Pattern, log_path: str
+    ) -> Optional[dict]:
+        # Only the directories ending with the literal suffix of the directory grok are tried
+        suffix = self._directory_suffixes[directory_grok]
+        end = len(log_path)
+        while True:
+            found = log_path.rfind(suffix, 0, end)
+            if found == -1:
+                return None
+
+            slash = found + len(suffix) - 1
+            if slash > 0 and basename_regex.match(log_path, slash + 1):
+                matches = self._match_directory(directory_grok, log_path[:slash])
+                if matches is not None:
+                    return matches
+            end = slash
+
+    def match(self, log_path: str) -> Optional[Tuple[int, dict]]:
+        """
+        Finds the first parser with a path grok matching a log path.
+        :param log_path: The path to the log file
+        :return: The index of the parser and the matches from its path groks, or None if no parser matches
+        """
+        for index, matchers in enumerate(self._entries):
+            results: List[Optional[dict]] = list()
+            for expression, directory_grok, basename_regex in matchers:
+                if directory_grok is None or basename_regex is None:
+                    results.append(self._grok(expression).match(log_path))
+                else:
+                    results.append(
+                        self._match_split(directory_grok, basename_regex, log_path)
+                    )
+
+            dicts = [i for i in results if i]
+            if dicts:
+                return index, {key: value for d in dicts for key, value in d.items()}
+
+        return None
 
 
 class ParserManager:
@@ -70,31 +449,58 @@ class ParserManager:
         self,
         config_file: Path,
         groks_dir=f"{os.path.dirname(s3_log_shipper.__file__)}/groks",
+        path_cache_size: int = 1024,
+        bundle_file: Optional[Path] = None,
     ) -> None:
+        """
+        :param config_file: The parser config file
+        :param groks_dir: A directory to find additional grok patterns
+        :param path_cache_size: The number of directories to cache path grok matches for
+        :param bundle_file: A pattern bundle built from the config, to load the groks from rather than building them
+        with pygrok. It is ignored, with a warning, if it was built from another config or other grok patterns.
+        """
         self._config_file: Path = config_file
 
         with open(config_file.as_posix(), "rb") as cf:
-            self._config: dict = json.load(cf)
+            config = cf.read()
+        self._config: dict = json.loads(config)
 
         if "files" not in self._config:
             raise ValueError('Config file format must contain top level "files" array.')
 
-        parsers: List[Parser] = list()
-        for file in self._config["files"]:
-            parser: Parser = ParserManager.make_parser(file, groks_dir)
-            parsers.append(parser)
+        self.checksum: str = source_checksum(config, groks_dir)
+        self._bundle: Optional[PatternBundle] = None
+        if bundle_file is not None:
+            try:
+                self._bundle = PatternBundle.load(bundle_file, self.checksum)
+            except (OSError, ValueError) as e:
+                log.warning(
+                    f"Building groks with pygrok, as the pattern bundle can't be used: {e}"
+                )
 
-        self._filters = parsers
+        # Parsers are built the first time a log path matches them, as most invocations only need one
+        self._groks_dir: str = groks_dir
+        self._parsers: List[Optional[Parser]] = [None] * len(self._config["files"])
+        self._lock = threading.Lock()
+        self._index = PathIndex(
+            [file["path"] for file in self._config["files"]],
+            groks_dir,
+            path_cache_size,
+            self._bundle,
+        )
 
     def __get__(self, obj, typ=None):
         return getattr(obj, self.name)
 
     @staticmethod
-    def make_parser(file: dict, groks_dir: str) -> Parser:
+    def make_parser(
+        file: dict, groks_dir: str, bundle: Optional[PatternBundle] = None
+    ) -> Parser:
         """
         Builds a parser from a config file entry and a directory of extra grok expressions.
         :param file: A single `file` element from the array within the config file.
         :param groks_dir: A directory to find additional grok patterns
+        :param bundle: A pattern bundle to load the groks from, already optimised, where it has them
         :return: A parser for the specified configuration
         """
 
@@ -105,7 +511,8 @@ class ParserManager:
 
         type: str = file["type"]
         strptime_pattern: str = file["strptime"]
-        groks = [Grok(grok, custom_patterns_dir=groks_dir) for grok in file["path"]]
+        # Paths are matched by the path index, so the parser's own path groks are rarely needed
+        groks = [LazyGrok(grok, groks_dir, bundle) for grok in file["path"]]
 
         if "grok" in file:
             grok_name = file["grok"]
@@ -114,21 +521,130 @@ class ParserManager:
             # Grok patterns don't support hyphenation
             grok_name = "%%{%s}" % type.upper().replace("-", "")
 
+        line_filter = LineFilter.from_config(file.get("filter"))
+        multiline = MultilineAssembler.from_config(file.get("multiline"))
+
+        bundled = None if bundle is None else bundle.log_grok(type, grok_name)
+        if bundled is not None:
+            return Parser(
+                type,
+                bundled,
+                groks,
+                strptime_pattern,
+                line_filter=line_filter,
+                multiline=multiline,
+            )
+
+        log_grok = Grok(grok_name, custom_patterns_dir=groks_dir)
+
+        if file.get("optimise", True):
+            # Captures which aren't shipped needn't be captured at all
+            optimised = compile_optimised(
+                log_grok.regex_obj,
+                file.get("samples", []),
+                line_filter.captures() if line_filter else None,
+            )
+            if optimised is None:
+                log.warning(
+                    f"Grok for {type} could not be optimised, or disagreed with the original on its samples"
+                )
+            else:
+                log_grok.regex_obj = optimised
+
         return Parser(
             type,
-            Grok(grok_name, custom_patterns_dir=groks_dir),
+            log_grok,
             groks,
             strptime_pattern,
+            line_filter=line_filter,
+            multiline=multiline,
         )
 
+    def parser(self, index: int) -> Parser:
+        """
+        Builds the parser for an entry in the config file, or returns it if it has already been built.
+        :param index: The position of the entry in the config file
+        :return: The parser
+        """
+        parser = self._parsers[index]
+        if parser is None:
+            with self._lock:
+                parser = self._parsers[index]
+                if parser is None:
+                    parser = self._parsers[index] = ParserManager.make_parser(
+                        self._config["files"][index], self._groks_dir, self._bundle
+                    )
+        return parser
+
+    def parsers(self) -> List[Parser]:
+        """
+        Builds every parser in the config file.
+        :return: The parsers, in the order of the config file
+        """
+        return [self.parser(index) for index in range(len(self._parsers))]
+
+    def build(self) -> None:
+        """
+        Builds every parser, and every path grok, up front. Processes forked afterwards inherit them, rather than each
+        building them again.
+        """
+        self.parsers()
+        self._index.build()
+
     def get_parser(self, log_path: str) -> Optional[Tuple[Parser, Optional[dict]]]:
         """
         Retrieves a parser for a given log path
         :param log_path: The path to the log file
         :return: If a parser matches; A tuple of the parser and any matches from the path grok; else None
         """
-        for flt in self._filters:
-            match = flt.match_path(log_path)
-            if match:
-                return flt, match
-        return None
+        match = self._index.match(log_path)
+        if match is None:
+            return None
+
+        index, path_groks = match
+        parser = self.parser(index)
+        return parser, parser.project(path_groks)
+
+    def build_bundle(self) -> PatternBundle:
+        """
+        Expands every grok in the config with pygrok, and optimises the log groks, into a bundle which can be loaded
+        in place of doing so again.
+        :return: The bundle
+        :raises ValueError: If a log grok, as loaded from the bundle, disagrees with pygrok on its samples
+        """
+        groks: Dict[str, dict] = dict()
+        for expression in self._index.expressions():
+            grok = Grok(expression, custom_patterns_dir=self._groks_dir)
+            groks[expression] = {
+                "regex": grok.regex_obj.pattern,
+                "types": grok.type_mapper,
+            }
+
+        parsers: Dict[str, dict] = dict()
+        for file in self._config["files"]:
+            parser = ParserManager.make_parser(file, self._groks_dir)
+            bundled = CompiledGrok(
+                parser.log_grok.pattern,
+                parser.log_grok.regex_obj.pattern,
+                parser.log_grok.type_mapper,
+            )
+
+            # The bundled regex is compiled with the standard library where it can be, rather than the regex module
+            original = Grok(
+                parser.log_grok.pattern, custom_patterns_dir=self._groks_dir
+            )
+            different = mismatches(
+                original.regex_obj, bundled.regex_obj, file.get("samples", [])
+            )
+            if different:
+                raise ValueError(
+                    f"Bundled grok for {parser.type} disagrees with pygrok on: {different}"
+                )
+
+            parsers[parser.type] = {
+                "grok": bundled.pattern,
+                "regex": bundled.regex_obj.pattern,
+                "types": bundled.type_mapper,
+            }
+
+        return PatternBundle(self.checksum, groks, parsers)
@@ -0,0 +1,300 @@
+import codecs
+import io
+import queue
+import threading
+import zlib
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Deque, Iterable, Iterator, List, Optional
+
+from botocore.client import BaseClient
+from botocore.exceptions import ClientError
+
+from s3_log_shipper.metrics import ShipMetrics, TimedReader
+
+DEFAULT_READ_AHEAD = 4
+# Compressed bodies are read in small chunks, which inflate to far more, so inflating starts as soon as possible
+DEFAULT_COMPRESSED_READ_SIZE = 64 * 1024
+DEFAULT_RANGE_WORKERS = 4
+
+# Accepts the gzip header and trailer of each member, as gzip.open does
+GZIP_WBITS = 16 + zlib.MAX_WBITS
+
+# How often a stage blocked on a full queue checks whether the stream was closed
+_POLL_SECONDS = 0.1
+
+_END = object()
+
+
+def inflate(chunks: Iterable[bytes], max_length: int) -> Iterator[bytes]:
+    """
+    Inflates a gzip stream, of one or more members, with zlib directly rather than through a GzipFile.
+    :param chunks: The compressed stream, in chunks of any size
+    :param max_length: The most bytes inflated at a time, however well the stream compresses
+    :return: The inflated stream, in chunks of at most `max_length` bytes
+    :raises EOFError: If the stream ends part way through a member
+    """
+    decompressor = zlib.decompressobj(GZIP_WBITS)
+    fed = False
+
+    for data in chunks:
+        fed = fed or bool(data)
+        while True:
+            inflated = decompressor.decompress(data, max_length)
+            if inflated:
+                yield inflated
+
+            if decompressor.eof:
+                # The rest is the next member
+                data = decompressor.unused_data
+                decompressor = zlib.decompressobj(GZIP_WBITS)
+                fed = bool(data)
+                if not data:
+                    break
+            else:
+                data = decompressor.unconsumed_tail
+                # Output cut at max_length may have more to come, even once all the input was taken
+                if not data and len(inflated) < max_length:
+                    break
+
+    if fed and not decompressor.eof:
+        raise EOFError(
+            "Compressed file ended before the end-of-stream marker was reached"
+        )
+
+
+def body_chunks(body: Any, read_size: int, metrics: ShipMetrics) -> Iterator[bytes]:
+    """
+    :param body: The streaming body of an S3 object
+    :param read_size: The number of bytes to read at a time
+    :param metrics: Times the download, and counts the bytes downloaded
+    :return: The body, in chunks of at most `read_size` bytes
+    """
+    timed_body = TimedReader(body, metrics, "download", "bytes_in")
+    while True:
+        data = timed_body.read(read_size)
+        if not data:
+            return
+        yield data
+
+
+def ranged_chunks(
+    s3_client: BaseClient,
+    bucket: str,
+    key: str,
+    range_size: int,
+    read_size: int,
+    metrics: ShipMetrics,
+    workers: int = DEFAULT_RANGE_WORKERS,
+) -> Iterator[bytes]:
+    """
+    Downloads an S3 object as several ranged GETs in parallel, a few ranges ahead of the ranges being read.
+    Every range is of the same version of the object as the first.
+    :param s3_client: The S3 client to download with
+    :param bucket: The bucket of the object
+    :param key: The key of the object
+    :param range_size: The number of bytes to download in each GET
+    :param read_size: The size of the chunks each range is cut into
+    :param metrics: Times waiting on the download, and counts the bytes downloaded
+    :param workers: The number of ranges downloaded at once
+    :return: The object, in order, in chunks of at most `read_size` bytes
+    """
+
+    def get(start: int, if_match: Optional[str] = None) -> dict:
+        params = dict(
+            Bucket=bucket, Key=key, Range=f"bytes={start}-{start + range_size - 1}"
+        )
+        if if_match is not None:
+            params["IfMatch"] = if_match
+        return s3_client.get_object(**params)
+
+    with metrics.timer("download"):
+        try:
+            first = get(0)
+        except ClientError as e:
+            # An empty object has no first byte to start the range at
+            if e.response.get("Error", {}).get("Code") == "InvalidRange":
+                return
+            raise
+        data = first["Body"].read()
+
+    size = int(first["ContentRange"].rpartition("/")[2])
+    e_tag = first.get("ETag")
+
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="s3-range") as pool:
+        starts = iter(range(range_size, size, range_size))
+        pending: Deque[Future] = deque()
+
+        while True:
+            # Bounds the ranges held in memory, whether downloading or downloaded and waiting to be read
+            while len(pending) < workers:
+                start = next(starts, None)
+                if start is None:
+                    break
+                pending.append(
+                    pool.submit(lambda s: get(s, e_tag)["Body"].read(), start)
+                )
+
+            metrics.count("bytes_in", len(data))
+            for offset in range(0, len(data), read_size):
+                end = offset + read_size
+                yield data[offset:end]
+
+            if not pending:
+                return
+            with metrics.timer("download"):
+                data = pending.popleft().result()
+
+
+class ReadAhead:
+    """
+    Reads a text stream from the chunks of an S3 object on a thread of its own, inflating and decoding them a few
+    chunks ahead of the reader, so the download and inflate of the next chunks overlap with the parsing and shipping
+    of this one. zlib and socket reads release the GIL, so they run alongside grokking on the reader's thread.
+    At most `read_ahead` decoded chunks are waiting at once, however large the object.
+    """
+
+    def __init__(
+        self,
+        chunks: Iterator[bytes],
+        gzipped: bool,
+        read_size: int,
+        metrics: ShipMetrics,
+        read_ahead: int = DEFAULT_READ_AHEAD,
+        body: Optional[Any] = None,
+    ) -> None:
+        """
+        :param chunks: The object's body
+        :param gzipped: Whether the body is gzipped, in which case its line endings are all read as newlines
+        :param read_size: The most characters in each chunk read
+        :param metrics: Times the inflate and decode, and the reader waiting for them
+        :param read_ahead: The number of decoded chunks which may be waiting to be read
+        :param body: The body the chunks are read from, if any, which is closed with the stream
+        """
+        if read_ahead < 1:
+            raise ValueError(f"Read ahead must be positive. Found: {read_ahead}")
+
+        self._chunks: Iterator[bytes] = chunks
+        self._body: Optional[Any] = body
+        self._gzipped: bool = gzipped
+        self._read_size: int = read_size
+        self._metrics: ShipMetrics = metrics
+        self._queue: "queue.Queue[Any]" = queue.Queue(maxsize=read_ahead)
+        self._closed = threading.Event()
+        self._done: bool = False
+        self._thread = threading.Thread(
+            target=self._run, name="s3-read-ahead", daemon=True
+        )
+        self._thread.start()
+
+    def _run(self) -> None:
+        try:
+            decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+            if self._gzipped:
+                # Reads "\r\n" and "\r" as "\n", as gzip.open's text mode did
+                decoder = io.IncrementalNewlineDecoder(decoder, translate=True)
+            data = (
+                inflate(self._chunks, self._read_size)
+                if self._gzipped
+                else self._chunks
+            )
+
+            # Small chunks are put together into one of up to `read_size` characters, as the reader reads a block
+            pieces: List[str] = []
+            size = 0
+
+            while not self._closed.is_set():
+                # Includes the download, which is accounted to a stage of its own
+                with self._metrics.timer("inflate"):
+                    chunk = next(data, None)
+                    text = decoder.decode(chunk or b"", final=chunk is None)
+
+                if size + len(text) > self._read_size and pieces:
+                    self._put("".join(pieces))
+                    pieces = []
+                    size = 0
+                if text:
+                    pieces.append(text)
+                    size += len(text)
+                if chunk is None:
+                    break
+
+            if pieces:
+                self._put("".join(pieces))
+
+            self._put(_END)
+        except BaseException as e:
+            self._put(e)
+        finally:
+            close = getattr(self._chunks, "close", None)
+            if close is not None:
+                close()
+
+    def _put(self, item: Any) -> None:
+        while not self._closed.is_set():
+            try:
+                self._queue.put(item, timeout=_POLL_SECONDS)
+                return
+            except queue.Full:
+                continue
+
+    def read(self, size: int = -1) -> str:
+        """
+        :param size: Ignored. Chunks are read as they were inflated and decoded.
+        :return: The next decoded chunk, of at most `read_size` characters, or "" at the end of the stream
+        :raises Exception: Whatever reading, inflating or decoding the stream raised
+        """
+        if self._done:
+            return ""
+
+        with self._metrics.timer("read_wait"):
+            item = self._queue.get()
+
+        if item is _END:
+            self._done = True
+            return ""
+        if isinstance(item, BaseException):
+            self._done = True
+            raise item
+        return item
+
+    def close(self) -> None:
+        """
+        Stops reading ahead, waiting for the chunk being read to finish, and closes the body.
+        """
+        self._closed.set()
+        self._thread.join()
+        if self._body is not None:
+            self._body.close()
+
+    def __enter__(self) -> "ReadAhead":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+
+class ClosingReader:
+    """
+    Wraps a text stream read from an S3 object's body, closing the body along with the stream. A GzipFile leaves the
+    file object it reads open.
+    """
+
+    def __init__(self, stream: Any, body: Any) -> None:
+        self.stream = stream
+        self.body = body
+
+    def read(self, size: int = -1) -> str:
+        return self.stream.read(size)
+
+    def close(self) -> None:
+        try:
+            self.stream.close()
+        finally:
+            self.body.close()
+
+    def __enter__(self) -> "ClosingReader":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
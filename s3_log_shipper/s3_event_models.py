@@ -1,8 +1,8 @@
+import json
 from dataclasses import dataclass
 from datetime import datetime
-from typing import Any, List, TypeVar, Type, cast, Callable
-
-import dateutil.parser
+from typing import Any, List, Optional, TypeVar, Type, cast, Callable
+from urllib.parse import quote_plus, unquote_plus
 
 T = TypeVar("T")
 
@@ -23,9 +23,27 @@ def from_int(x: Any) -> int:
 
 
 def from_datetime(x: Any) -> datetime:
+    # S3 event times are ISO 8601 in UTC, e.g. 2020-04-28T05:58:34.602Z, which don't need dateutil, a slow import
+    if isinstance(x, str) and x.endswith("Z"):
+        try:
+            return datetime.fromisoformat(f"{x[:-1]}+00:00")
+        except ValueError:
+            pass
+
+    import dateutil.parser
+
     return dateutil.parser.parse(x)
 
 
+def from_key(x: Any) -> str:
+    # S3 sends object keys URL encoded, with spaces as +
+    return unquote_plus(from_str(x))
+
+
+def to_key(x: str) -> str:
+    return quote_plus(x, safe="/")
+
+
 def from_list(f: Callable[[Any], T], x: Any) -> List[T]:
     assert isinstance(x, list)
     return [f(y) for y in x]
@@ -114,7 +132,7 @@ class Object:
     @staticmethod
     def from_dict(obj: Any) -> "Object":
         assert isinstance(obj, dict)
-        key = from_str(obj.get("key"))
+        key = from_key(obj.get("key"))
         size = from_int(obj.get("size"))
         e_tag = from_str(obj.get("eTag"))
         sequencer = from_str(obj.get("sequencer"))
@@ -122,7 +140,7 @@ class Object:
 
     def to_dict(self) -> dict:
         result: dict = {}
-        result["key"] = from_str(self.key)
+        result["key"] = to_key(from_str(self.key))
         result["size"] = from_int(self.size)
         result["eTag"] = from_str(self.e_tag)
         result["sequencer"] = from_str(self.sequencer)
@@ -228,3 +246,91 @@ def s3_event_from_dict(s: Any) -> S3Event:
 
 def s3_event_to_dict(x: S3Event) -> Any:
     return to_class(S3Event, x)
+
+
+class ObjectRecord:
+    """
+    The fields of an S3 event record needed to ship its object, read straight from the event.
+    The full `Record`, with its nested dataclasses and parsed event time, is only decoded if asked for.
+    """
+
+    __slots__ = ("bucket", "key", "size", "e_tag", "sequencer", "_raw", "_record")
+
+    def __init__(self, raw: dict) -> None:
+        """
+        :param raw: A record of an S3 event
+        """
+        s3 = raw["s3"]
+        obj = s3["object"]
+        self.bucket: str = s3["bucket"]["name"]
+        self.key: str = unquote_plus(obj["key"])
+        self.size: int = obj.get("size", 0)
+        # Versions of an object without an eTag can't be told apart, so are never deduplicated or resumed
+        self.e_tag: Optional[str] = obj.get("eTag") or None
+        self.sequencer: str = obj.get("sequencer", "")
+        self._raw: dict = raw
+        self._record: Optional[Record] = None
+
+    @property
+    def record(self) -> Record:
+        if self._record is None:
+            self._record = Record.from_dict(self._raw)
+        return self._record
+
+    def to_dict(self) -> dict:
+        return self._raw
+
+    def __repr__(self) -> str:
+        return f"ObjectRecord(bucket={self.bucket!r}, key={self.key!r}, size={self.size}, e_tag={self.e_tag!r})"
+
+
+def object_records(event: dict) -> List[ObjectRecord]:
+    """
+    Decodes just what is needed to ship the objects of an S3 event, without building an `S3Event`.
+    :param event: The S3 event
+    :return: The object of each record in the event, in order
+    """
+    return [ObjectRecord(raw) for raw in event["Records"]]
+
+
+def is_sqs_event(event: dict) -> bool:
+    """
+    :return: Whether the event is a batch of SQS messages, rather than an S3 event
+    """
+    records = event.get("Records")
+    return bool(records) and records[0].get("eventSource") == "aws:sqs"
+
+
+def message_object_records(message: dict) -> List[ObjectRecord]:
+    """
+    Decodes the S3 event in the body of an SQS message, sent to the queue by S3 directly or through an SNS topic.
+    :param message: A record of an SQS event
+    :return: The object of each record in the S3 event, which has none for the test event S3 sends on subscribing
+    :raises ValueError: If the message doesn't contain an S3 event
+    """
+    body = json.loads(message["body"])
+    if not isinstance(body, dict):
+        raise ValueError(
+            f"Expected an S3 event in SQS message {message.get('messageId')}"
+        )
+
+    if body.get("Type") == "Notification" and "Message" in body:
+        body = json.loads(body["Message"])
+        if not isinstance(body, dict):
+            raise ValueError(
+                f"Expected an S3 event in SNS notification in SQS message {message.get('messageId')}"
+            )
+
+    if "Records" not in body:
+        if body.get("Event") == "s3:TestEvent":
+            return []
+        raise ValueError(
+            f"Expected an S3 event in SQS message {message.get('messageId')}"
+        )
+
+    try:
+        return object_records(body)
+    except (KeyError, TypeError) as e:
+        raise ValueError(
+            f"Malformed S3 event in SQS message {message.get('messageId')}: {e!r}"
+        )
@@ -0,0 +1,113 @@
+import json
+from abc import ABC, abstractmethod
+from typing import Callable, Optional, Union
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+Record = Union[str, bytes]
+
+
+class Serialiser(ABC):
+    """
+    Encodes parsed log lines as JSON records for logstash.
+    The path grok fields are the same for every line in a file, so they are encoded once per file and spliced into
+    each line's record, rather than merged into every line's fields before encoding.
+    """
+
+    def __init__(self, sort_keys: bool = False) -> None:
+        self.sort_keys: bool = sort_keys
+
+    @abstractmethod
+    def encode(self, fields: dict) -> Record:
+        """
+        :param fields: The fields of a log line
+        :return: The fields as a JSON object
+        """
+
+    def bind(self, path_groks: Optional[dict]) -> Callable[[dict], Record]:
+        """
+        Builds an encoder for the lines of a single file.
+        :param path_groks: The fields matched from the file's path
+        :return: A function encoding a line's fields together with the path fields
+        """
+        if not path_groks:
+            return self.encode
+
+        path_keys = frozenset(path_groks)
+
+        if self.sort_keys:
+            # Sorted keys can't be spliced, so the fields are merged as they always were
+            def merged(fields: dict) -> Record:
+                fields.update(path_groks)
+                return self.encode(fields)
+
+            return merged
+
+        encoded_path = self.encode(path_groks)
+        fragment = encoded_path[1:-1]
+        comma = b"," if isinstance(encoded_path, bytes) else ","
+
+        def spliced(fields: dict) -> Record:
+            # The path fields win where the two overlap, which only merging can express
+            if not path_keys.isdisjoint(fields):
+                fields.update(path_groks)
+                return self.encode(fields)
+
+            encoded = self.encode(fields)
+            if len(encoded) == 2:
+                return encoded_path
+            return encoded[:-1] + comma + fragment + encoded[-1:]  # type: ignore
+
+        return spliced
+
+
+class JsonSerialiser(Serialiser):
+    """
+    Encodes records with a single pre-built standard library JSON encoder.
+    """
+
+    def __init__(self, sort_keys: bool = False, as_bytes: bool = False) -> None:
+        super().__init__(sort_keys)
+        self.as_bytes: bool = as_bytes
+        self._encoder = json.JSONEncoder(sort_keys=sort_keys, separators=(",", ":"))
+
+    def encode(self, fields: dict) -> Record:
+        encoded = self._encoder.encode(fields)
+        return encoded.encode("utf-8") if self.as_bytes else encoded
+
+
+class OrjsonSerialiser(Serialiser):
+    """
+    Encodes records with orjson, which produces UTF-8 bytes that are written to redis as they are. orjson isn't a
+    dependency of the shipper, so it is only used when asked for, and must be installed alongside it.
+    """
+
+    def __init__(self, sort_keys: bool = False) -> None:
+        if orjson is None:
+            raise ImportError("The orjson serialiser requires the orjson package")
+
+        super().__init__(sort_keys)
+        self._option: int = orjson.OPT_SORT_KEYS if sort_keys else 0
+
+    def encode(self, fields: dict) -> Record:
+        return orjson.dumps(fields, option=self._option)
+
+
+def make_serialiser(
+    name: str = "json", sort_keys: bool = False, as_bytes: bool = False
+) -> Serialiser:
+    """
+    Builds a serialiser by name.
+    :param name: "json", or "orjson", which must be installed
+    :param sort_keys: Whether to sort the keys of each record
+    :param as_bytes: Whether the json serialiser produces bytes rather than str. orjson always produces bytes.
+    :return: The serialiser
+    """
+    if name == "orjson":
+        return OrjsonSerialiser(sort_keys)
+    if name == "json":
+        return JsonSerialiser(sort_keys, as_bytes)
+    raise ValueError(f"Unknown serialiser {name}. Expected one of json, orjson.")
@@ -0,0 +1,112 @@
+import bisect
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional, Tuple
+
+from redis import StrictRedis
+
+DEFAULT_REPLICAS = 100
+DEFAULT_FLUSH_WORKERS_PER_SHARD = 4
+
+ROUND_ROBIN = "round_robin"
+
+
+def parse_endpoints(endpoints: str) -> List[Tuple[str, int]]:
+    """
+    :param endpoints: Comma separated host:port pairs, e.g. "redis-1:6379,redis-2:6379"
+    :return: The host and port of each endpoint
+    """
+    parsed: List[Tuple[str, int]] = []
+    for endpoint in endpoints.split(","):
+        host, _, port = endpoint.strip().rpartition(":")
+        if not host or not port.isdigit():
+            raise ValueError(
+                f"Redis endpoints must be comma separated host:port pairs. Found: {endpoints}"
+            )
+        parsed.append((host, int(port)))
+    return parsed
+
+
+def _hash(key: str) -> int:
+    return int.from_bytes(
+        hashlib.blake2b(key.encode("utf-8"), digest_size=8).digest(), "big"
+    )
+
+
+class HashRing:
+    """
+    A consistent hash ring over named shards. Each shard is placed at many points on the ring, so keys are spread
+    evenly, and adding or removing a shard only moves the keys of that shard.
+    """
+
+    def __init__(self, names: List[str], replicas: int = DEFAULT_REPLICAS) -> None:
+        """
+        :param names: The name of each shard, which places it on the ring regardless of its position in the list
+        :param replicas: The number of points on the ring for each shard
+        """
+        if not names:
+            raise ValueError("A hash ring needs at least one shard")
+
+        points = sorted(
+            (_hash(f"{name}#{replica}"), shard)
+            for shard, name in enumerate(names)
+            for replica in range(replicas)
+        )
+        self._hashes: List[int] = [point for point, _ in points]
+        self._shards: List[int] = [shard for _, shard in points]
+
+    def shard(self, key: str) -> int:
+        """
+        :return: The index of the shard a key belongs to
+        """
+        i = bisect.bisect(self._hashes, _hash(key)) % len(self._hashes)
+        return self._shards[i]
+
+
+class RedisShards:
+    """
+    Several redis endpoints the shipper's output is spread across, each with its own client and connection pool.
+    Records are sent to a shard chosen by consistent hashing on fields of the path groks, so every record of an
+    object (and of a cluster or node) goes to the same shard, or else spread across every shard in turn.
+    """
+
+    def __init__(
+        self,
+        clients: List[StrictRedis],
+        names: List[str],
+        shard_by: Optional[List[str]] = None,
+        replicas: int = DEFAULT_REPLICAS,
+        flush_workers: Optional[int] = None,
+    ) -> None:
+        """
+        :param clients: A client for each endpoint
+        :param names: The name of each endpoint, e.g. its host and port, which places it on the hash ring
+        :param shard_by: The path grok fields to hash, e.g. ["cluster", "node"], or None for round robin
+        :param replicas: The number of points on the hash ring for each endpoint
+        :param flush_workers: The number of threads flushing to the shards in parallel
+        """
+        if len(clients) != len(names):
+            raise ValueError(
+                f"Expected a name for each of the {len(clients)} redis endpoints. Found: {names}"
+            )
+
+        self.clients: List[StrictRedis] = clients
+        self.shard_by: Optional[List[str]] = shard_by
+        self._ring: HashRing = HashRing(names, replicas)
+        self.pool: ThreadPoolExecutor = ThreadPoolExecutor(
+            max_workers=flush_workers or DEFAULT_FLUSH_WORKERS_PER_SHARD * len(clients),
+            thread_name_prefix="redis-shard",
+        )
+
+    def shard(self, path_groks: Optional[dict]) -> Optional[int]:
+        """
+        :param path_groks: The matches from the path groks of the object being shipped
+        :return: The index of the shard every record of the object goes to, or None to spread them round robin
+        """
+        if self.shard_by is None:
+            return None
+
+        groks = path_groks or {}
+        return self._ring.shard(
+            "/".join(str(groks.get(field, "")) for field in self.shard_by)
+        )
@@ -1,17 +1,429 @@
 import codecs
 import gzip
-import json
 import logging
-from typing import Tuple, Optional, Any, Dict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+from dataclasses import dataclass, field
+from typing import Tuple, Optional, List, Iterator, TextIO, Callable, Union
 
 from botocore.client import BaseClient
 from botocore.response import StreamingBody
-from redis import StrictRedis
+from redis import StrictRedis, RedisError
 
+from s3_log_shipper.backpressure import (
+    FlowControl,
+    RateLimiter,
+    SpillStore,
+    SpillWriter,
+)
+from s3_log_shipper.checkpoints import CheckpointStore, Checkpoint
+from s3_log_shipper.metrics import (
+    ShipMetrics,
+    TimedReader,
+    DEFAULT_SAMPLE_EVERY,
+    metrics_log,
+)
+from s3_log_shipper.parallel import (
+    ParsePool,
+    parse_block,
+    DEFAULT_PARALLEL_MIN_BYTES,
+)
 from s3_log_shipper.parsers import ParserManager, Parser
+from s3_log_shipper.pipeline import (
+    ClosingReader,
+    ReadAhead,
+    body_chunks,
+    ranged_chunks,
+    DEFAULT_READ_AHEAD,
+    DEFAULT_COMPRESSED_READ_SIZE,
+)
+from s3_log_shipper.serialisers import Serialiser, JsonSerialiser, Record
+from s3_log_shipper.sharding import RedisShards
+from s3_log_shipper.unmatched import (
+    DeadLetterStore,
+    UnmatchedReporter,
+    DEFAULT_SAMPLE_SIZE,
+)
 
 log: logging.Logger = logging.getLogger(__name__)
 
+DEFAULT_BATCH_SIZE = 500
+DEFAULT_BATCH_BYTES = 1024 * 1024
+DEFAULT_BLOCK_SIZE = 1024 * 1024
+DEFAULT_STREAM_MAXLEN = 1000 * 1000
+
+# Where records are written in redis: pushed onto a list, or added to a stream
+OUTPUTS = ("list", "stream")
+
+# The field of each stream entry holding the record
+STREAM_FIELD = "event"
+
+# Bytes which aren't valid UTF-8 are decoded as this, rather than failing the whole object
+REPLACEMENT_CHARACTER = "\ufffd"
+
+
+class ShippingError(Exception):
+    """
+    Raised when records could not be written to redis.
+    Carries the number of records that had been written before the failure.
+    """
+
+    def __init__(self, msg: str, written: int) -> None:
+        super().__init__(msg)
+        self.written: int = written
+
+
+class QueueFullError(ShippingError):
+    """
+    Raised when redis is over the hard backpressure limit, and there is nowhere to spill records to instead.
+    """
+
+
+@dataclass
+class ShipResult:
+    """
+    The outcome of shipping a single S3 object.
+    """
+
+    written: int
+    lines: int
+    complete: bool = True
+    spilled: int = 0
+    metrics: Optional[ShipMetrics] = field(default=None, compare=False, repr=False)
+
+
+class RedisBatchWriter:
+    """
+    Buffers records and writes them to a redis list as multi-value RPUSH commands sent through a single pipeline,
+    rather than paying a network round trip for every record.
+    """
+
+    def __init__(
+        self,
+        redis_endpoint: StrictRedis,
+        list_key: str = "logstash",
+        batch_size: int = DEFAULT_BATCH_SIZE,
+        batch_bytes: int = DEFAULT_BATCH_BYTES,
+        metrics: Optional[ShipMetrics] = None,
+        rate_limit: Optional[RateLimiter] = None,
+    ) -> None:
+        """
+        :param redis_endpoint: The redis client to write to
+        :param list_key: The redis list the records are pushed onto
+        :param batch_size: The maximum number of records sent in a single RPUSH command
+        :param batch_bytes: The number of buffered bytes that triggers a flush of the pipeline
+        :param metrics: Times the writes to redis, and counts the bytes written
+        :param rate_limit: Limits the records written per second, if set
+        """
+        if batch_size < 1 or batch_bytes < 1:
+            raise ValueError(
+                f"Batch size and byte limit must be positive. Found: {batch_size}, {batch_bytes}"
+            )
+
+        self.redis_endpoint: StrictRedis = redis_endpoint
+        self.list_key: str = list_key
+        self.batch_size: int = batch_size
+        self.batch_bytes: int = batch_bytes
+        self.metrics: Optional[ShipMetrics] = metrics
+        self.rate_limit: Optional[RateLimiter] = rate_limit
+        self.written: int = 0
+        self.failed: int = 0
+        self._buffer: List[Record] = []
+        self._buffered_bytes: int = 0
+
+    def write(self, record: Record) -> None:
+        self.buffer(record)
+
+        if self._buffered_bytes >= self.batch_bytes:
+            self.flush()
+
+    def buffer(self, record: Record) -> None:
+        """
+        Buffers a record without flushing, however many bytes are buffered.
+        """
+        self._buffer.append(record)
+        self._buffered_bytes += len(record)
+
+    def flush(self) -> int:
+        """
+        Sends all buffered records to redis.
+        :return: The number of records written by this flush
+        :raises ShippingError: If any of the records could not be written
+        """
+        if not self._buffer:
+            return 0
+
+        records = self._buffer
+        buffered_bytes = self._buffered_bytes
+        self._buffer = []
+        self._buffered_bytes = 0
+
+        if self.rate_limit is not None:
+            waited = self.rate_limit.acquire(len(records))
+            if self.metrics:
+                self.metrics.add_time("rate_limit", waited)
+
+        pipe = self.redis_endpoint.pipeline(transaction=False)
+        batches = self.queue(pipe, records)
+
+        try:
+            with self.metrics.timer("redis") if self.metrics else nullcontext():
+                results = pipe.execute(raise_on_error=False)
+        except RedisError as e:
+            self.failed += len(records)
+            raise ShippingError(
+                f"Failed to write {len(records)} records to redis: {e}", self.written
+            ) from e
+
+        written = 0
+        errors = []
+        for batch, result in zip(batches, results):
+            if isinstance(result, Exception):
+                self.failed += batch
+                errors.append(result)
+            else:
+                written += batch
+
+        self.written += written
+
+        if self.metrics:
+            self.metrics.count("bytes_out", buffered_bytes)
+
+        if errors:
+            raise ShippingError(
+                f"Failed to write {len(records) - written} of {len(records)} records to redis: {errors[0]}",
+                self.written,
+            )
+
+        return written
+
+    def discard(self) -> None:
+        """
+        Throws away the buffered records, when shipping fails and the object will be shipped again.
+        """
+        self._buffer = []
+        self._buffered_bytes = 0
+
+    def queue(self, pipe, records: List[Record]) -> List[int]:
+        """
+        Queues the commands writing records on a pipeline.
+        :param pipe: The pipeline
+        :param records: The records to write
+        :return: The number of records written by each command queued
+        """
+        batches = list()
+        for start in range(0, len(records), self.batch_size):
+            end = start + self.batch_size
+            batch = records[start:end]
+            batches.append(len(batch))
+            pipe.rpush(self.list_key, *batch)
+        return batches
+
+
+class RedisStreamWriter(RedisBatchWriter):
+    """
+    Buffers records and adds them to a redis stream as XADD commands sent through a single pipeline.
+    The stream is capped at roughly `maxlen` entries, trimming the oldest, so unlike a list its memory is bounded, and
+    several logstash consumers in a consumer group can read it in parallel.
+    """
+
+    def __init__(
+        self,
+        redis_endpoint: StrictRedis,
+        stream_key: str = "logstash",
+        maxlen: int = DEFAULT_STREAM_MAXLEN,
+        batch_bytes: int = DEFAULT_BATCH_BYTES,
+        metrics: Optional[ShipMetrics] = None,
+        rate_limit: Optional[RateLimiter] = None,
+    ) -> None:
+        """
+        :param redis_endpoint: The redis client to write to
+        :param stream_key: The redis stream the records are added to
+        :param maxlen: The approximate number of entries the stream is trimmed to, or 0 not to trim it
+        :param batch_bytes: The number of buffered bytes that triggers a flush of the pipeline
+        :param metrics: Times the writes to redis, and counts the bytes written
+        :param rate_limit: Limits the records written per second, if set
+        """
+        if maxlen < 0:
+            raise ValueError(f"Stream max length must not be negative. Found: {maxlen}")
+
+        # XADD adds a single entry, so every record is a command of its own
+        super().__init__(
+            redis_endpoint, stream_key, 1, batch_bytes, metrics, rate_limit
+        )
+        self.maxlen: Optional[int] = maxlen or None
+
+    def queue(self, pipe, records: List[Record]) -> List[int]:
+        for record in records:
+            # Trimming to roughly maxlen lets redis drop whole nodes of the stream, which is far cheaper than exactly
+            pipe.xadd(
+                self.list_key,
+                {STREAM_FIELD: record},
+                maxlen=self.maxlen,
+                approximate=True,
+            )
+        return [1] * len(records)
+
+
+class ShardedWriter:
+    """
+    Spreads records across the writers of several redis shards in turn, and flushes them all in parallel once
+    enough bytes are buffered to fill a batch for each shard.
+    """
+
+    def __init__(
+        self,
+        writers: List[RedisBatchWriter],
+        pool: ThreadPoolExecutor,
+        batch_bytes: int = DEFAULT_BATCH_BYTES,
+        metrics: Optional[ShipMetrics] = None,
+    ) -> None:
+        """
+        :param writers: A writer for each shard, which times nothing itself
+        :param pool: The threads to flush the shards on
+        :param batch_bytes: The number of buffered bytes for each shard that triggers a flush
+        :param metrics: Times the parallel writes to redis, and counts the bytes written
+        """
+        self.writers: List[RedisBatchWriter] = writers
+        self.pool: ThreadPoolExecutor = pool
+        self.batch_bytes: int = batch_bytes * len(writers)
+        self.metrics: Optional[ShipMetrics] = metrics
+        self._next: int = 0
+        self._buffered_bytes: int = 0
+
+    @property
+    def written(self) -> int:
+        return sum(writer.written for writer in self.writers)
+
+    @property
+    def failed(self) -> int:
+        return sum(writer.failed for writer in self.writers)
+
+    def write(self, record: Record) -> None:
+        self.writers[self._next].buffer(record)
+        self._next = (self._next + 1) % len(self.writers)
+        self._buffered_bytes += len(record)
+
+        if self._buffered_bytes >= self.batch_bytes:
+            self.flush()
+
+    def flush(self) -> int:
+        """
+        Sends all buffered records to their shards, in parallel.
+        :return: The number of records written by this flush
+        :raises ShippingError: If any of the records could not be written, once every shard has been flushed
+        """
+        if not self._buffered_bytes:
+            return 0
+
+        buffered_bytes = self._buffered_bytes
+        self._buffered_bytes = 0
+
+        with self.metrics.timer("redis") if self.metrics else nullcontext():
+            futures = [self.pool.submit(writer.flush) for writer in self.writers]
+
+            written = 0
+            errors: List[ShippingError] = []
+            for future in futures:
+                try:
+                    written += future.result()
+                except ShippingError as e:
+                    errors.append(e)
+
+        if self.metrics:
+            self.metrics.count("bytes_out", buffered_bytes)
+
+        if errors:
+            raise ShippingError(
+                f"Failed to write to {len(errors)} of {len(self.writers)} redis shards: {errors[0]}",
+                self.written,
+            ) from errors[0]
+
+        return written
+
+    def discard(self) -> None:
+        """
+        Throws away the records buffered for every shard, when shipping fails and the object will be shipped again.
+        """
+        for writer in self.writers:
+            writer.discard()
+        self._buffered_bytes = 0
+
+
+def read_blocks(log_file: TextIO, block_size: int) -> Iterator[str]:
+    """
+    Reads a text stream in blocks of roughly `block_size` characters, cut at the end of a line.
+    :param log_file: The text stream to read
+    :param block_size: The number of characters to read at a time
+    :return: Blocks of whole lines. Only the last block may not end with a newline.
+    """
+    remainder = ""
+    while True:
+        block = log_file.read(block_size)
+        if not block:
+            break
+
+        if remainder:
+            block = remainder + block
+
+        cut = block.rfind("\n") + 1
+        if cut == 0:
+            remainder = block
+            continue
+
+        if cut < len(block):
+            remainder = block[cut:]
+            block = block[:cut]
+        else:
+            remainder = ""
+
+        yield block
+
+    if remainder:
+        yield remainder
+
+
+def count_lines(block: str) -> int:
+    return block.count("\n") + (0 if block.endswith("\n") else 1)
+
+
+def skip_lines(block: str, count: int) -> str:
+    offset = 0
+    for _ in range(count):
+        offset = block.index("\n", offset) + 1
+    return block[offset:]
+
+
+def resume_blocks(
+    blocks: Iterator[str], resume_from: int, metrics: ShipMetrics
+) -> Iterator[Tuple[int, str]]:
+    """
+    Skips the lines of an object which were shipped before, and counts the replacement characters in the rest.
+    :param blocks: The blocks of the object
+    :param resume_from: The number of lines to skip
+    :param metrics: Counts the replacement characters, both those replacing undecodable bytes and any in the object
+    :return: The blocks to ship, each with the number of lines read once it is shipped
+    """
+    lines = 0
+    for block in blocks:
+        block_lines = count_lines(block)
+
+        if lines + block_lines <= resume_from:
+            lines += block_lines
+            continue
+
+        if lines < resume_from:
+            block = skip_lines(block, resume_from - lines)
+            block_lines -= resume_from - lines
+            lines = resume_from
+
+        replaced = block.count(REPLACEMENT_CHARACTER)
+        if replaced:
+            metrics.count("replacement_chars", replaced)
+
+        lines += block_lines
+        yield lines, block
+
 
 class RedisLogShipper:
     def __init__(
@@ -19,12 +431,89 @@ class RedisLogShipper:
         redis_endpoint: StrictRedis,
         parser_manager: ParserManager,
         s3_client: BaseClient,
+        batch_size: int = DEFAULT_BATCH_SIZE,
+        batch_bytes: int = DEFAULT_BATCH_BYTES,
+        block_size: int = DEFAULT_BLOCK_SIZE,
+        serialiser: Optional[Serialiser] = None,
+        checkpoints: Optional[CheckpointStore] = None,
+        flow_control: Optional[FlowControl] = None,
+        spills: Optional[SpillStore] = None,
+        emit_metrics: bool = False,
+        metrics_sample_every: int = DEFAULT_SAMPLE_EVERY,
+        output: str = "list",
+        output_key: str = "logstash",
+        stream_maxlen: int = DEFAULT_STREAM_MAXLEN,
+        shards: Optional[RedisShards] = None,
+        dead_letters: Optional[DeadLetterStore] = None,
+        unmatched_sample: int = DEFAULT_SAMPLE_SIZE,
+        read_ahead: int = DEFAULT_READ_AHEAD,
+        range_size: int = 0,
+        parse_pool: Optional[ParsePool] = None,
+        parallel_min_bytes: int = DEFAULT_PARALLEL_MIN_BYTES,
+        rate_limit: Optional[RateLimiter] = None,
     ):
+        if output not in OUTPUTS:
+            raise ValueError(
+                f"Unknown redis output {output}. Expected one of {', '.join(OUTPUTS)}."
+            )
+        if read_ahead < 0 or range_size < 0 or (range_size and not read_ahead):
+            raise ValueError(
+                f"Read ahead and range size must not be negative, and ranged GETs need read ahead. "
+                f"Found: {read_ahead}, {range_size}"
+            )
+
         self.redis_endpoint: StrictRedis = redis_endpoint
         self.parser_manager: ParserManager = parser_manager
         self.s3_client: BaseClient = s3_client
+        self.batch_size: int = batch_size
+        self.batch_bytes: int = batch_bytes
+        self.block_size: int = block_size
+        self.serialiser: Serialiser = serialiser or JsonSerialiser()
+        self.checkpoints: Optional[CheckpointStore] = checkpoints
+        self.flow_control: Optional[FlowControl] = flow_control
+        self.spills: Optional[SpillStore] = spills
+        self.emit_metrics: bool = emit_metrics
+        self.metrics_sample_every: int = metrics_sample_every
+        self.output: str = output
+        self.output_key: str = output_key
+        self.stream_maxlen: int = stream_maxlen
+        self.shards: Optional[RedisShards] = shards
+        self.dead_letters: Optional[DeadLetterStore] = dead_letters
+        self.unmatched_sample: int = unmatched_sample
+        self.read_ahead: int = read_ahead
+        self.range_size: int = range_size
+        self.parse_pool: Optional[ParsePool] = parse_pool
+        self.parallel_min_bytes: int = parallel_min_bytes
+        self.rate_limit: Optional[RateLimiter] = rate_limit
 
-    def ship(self, bucket: str, key: str):
+    def ship(
+        self,
+        bucket: str,
+        key: str,
+        e_tag: Optional[str] = None,
+        should_stop: Optional[Callable[[], bool]] = None,
+        size: Optional[int] = None,
+    ) -> ShipResult:
+        """
+        Ships the log lines of an S3 object to redis.
+        When checkpoints are configured and the object's eTag is given, the number of lines shipped is checkpointed
+        after every block, and shipping resumes from the checkpoint if the object was only partly shipped before.
+        With flow control, redis is sampled after every block. Once it is over the hard limit, the rest of the object
+        is spilled to S3 if spills are configured, and otherwise shipping fails.
+        The time spent in each stage of shipping is measured, and logged as CloudWatch embedded metric format when
+        `emit_metrics` is set. Lines which can't be grokked are summarised in a single log line once the object is
+        shipped, and written to a dead letter object when dead letters are configured.
+        An object of at least `parallel_min_bytes` is parsed by the parse pool, when there is one and it isn't busy
+        with another object.
+        :param bucket: The bucket of the object
+        :param key: The key of the object
+        :param e_tag: The eTag of the object
+        :param should_stop: Checked after every block. Shipping stops early, leaving a checkpoint to resume from,
+        once it returns True.
+        :param size: The size of the object in S3, if known
+        :return: How much of the object was shipped
+        :raises QueueFullError: If redis is over the hard limit and there is nowhere to spill to
+        """
         maybe_parser: Optional[
             Tuple[Parser, Optional[dict]]
         ] = self.parser_manager.get_parser(f"{bucket}/{key}")
@@ -37,43 +526,295 @@ class RedisLogShipper:
         if parser is None:
             raise KeyError(f"No parser configured to handle logs from {key}")
 
-        with self.open_file_stream(bucket, key) as log_file:
+        metrics = ShipMetrics(self.metrics_sample_every)
+        started = metrics.clock()
 
-            written = 0
+        writer = self.make_writer(metrics, path_groks)
+
+        encode = metrics.sampled("encode", self.serialiser.bind(path_groks))
+        convert_timestamp = metrics.sampled("timestamp", parser.timestamp_converter)
 
-            for line in log_file:
+        checkpoint: Optional[Checkpoint] = None
+        if self.checkpoints is not None and e_tag is not None:
+            checkpoint = self.checkpoints.checkpoint(bucket, key, e_tag)
 
-                log_groks: Optional[Dict[Any, Any]] = parser.parse_log(line)
+        resume_from = checkpoint.get() if checkpoint else 0
+        # Every line up to the checkpoint was read before
+        lines = resume_from
+        complete = True
+        spill: Optional[SpillWriter] = None
+        unmatched = UnmatchedReporter(
+            parser.type,
+            bucket,
+            key,
+            resume_from,
+            self.unmatched_sample,
+            self.dead_letters,
+        )
 
-                if log_groks is None:
-                    log.error(f"Couldn't grok log line {line}")
-                    continue
+        with metrics.timer("s3_get"):
+            file_stream = self.open_file_stream(bucket, key, metrics)
 
-                if path_groks is not None:
-                    log_groks.update(path_groks)
+        with file_stream as log_file:
+            pool = self.reserve_parse_pool(size)
+            results = None
 
-                self.redis_endpoint.rpush(
-                    "logstash", json.dumps(log_groks, sort_keys=True)
+            try:
+                timed_file = (
+                    log_file
+                    if isinstance(log_file, ReadAhead)
+                    else TimedReader(log_file, metrics, "inflate")
                 )
+                blocks = read_blocks(timed_file, self.block_size)
+                if parser.multiline is not None:
+                    # Lines are still counted, and checkpointed, as read, but only ever between events
+                    blocks = parser.multiline.blocks(blocks)
+                to_parse = resume_blocks(blocks, resume_from, metrics)
 
-                written = written + 1
+                if pool is not None:
+                    results = pool.parse(f"{bucket}/{key}", to_parse, metrics)
+                else:
+                    results = (
+                        (
+                            block_end,
+                            parse_block(
+                                parser, block, encode, convert_timestamp, metrics
+                            ),
+                        )
+                        for block_end, block in to_parse
+                    )
 
-            log.info(f"Wrote {written} lines to elasticache from {bucket}/{key}")
+                for block_end, parsed in results:
+                    sink: Union[RedisBatchWriter, ShardedWriter, SpillWriter] = (
+                        spill or writer
+                    )
 
-    def open_file_stream(self, bucket, key):
-        get_object_response = self.s3_client.get_object(Bucket=bucket, Key=key)
+                    for record in parsed.records:
+                        sink.write(record)
+
+                    for line in parsed.unmatched:
+                        unmatched.report(line)
+
+                    if parser.line_filter is not None:
+                        metrics.count("dropped", parsed.dropped)
+                    metrics.count("matched", len(parsed.records))
+                    metrics.count("unmatched", len(parsed.unmatched))
+
+                    lines = block_end
+
+                    # Spilled lines are only checkpointed once the spill is uploaded
+                    if spill is None and (checkpoint or self.flow_control):
+                        writer.flush()
+
+                        if checkpoint:
+                            checkpoint.save(lines)
+
+                        if self.flow_control and not self.flow_control.admit(
+                            should_stop
+                        ):
+                            spill = self.divert(bucket, key, lines, writer.written)
+
+                    if checkpoint and should_stop is not None and should_stop():
+                        complete = False
+                        break
+            except BaseException:
+                if spill is not None:
+                    spill.discard()
+                unmatched.discard()
+                # The records after the last checkpoint are shipped again, and redis may be what failed
+                writer.discard()
+                raise
+            finally:
+                if pool is not None:
+                    # Waits for the blocks still being parsed, when shipping stopped before the end
+                    if results is not None:
+                        results.close()
+                    pool.release()
 
+            writer.flush()
+
+        unmatched.close()
+
+        if spill is not None:
+            spill.close()
+
+            if checkpoint and not complete:
+                checkpoint.save(lines)
+
+        if checkpoint and complete:
+            checkpoint.clear()
+
+        resumed = f", resuming from line {resume_from}" if resume_from else ""
+        stopped = f", stopping early at line {lines}" if not complete else ""
+        dropped = (
+            f", dropping {metrics.counts['dropped']} filtered lines"
+            if metrics.counts.get("dropped")
+            else ""
+        )
+        replaced = (
+            f", shipping {metrics.counts['replacement_chars']} U+FFFD replacement characters"
+            if metrics.counts.get("replacement_chars")
+            else ""
+        )
+        spilled = (
+            f", spilling {spill.written} lines to s3://{spill.bucket}/{spill.key}"
+            if spill
+            else ""
+        )
+        log.info(
+            f"Wrote {writer.written} lines to elasticache from {bucket}/{key}"
+            f"{resumed}{stopped}{dropped}{replaced}{spilled}"
+        )
+
+        metrics.count("written", writer.written)
+        metrics.count("spilled", spill.written if spill else 0)
+        metrics.count("resumed", 1 if resume_from else 0)
+        metrics.count("stopped", 0 if complete else 1)
+        metrics.add_time("total", metrics.clock() - started)
+
+        if self.emit_metrics:
+            metrics_log.info(
+                metrics.emf({"Type": parser.type}, {"Bucket": bucket, "Key": key})
+            )
+
+        return ShipResult(
+            writer.written, lines, complete, spill.written if spill else 0, metrics
+        )
+
+    def reserve_parse_pool(self, size: Optional[int]) -> Optional[ParsePool]:
+        """
+        :param size: The size of the object in S3, if known
+        :return: The parse pool, reserved for the object, if the object is large enough to be worth parsing in
+        parallel and the pool is free
+        """
+        if self.parse_pool is None or size is None or size < self.parallel_min_bytes:
+            return None
+        return self.parse_pool if self.parse_pool.reserve() else None
+
+    def make_writer(
+        self,
+        metrics: Optional[ShipMetrics] = None,
+        path_groks: Optional[dict] = None,
+    ) -> Union[RedisBatchWriter, ShardedWriter]:
+        """
+        :param metrics: Times the writes to redis, and counts the bytes written
+        :param path_groks: The matches from the path groks of the object being shipped, which may choose its shard
+        :return: A writer for the records of an object
+        """
+        if self.shards is None:
+            return self.shard_writer(self.redis_endpoint, metrics)
+
+        shard = self.shards.shard(path_groks)
+        if shard is not None:
+            return self.shard_writer(self.shards.clients[shard], metrics)
+
+        return ShardedWriter(
+            [self.shard_writer(client) for client in self.shards.clients],
+            self.shards.pool,
+            batch_bytes=self.batch_bytes,
+            metrics=metrics,
+        )
+
+    def shard_writer(
+        self, redis_endpoint: StrictRedis, metrics: Optional[ShipMetrics] = None
+    ) -> RedisBatchWriter:
+        if self.output == "stream":
+            return RedisStreamWriter(
+                redis_endpoint,
+                self.output_key,
+                maxlen=self.stream_maxlen,
+                batch_bytes=self.batch_bytes,
+                metrics=metrics,
+                rate_limit=self.rate_limit,
+            )
+        return RedisBatchWriter(
+            redis_endpoint,
+            self.output_key,
+            batch_size=self.batch_size,
+            batch_bytes=self.batch_bytes,
+            metrics=metrics,
+            rate_limit=self.rate_limit,
+        )
+
+    def divert(self, bucket: str, key: str, lines: int, written: int) -> SpillWriter:
+        """
+        Stops writing an object's records to redis once it is over the hard backpressure limit.
+        :param bucket: The bucket of the object
+        :param key: The key of the object
+        :param lines: The number of lines of the object shipped so far
+        :param written: The number of records written to redis so far
+        :return: A writer spilling the rest of the object's records to S3
+        :raises QueueFullError: If there is nowhere to spill to
+        """
+        msg = f"Redis is over its hard limit of {self.flow_control.hard_limit} ({self.flow_control.metric})"
+
+        if self.spills is None:
+            raise QueueFullError(
+                f"{msg}, stopped shipping {bucket}/{key} at line {lines}", written
+            )
+
+        log.warning(f"{msg}, spilling {bucket}/{key} to S3 from line {lines}")
+        return self.spills.spill(bucket, key, lines)
+
+    def open_file_stream(self, bucket, key, metrics: Optional[ShipMetrics] = None):
+        """
+        Opens an S3 object as a text stream. With read ahead, the object is downloaded, inflated and decoded on a
+        thread of its own while the lines already read are shipped, as several ranged GETs in parallel when a range
+        size is set.
+        :param bucket: The bucket of the object
+        :param key: The key of the object
+        :param metrics: Times the download, inflate and decode
+        :return: The text stream, to be closed once read, which closes the object's body
+        """
         is_gzipped = key.endswith(".gz")
 
+        if self.range_size:
+            metrics = metrics or ShipMetrics()
+            chunks = ranged_chunks(
+                self.s3_client,
+                bucket,
+                key,
+                self.range_size,
+                self.block_size,
+                metrics,
+            )
+            return ReadAhead(
+                chunks, is_gzipped, self.block_size, metrics, self.read_ahead
+            )
+
+        get_object_response = self.s3_client.get_object(Bucket=bucket, Key=key)
+
         if "Body" not in get_object_response:
             msg = f"Expected valid S3 get object response. Found: [{get_object_response}]."
             log.error(msg)
             raise Exception(msg)
 
         streaming_body: StreamingBody = get_object_response["Body"]
+        if self.read_ahead:
+            metrics = metrics or ShipMetrics()
+            return ReadAhead(
+                body_chunks(
+                    streaming_body,
+                    DEFAULT_COMPRESSED_READ_SIZE if is_gzipped else self.block_size,
+                    metrics,
+                ),
+                is_gzipped,
+                self.block_size,
+                metrics,
+                self.read_ahead,
+                body=streaming_body,
+            )
+
+        timed_body = (
+            # Times the download, as distinct from inflating and decoding what was downloaded
+            TimedReader(streaming_body, metrics, "download", "bytes_in")
+            if metrics is not None
+            else streaming_body
+        )
 
-        return (
-            gzip.open(streaming_body, "rt", encoding="utf-8")
+        return ClosingReader(
+            gzip.open(timed_body, "rt", encoding="utf-8", errors="replace")
             if is_gzipped
-            else codecs.getreader("utf-8")(streaming_body)
+            else codecs.getreader("utf-8")(timed_body, errors="replace"),
+            streaming_body,
         )
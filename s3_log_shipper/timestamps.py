@@ -0,0 +1,157 @@
+from datetime import datetime, date
+from typing import Callable, Dict, Optional, Tuple
+
+_MONTHS: Dict[str, int] = {
+    name: number
+    for number, name in enumerate(
+        "jan feb mar apr may jun jul aug sep oct nov dec".split(), start=1
+    )
+}
+
+
+def _digits(value: str) -> bool:
+    return value.isdigit() and value.isascii()
+
+
+class TimestampConverter:
+    """
+    Converts timestamps in a strptime format into the ISO 8601 string `datetime.isoformat` would produce.
+    The common log formats are sliced at fixed offsets, and the date part is memoised because consecutive log lines
+    mostly share a date. Anything else, including timestamps the fast path doesn't recognise, goes through strptime.
+    """
+
+    def __init__(self, strptime_pattern: str) -> None:
+        self.strptime_pattern: str = strptime_pattern
+        self._fast: Optional[
+            Callable[["TimestampConverter", str], Optional[str]]
+        ] = _FAST_FORMATS.get(strptime_pattern)
+        self._last_date: Tuple[str, str] = ("", "")
+
+    def __call__(self, timestamp: str) -> str:
+        """
+        :param timestamp: The timestamp to convert
+        :return: The timestamp in ISO 8601 format
+        :raises ValueError: If the timestamp doesn't match the strptime pattern
+        """
+        if self._fast is not None:
+            converted = self._fast(self, timestamp)
+            if converted is not None:
+                return converted
+
+        return datetime.strptime(timestamp, self.strptime_pattern).isoformat()
+
+    def _iso_date(self, key: str, year: int, month: int, day: int) -> Optional[str]:
+        last_key, last_date = self._last_date
+        if key == last_key:
+            return last_date
+
+        try:
+            iso_date = date(year, month, day).isoformat()
+        except ValueError:
+            return None
+
+        self._last_date = (key, iso_date)
+        return iso_date
+
+    @staticmethod
+    def _iso_time(hour: str, minute: str, second: str) -> Optional[str]:
+        if hour < "24" and minute < "60" and second < "60":
+            return f"{hour}:{minute}:{second}"
+        return None
+
+    def _from_ymd_hmsf(self, value: str) -> Optional[str]:
+        # %Y-%m-%d %H:%M:%S,%f e.g. 2020-04-28 05:58:34,602
+        if (
+            not 21 <= len(value) <= 26
+            or value[4] != "-"
+            or value[7] != "-"
+            or value[10] != " "
+            or value[13] != ":"
+            or value[16] != ":"
+            or value[19] != ","
+        ):
+            return None
+
+        year, month, day = value[0:4], value[5:7], value[8:10]
+        hour, minute, second = value[11:13], value[14:16], value[17:19]
+        fraction = value[20:]
+        if not _digits(year + month + day + hour + minute + second + fraction):
+            return None
+
+        iso_date = self._iso_date(value[0:10], int(year), int(month), int(day))
+        iso_time = self._iso_time(hour, minute, second)
+        if iso_date is None or iso_time is None:
+            return None
+
+        microseconds = fraction.ljust(6, "0")
+        if microseconds == "000000":
+            return f"{iso_date}T{iso_time}"
+        return f"{iso_date}T{iso_time}.{microseconds}"
+
+    def _from_short_ymd_hms(self, value: str) -> Optional[str]:
+        # %y/%m/%d %H:%M:%S e.g. 20/04/27 19:14:44
+        if (
+            len(value) != 17
+            or value[2] != "/"
+            or value[5] != "/"
+            or value[8] != " "
+            or value[11] != ":"
+            or value[14] != ":"
+        ):
+            return None
+
+        year, month, day = value[0:2], value[3:5], value[6:8]
+        hour, minute, second = value[9:11], value[12:14], value[15:17]
+        if not _digits(year + month + day + hour + minute + second):
+            return None
+
+        # strptime maps two digit years 69-99 onto 1969-1999 and 00-68 onto 2000-2068
+        full_year = int(year) + (1900 if year >= "69" else 2000)
+        iso_date = self._iso_date(value[0:8], full_year, int(month), int(day))
+        iso_time = self._iso_time(hour, minute, second)
+        if iso_date is None or iso_time is None:
+            return None
+
+        return f"{iso_date}T{iso_time}"
+
+    def _from_clf(self, value: str) -> Optional[str]:
+        # %d/%b/%Y:%H:%M:%S %z e.g. 28/Apr/2020:07:48:37 +0000
+        if (
+            len(value) != 26
+            or value[2] != "/"
+            or value[6] != "/"
+            or value[11] != ":"
+            or value[14] != ":"
+            or value[17] != ":"
+            or value[20] != " "
+            or value[21] not in "+-"
+        ):
+            return None
+
+        day, month_name, year = value[0:2], value[3:6], value[7:11]
+        hour, minute, second = value[12:14], value[15:17], value[18:20]
+        offset_hours, offset_minutes = value[22:24], value[24:26]
+        month = _MONTHS.get(month_name.lower())
+        if month is None or not _digits(
+            day + year + hour + minute + second + offset_hours + offset_minutes
+        ):
+            return None
+
+        iso_date = self._iso_date(value[0:11], int(year), month, int(day))
+        iso_time = self._iso_time(hour, minute, second)
+        if iso_date is None or iso_time is None:
+            return None
+
+        if offset_hours >= "24" or offset_minutes >= "60":
+            return None
+
+        # A zero offset is always rendered as +00:00, whichever sign it was written with
+        sign = value[21] if offset_hours + offset_minutes != "0000" else "+"
+        return f"{iso_date}T{iso_time}{sign}{offset_hours}:{offset_minutes}"
+
+
+_FAST_FORMATS: Dict[str, Callable[[TimestampConverter, str], Optional[str]]] = {
+    "%Y-%m-%d %H:%M:%S,%f": TimestampConverter._from_ymd_hmsf,
+    "%y/%m/%d %H:%M:%S": TimestampConverter._from_short_ymd_hms,
+    "%d/%b/%Y:%H:%M:%S %z": TimestampConverter._from_clf,
+}
@@ -0,0 +1,127 @@
+import logging
+from typing import List, Optional
+
+from botocore.client import BaseClient
+
+from s3_log_shipper.backpressure import SpillWriter
+
+log: logging.Logger = logging.getLogger(__name__)
+
+DEFAULT_SAMPLE_SIZE = 5
+DEFAULT_DEAD_LETTER_PREFIX = "s3-log-shipper-unmatched/"
+
+# Sampled lines are cut to this many characters in the summary
+SAMPLE_LINE_CHARS = 500
+
+
+class DeadLetterStore:
+    """
+    Writes the lines of S3 objects that couldn't be grokked, as they were read, under a prefix in S3.
+    """
+
+    def __init__(
+        self,
+        s3_client: BaseClient,
+        bucket: str,
+        prefix: str = DEFAULT_DEAD_LETTER_PREFIX,
+    ) -> None:
+        """
+        :param s3_client: The S3 client to upload with
+        :param bucket: The bucket to write the lines to
+        :param prefix: The prefix of the dead letter objects
+        """
+        self.s3_client: BaseClient = s3_client
+        self.bucket: str = bucket
+        self.prefix: str = prefix
+
+    def writer(self, bucket: str, key: str, from_line: int) -> SpillWriter:
+        """
+        :param bucket: The bucket of the object being shipped
+        :param key: The key of the object being shipped
+        :param from_line: The line of the object shipping started from
+        :return: A writer for the lines of the object which couldn't be grokked
+        """
+        return SpillWriter(
+            self.s3_client, self.bucket, f"{self.prefix}{bucket}/{key}.{from_line}.gz"
+        )
+
+
+class UnmatchedReporter:
+    """
+    Counts the lines of an S3 object its parser couldn't grok, and keeps the first few of them, to be logged in a
+    single summary once the object is shipped rather than a log line each. Every unmatched line is also written to a
+    dead letter object, when a dead letter store is configured.
+    """
+
+    def __init__(
+        self,
+        type: str,
+        bucket: str,
+        key: str,
+        from_line: int = 0,
+        sample_size: int = DEFAULT_SAMPLE_SIZE,
+        dead_letters: Optional[DeadLetterStore] = None,
+    ) -> None:
+        """
+        :param type: The type of the object's parser
+        :param bucket: The bucket of the object
+        :param key: The key of the object
+        :param from_line: The line of the object shipping started from
+        :param sample_size: The number of unmatched lines to log
+        :param dead_letters: Where to write every unmatched line, if anywhere
+        """
+        self.type: str = type
+        self.bucket: str = bucket
+        self.key: str = key
+        self.from_line: int = from_line
+        self.sample_size: int = sample_size
+        self.dead_letters: Optional[DeadLetterStore] = dead_letters
+        self.unmatched: int = 0
+        self.sample: List[str] = []
+        self._dead_letter: Optional[SpillWriter] = None
+
+    def report(self, line: str) -> None:
+        """
+        :param line: A line, or the lines of a multiline event, which couldn't be grokked
+        """
+        self.unmatched += 1
+
+        if len(self.sample) < self.sample_size:
+            self.sample.append(line[:SAMPLE_LINE_CHARS])
+
+        if self.dead_letters is not None:
+            if self._dead_letter is None:
+                self._dead_letter = self.dead_letters.writer(
+                    self.bucket, self.key, self.from_line
+                )
+            self._dead_letter.write(line)
+
+    def close(self) -> None:
+        """
+        Uploads the dead letter object, if there were unmatched lines to write to it, and logs the summary.
+        """
+        if not self.unmatched:
+            return
+
+        dead_letter = self._dead_letter
+        if dead_letter is not None:
+            self._dead_letter = None
+            dead_letter.close()
+
+        written = (
+            f", writing them to s3://{dead_letter.bucket}/{dead_letter.key}"
+            if dead_letter
+            else ""
+        )
+        log.error(
+            f"Couldn't grok {self.unmatched} lines of {self.type} log {self.bucket}/{self.key}{written}. "
+            f"The first {len(self.sample)}: {self.sample}"
+        )
+
+    def discard(self) -> None:
+        """
+        Throws away the dead letter object, when shipping fails and the object will be shipped again.
+        """
+        if self._dead_letter is not None:
+            self._dead_letter.discard()
+            self._dead_letter = None
@@ -1,4 +1,6 @@
+import json
 import os
+from unittest.mock import Mock
 
 
 def stub_event(bucket, key, record_count=1) -> dict:
@@ -37,5 +39,31 @@ def stub_record(bucket, key) -> dict:
     }
 
 
-def test_config_file():
+def stub_sqs_message(message_id, body, via_sns=False) -> dict:
+    if via_sns:
+        body = {
+            "Type": "Notification",
+            "TopicArn": "arn:aws:sns:eu-west-2:123456789012:s3-log-shipper",
+            "Message": json.dumps(body),
+        }
+    return {
+        "messageId": message_id,
+        "receiptHandle": f"{message_id}-receipt",
+        "body": body if isinstance(body, str) else json.dumps(body),
+        "eventSource": "aws:sqs",
+        "eventSourceARN": "arn:aws:sqs:eu-west-2:123456789012:s3-log-shipper",
+        "awsRegion": "eu-west-2",
+    }
+
+
+def stub_context(remaining_time_in_millis=300000) -> Mock:
+    context = Mock()
+    context.invoked_function_arn = (
+        "arn:aws:lambda:eu-west-2:123456789012:function:s3-log-shipper"
+    )
+    context.get_remaining_time_in_millis.return_value = remaining_time_in_millis
+    return context
+
+
+def config_path():
     return f"{os.path.dirname(__file__)}/test_config.json"
@@ -0,0 +1,171 @@
+import gzip
+import json
+import multiprocessing
+import os
+import tempfile
+import unittest
+from pathlib import Path
+from unittest.mock import Mock
+
+import boto3
+from moto import mock_s3
+from redis import StrictRedis
+
+from s3_log_shipper.backfill import (
+    Backfill,
+    LocalObjects,
+    Manifest,
+    ShipWorkers,
+    list_s3,
+    main,
+    parse_source,
+)
+from s3_log_shipper.parsers import ParserManager
+from s3_log_shipper.shipper import RedisLogShipper, ShipResult
+from test.fixtures import config_path
+
+NODE = "emr-logs/j-2QN8WF3UJZKK3/node/i-0c08a7e99b9985c73/applications"
+OOZIE = f"{NODE}/oozie/oozie.log-2020-04-28-05.gz"
+LIVY = f"{NODE}/livy/livy-livy-server.out.gz"
+
+
+class BackfillSpec(unittest.TestCase):
+    def setUp(self) -> None:
+        self._dir = tempfile.TemporaryDirectory()
+        self.root = Path(self._dir.name) / "logs"
+        self.write(
+            OOZIE, "2020-04-28 05:58:34,602  INFO Service:520 - line {}\n".format
+        )
+        self.write(LIVY, "20/04/28 07:48:37 WARN InteractiveSession$: line {}\n".format)
+        self.write("notes.txt", "not a log {}\n".format, gzipped=False)
+
+        self.objects = LocalObjects(self.root, "bucket")
+        self.objects.get_object = Mock(wraps=self.objects.get_object)
+        self.redis_client = Mock(StrictRedis)
+        self.redis_client.pipeline.return_value.execute.return_value = [1]
+        self.shipper = RedisLogShipper(
+            self.redis_client,
+            ParserManager(Path(config_path()).absolute()),
+            self.objects,
+        )
+
+    def tearDown(self) -> None:
+        self._dir.cleanup()
+
+    def write(self, key: str, line, gzipped: bool = True) -> None:
+        path = self.root / key
+        path.parent.mkdir(parents=True, exist_ok=True)
+        data = "".join(line(i) for i in range(10)).encode("utf-8")
+        path.write_bytes(gzip.compress(data) if gzipped else data)
+
+    def test_ships_local_files_with_a_parser_once(self):
+        manifest_file = Path(self._dir.name) / "manifest.jsonl"
+
+        manifest = Manifest(manifest_file)
+        result = Backfill(self.shipper, manifest, concurrency=2).run(
+            self.objects.list()
+        )
+        manifest.close()
+
+        self.assertEqual((2, 20, 1), (result.shipped, result.written, result.unparsed))
+        # Files without a parser are never read
+        self.assertEqual(
+            {LIVY, OOZIE},
+            {kwargs["Key"] for _, kwargs in self.objects.get_object.call_args_list},
+        )
+        with open(manifest_file) as entries:
+            self.assertEqual(
+                {(LIVY, 10), (OOZIE, 10)},
+                {(e["key"], e["written"]) for e in map(json.loads, entries)},
+            )
+
+        manifest = Manifest(manifest_file)
+        result = Backfill(self.shipper, manifest).run(self.objects.list())
+        manifest.close()
+
+        self.assertEqual((0, 2), (result.shipped, result.skipped))
+        self.assertEqual(2, self.objects.get_object.call_count)
+
+    def test_counts_objects_which_fail(self):
+        self.redis_client.pipeline.return_value.execute.side_effect = IOError("down")
+
+        with self.assertLogs("s3_log_shipper.backfill", "ERROR"):
+            result = Backfill(self.shipper).run(self.objects.list())
+
+        self.assertEqual((0, 2), (result.shipped, result.failed))
+
+    def test_ships_objects_in_worker_processes(self):
+        workers = ShipWorkers(self.shipper, 2, multiprocessing.get_context("fork"))
+        try:
+            result = Backfill(self.shipper, concurrency=2, workers=workers).run(
+                self.objects.list()
+            )
+        finally:
+            workers.close()
+
+        self.assertEqual((2, 20, 1), (result.shipped, result.written, result.unparsed))
+        # The workers write with copies of the redis client
+        self.redis_client.pipeline.assert_not_called()
+        self.objects.get_object.assert_not_called()
+
+    def test_counts_objects_which_fail_in_worker_processes(self):
+        self.redis_client.pipeline.return_value.execute.side_effect = IOError("down")
+        workers = ShipWorkers(self.shipper, 2, multiprocessing.get_context("fork"))
+        try:
+            with self.assertLogs("s3_log_shipper.backfill", "ERROR"):
+                result = Backfill(self.shipper, workers=workers).run(
+                    self.objects.list()
+                )
+        finally:
+            workers.close()
+
+        self.assertEqual((0, 2), (result.shipped, result.failed))
+
+    def test_ships_on_the_workers_left_once_one_dies(self):
+        def ship(bucket, key, e_tag, should_stop, size=None):
+            if key == "crash":
+                os._exit(1)
+            return ShipResult(1, 1)
+
+        self.shipper.ship = ship
+        workers = ShipWorkers(self.shipper, 2, multiprocessing.get_context("fork"))
+        try:
+            with self.assertLogs("s3_log_shipper.backfill", "WARNING"):
+                with self.assertRaises(RuntimeError):
+                    workers.ship("bucket", "crash")
+            self.assertEqual(1, workers.processes)
+
+            for _ in range(3):
+                self.assertEqual(ShipResult(1, 1), workers.ship("bucket", OOZIE))
+
+            with self.assertLogs("s3_log_shipper.backfill", "WARNING"):
+                with self.assertRaises(RuntimeError):
+                    workers.ship("bucket", "crash")
+            with self.assertRaises(RuntimeError):
+                workers.ship("bucket", OOZIE)
+        finally:
+            workers.close()
+
+    @mock_s3
+    def test_lists_an_s3_prefix(self):
+        s3 = boto3.client("s3", region_name="us-east-1")
+        s3.create_bucket(Bucket="bucket")
+        for key in (OOZIE, LIVY, "other/file.gz"):
+            s3.put_object(Bucket="bucket", Key=key, Body=b"data")
+
+        bucket, prefix = parse_source("s3://bucket/emr-logs/")
+        objects = list(list_s3(s3, bucket, prefix))
+
+        self.assertEqual([LIVY, OOZIE], [obj.key for obj in objects])
+        self.assertEqual([4, 4], [obj.size for obj in objects])
+        self.assertNotIn('"', objects[0].e_tag)
+
+    def test_rejects_a_source_which_is_not_a_directory(self):
+        with self.assertRaises(SystemExit) as raised:
+            main([str(self.root / "missing")])
+
+        self.assertEqual(2, raised.exception.code)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,141 @@
+import gzip
+import json
+import multiprocessing
+import unittest
+from unittest.mock import Mock
+
+from redis import StrictRedis
+
+from s3_log_shipper.backpressure import FlowControl, RateLimiter, SpillStore
+
+
+class FlowControlSpec(unittest.TestCase):
+    def setUp(self) -> None:
+        self.redis_client = Mock(StrictRedis)
+        self.sleep = Mock()
+
+    def flow_control(self, **kwargs) -> FlowControl:
+        return FlowControl(self.redis_client, sleep=self.sleep, **kwargs)
+
+    def test_admits_below_the_soft_limit(self):
+        self.redis_client.llen.return_value = 9
+
+        self.assertTrue(self.flow_control(soft_limit=10, hard_limit=20).admit())
+        self.redis_client.llen.assert_called_once_with("logstash")
+        self.sleep.assert_not_called()
+
+    def test_backs_off_exponentially_over_the_soft_limit(self):
+        self.redis_client.llen.side_effect = [15, 15, 15, 5]
+
+        self.assertTrue(self.flow_control(soft_limit=10, hard_limit=20).admit())
+        self.assertEqual(
+            [0.1, 0.2, 0.4], [call[0][0] for call in self.sleep.call_args_list]
+        )
+
+    def test_gives_up_backing_off_after_the_max_wait(self):
+        self.redis_client.llen.return_value = 15
+
+        self.assertTrue(self.flow_control(soft_limit=10, max_wait_ms=300).admit())
+        self.assertEqual(2, self.sleep.call_count)
+
+    def test_stops_backing_off_when_asked(self):
+        self.redis_client.llen.return_value = 15
+
+        self.assertTrue(self.flow_control(soft_limit=10).admit(lambda: True))
+        self.sleep.assert_not_called()
+
+    def test_refuses_over_the_hard_limit(self):
+        self.redis_client.llen.side_effect = [15, 25]
+
+        self.assertFalse(self.flow_control(soft_limit=10, hard_limit=20).admit())
+        self.assertEqual(1, self.sleep.call_count)
+
+    def test_samples_memory(self):
+        self.redis_client.info.return_value = {"used_memory": 2048}
+
+        self.assertFalse(self.flow_control(hard_limit=1024, metric="memory").admit())
+        self.redis_client.info.assert_called_once_with("memory")
+
+    def test_samples_stream_length(self):
+        self.redis_client.xlen.return_value = 25
+
+        self.assertFalse(self.flow_control(hard_limit=20, stream=True).admit())
+        self.redis_client.xlen.assert_called_once_with("logstash")
+        self.redis_client.llen.assert_not_called()
+
+    def test_samples_the_deepest_shard(self):
+        other = Mock(StrictRedis)
+        self.redis_client.llen.return_value = 5
+        other.llen.return_value = 25
+
+        under_test = FlowControl([self.redis_client, other], hard_limit=20)
+
+        self.assertFalse(under_test.admit())
+
+    def test_rejects_bad_limits(self):
+        with self.assertRaises(ValueError):
+            self.flow_control(soft_limit=20, hard_limit=10)
+        with self.assertRaises(ValueError):
+            self.flow_control(soft_limit=10, metric="keys")
+
+
+class SpillStoreSpec(unittest.TestCase):
+    def test_spills_gzipped_ndjson(self):
+        uploaded = {}
+
+        def upload_fileobj(file, bucket, key):
+            uploaded[(bucket, key)] = gzip.decompress(file.read())
+
+        s3_client = Mock()
+        s3_client.upload_fileobj.side_effect = upload_fileobj
+
+        spill = SpillStore(s3_client, "staging").spill("logs", "app.log.gz", 42)
+        spill.write('{"a":1}')
+        spill.write(b'{"b":2}')
+        spill.close()
+
+        body = uploaded[
+            ("staging", "s3-log-shipper-spill/logs/app.log.gz.42.ndjson.gz")
+        ]
+        self.assertEqual(
+            [{"a": 1}, {"b": 2}], [json.loads(line) for line in body.splitlines()]
+        )
+        self.assertEqual(2, spill.written)
+
+
+class RateLimiterSpec(unittest.TestCase):
+    def test_waits_until_the_records_written_are_paid_for(self):
+        now = [0.0]
+        slept = []
+        under_test = RateLimiter(100, clock=lambda: now[0], sleep=slept.append)
+
+        # A second's worth may be written straight away
+        self.assertEqual(0, under_test.acquire(100))
+        self.assertEqual(0.5, under_test.acquire(50))
+        self.assertEqual(1.5, under_test.acquire(100))
+
+        now[0] = 10.0
+        self.assertEqual(0, under_test.acquire(80))
+        self.assertEqual([0.5, 1.5], slept)
+
+    def test_shares_the_allowance_with_forked_processes(self):
+        slept = []
+        context = multiprocessing.get_context("fork")
+        under_test = RateLimiter(
+            100, clock=lambda: 0.0, sleep=slept.append, context=context
+        )
+
+        child = context.Process(target=under_test.acquire, args=(100,))
+        child.start()
+        child.join()
+
+        self.assertEqual(0.5, under_test.acquire(50))
+        self.assertEqual([0.5], slept)
+
+    def test_rejects_a_rate_which_is_not_positive(self):
+        with self.assertRaises(ValueError):
+            RateLimiter(0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,34 @@
+import os
+import unittest
+from pathlib import Path
+
+from bench.generator import LOG_TYPES, generate_lines
+from s3_log_shipper.parsers import ParserManager
+
+
+class GeneratorSpec(unittest.TestCase):
+    def setUp(self) -> None:
+        config = Path(os.path.dirname(__file__)).parent / "input_files.json"
+        self.parser_manager = ParserManager(config_file=config)
+
+    def test_generated_logs_match_their_groks(self):
+        for log_type, generated in LOG_TYPES.items():
+            with self.subTest(log_type):
+                parser, _ = self.parser_manager.get_parser(f"bucket/{generated.key}")
+                self.assertEqual(log_type, parser.type)
+
+                for line in generate_lines(log_type, 10000, seed=1):
+                    self.assertIsNotNone(parser.parse_log(line), line)
+
+                for line in generate_lines(log_type, 1000, error_rate=1, seed=1):
+                    self.assertIsNone(parser.parse_log(line), line)
+
+    def test_generation_is_reproducible(self):
+        self.assertEqual(
+            list(generate_lines("oozie", 5000, 0.1, seed=7)),
+            list(generate_lines("oozie", 5000, 0.1, seed=7)),
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
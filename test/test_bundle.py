@@ -0,0 +1,83 @@
+import csv
+import json
+import os
+import tempfile
+from pathlib import Path
+from unittest import TestCase
+from unittest.mock import patch
+
+from s3_log_shipper import bundle
+from s3_log_shipper.bundle import PatternBundle, CompiledGrok
+from s3_log_shipper.parsers import ParserManager
+from test.fixtures import config_path
+
+
+class PatternBundleSpec(TestCase):
+    _config_file = Path(config_path()).absolute()
+
+    def setUp(self) -> None:
+        self._dir = tempfile.TemporaryDirectory()
+        self._bundle_file = Path(self._dir.name) / "test_config.bundle.json"
+        ParserManager(self._config_file).build_bundle().save(self._bundle_file)
+
+    def tearDown(self) -> None:
+        self._dir.cleanup()
+
+    def test_bundled_parsers_agree_with_pygrok(self):
+        parser_manager = ParserManager(self._config_file)
+        with open(
+            f"{os.path.dirname(__file__)}/sample_logs.csv", "rt"
+        ) as sample_logs_file:
+            samples = [
+                (line[0], line[1])
+                for line in csv.reader(sample_logs_file, delimiter="|")
+            ]
+
+        expected = []
+        for path, log in samples:
+            prs, path_groks = parser_manager.get_parser(path)
+            expected.append((path_groks, prs.parse_log(log)))
+
+        # Nothing may be built with pygrok once the bundle is loaded
+        with patch("s3_log_shipper.parsers.Grok", side_effect=AssertionError):
+            bundled = ParserManager(self._config_file, bundle_file=self._bundle_file)
+
+            actual = []
+            for path, log in samples:
+                prs, path_groks = bundled.get_parser(path)
+                self.assertIsInstance(prs.log_grok, CompiledGrok)
+                actual.append((path_groks, prs.parse_log(log)))
+
+        self.assertEqual(expected, actual)
+
+    def test_compiled_grok_converts_types(self):
+        grok = CompiledGrok(
+            "%{INT:count:int}", r"(?P<count>\d+) (?P<ratio>[\d.]+)", {"count": "int"}
+        )
+
+        self.assertEqual({"count": 12, "ratio": "0.5"}, grok.match("x 12 0.5"))
+        self.assertIsNone(grok.match("none"))
+
+    def test_stale_bundle_is_ignored(self):
+        with open(self._bundle_file) as bf:
+            content = json.load(bf)
+        content["checksum"] = "stale"
+        with open(self._bundle_file, "w") as bf:
+            json.dump(content, bf)
+
+        with self.assertLogs("s3_log_shipper.parsers", "WARNING"):
+            parser_manager = ParserManager(
+                self._config_file, bundle_file=self._bundle_file
+            )
+
+        self.assertIsNone(parser_manager._bundle)
+        with self.assertRaises(ValueError):
+            PatternBundle.load(self._bundle_file, parser_manager.checksum)
+
+    def test_check_fails_until_bundle_is_built(self):
+        output = Path(self._dir.name) / "other.bundle.json"
+        args = [str(self._config_file), "--output", str(output)]
+
+        self.assertEqual(1, bundle.main(args + ["--check"]))
+        self.assertEqual(0, bundle.main(args))
+        self.assertEqual(0, bundle.main(args + ["--check"]))
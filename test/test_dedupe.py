@@ -0,0 +1,77 @@
+from unittest import TestCase
+from unittest.mock import Mock
+
+from redis import StrictRedis
+
+from s3_log_shipper.dedupe import DuplicateFilter
+
+
+class DuplicateFilterSpec(TestCase):
+    def test_only_the_first_claim_ships(self) -> None:
+        redis_client = Mock(spec=StrictRedis)
+        redis_client.set.side_effect = [True, None]
+
+        first = DuplicateFilter(redis_client, ttl=60, claim_ttl=30)
+        second = DuplicateFilter(redis_client, ttl=60, claim_ttl=30)
+
+        self.assertTrue(first.claim("bucket", "key", "etag", "0001"))
+        self.assertFalse(second.claim("bucket", "key", "etag", "0001"))
+        self.assertEqual(1, second.skipped)
+        redis_client.set.assert_called_with(
+            "s3-log-shipper:shipped:bucket/key:etag", "0001", nx=True, ex=30
+        )
+
+    def test_claims_last_as_long_as_the_invocation_until_shipped(self) -> None:
+        redis_client = Mock(spec=StrictRedis)
+        redis_client.set.return_value = True
+        duplicates = DuplicateFilter(redis_client, ttl=86400)
+
+        duplicates.claim("bucket", "key", "etag", "0001", ttl=120)
+        redis_client.set.assert_called_with(
+            "s3-log-shipper:shipped:bucket/key:etag", "0001", nx=True, ex=120
+        )
+
+        duplicates.shipped("bucket", "key", "etag")
+        redis_client.set.assert_called_with(
+            "s3-log-shipper:shipped:bucket/key:etag", "shipped", ex=86400
+        )
+
+    def test_shipped_versions_are_skipped_without_redis(self) -> None:
+        redis_client = Mock(spec=StrictRedis)
+        redis_client.set.return_value = True
+        duplicates = DuplicateFilter(redis_client, cache_size=1)
+
+        self.assertTrue(duplicates.claim("bucket", "key", "etag", "0001"))
+        duplicates.shipped("bucket", "key", "etag")
+        self.assertFalse(duplicates.claim("bucket", "key", "etag", "0001"))
+        self.assertEqual(2, redis_client.set.call_count)
+
+        # The oldest version is forgotten once the cache is full, and redis decides
+        duplicates.shipped("bucket", "other-key", "etag")
+        self.assertTrue(duplicates.claim("bucket", "key", "etag", "0001"))
+        self.assertEqual(4, redis_client.set.call_count)
+
+    def test_released_claims_can_be_claimed_again(self) -> None:
+        redis_client = Mock(spec=StrictRedis)
+        redis_client.set.return_value = True
+        duplicates = DuplicateFilter(redis_client)
+
+        duplicates.claim("bucket", "key", "etag", "0001")
+        duplicates.release("bucket", "key", "etag")
+
+        self.assertTrue(duplicates.claim("bucket", "key", "etag", "0001"))
+        redis_client.delete.assert_called_once_with(
+            "s3-log-shipper:shipped:bucket/key:etag"
+        )
+
+    def test_objects_without_an_etag_are_always_shipped(self) -> None:
+        redis_client = Mock(spec=StrictRedis)
+        duplicates = DuplicateFilter(redis_client)
+
+        self.assertTrue(duplicates.claim("bucket", "key", None, "0001"))
+        duplicates.shipped("bucket", "key", None)
+        self.assertTrue(duplicates.claim("bucket", "key", None, "0002"))
+        duplicates.release("bucket", "key", None)
+
+        redis_client.set.assert_not_called()
+        redis_client.delete.assert_not_called()
@@ -0,0 +1,87 @@
+import json
+import tempfile
+import unittest
+from pathlib import Path
+
+from s3_log_shipper.filters import LineFilter
+from s3_log_shipper.parsers import ParserManager
+from test.fixtures import config_path
+
+INFO = "20/04/27 19:14:44 INFO SecurityManager: authentication disabled\n"
+ERROR = "20/04/27 19:14:45 ERROR FsHistoryProvider: Exception encountered\n"
+TRACE = "java.io.FileNotFoundException: File does not exist\n"
+
+
+class LineFilterSpec(unittest.TestCase):
+    def test_drops_other_levels_and_keeps_lines_without_one(self):
+        under_test = LineFilter(levels=["WARN", "ERROR"])
+
+        self.assertEqual((ERROR + TRACE, 1), under_test.apply(INFO + ERROR + TRACE))
+
+    def test_drops_denied_lines(self):
+        under_test = LineFilter(deny=["authentication"], deny_regex=[r"File does \w+"])
+
+        self.assertEqual((ERROR, 2), under_test.apply(INFO + ERROR + TRACE))
+        self.assertEqual(
+            (ERROR.rstrip("\n"), 1), under_test.apply(INFO + ERROR.rstrip("\n"))
+        )
+        self.assertEqual(("", 1), under_test.apply(INFO))
+
+    def test_projects_fields(self):
+        under_test = LineFilter(fields=["level"])
+
+        self.assertEqual(
+            {"level": "INFO", "type": "spark", "@timestamp": "2020"},
+            under_test.project(
+                {"level": "INFO", "message": "m", "type": "spark", "@timestamp": "2020"}
+            ),
+        )
+        self.assertEqual(
+            {"level", "timestamp", "@timestamp", "type"}, under_test.captures()
+        )
+
+    def test_rejects_bad_config(self):
+        self.assertIsNone(LineFilter.from_config(None))
+        with self.assertRaises(ValueError):
+            LineFilter.from_config({"levels": ["LOUD"]})
+        with self.assertRaises(ValueError):
+            LineFilter.from_config({"allow": ["INFO"]})
+
+    def test_parser_drops_and_projects_lines(self):
+        with open(config_path()) as config_file:
+            config = json.load(config_file)
+        config["files"][1]["filter"] = {
+            "levels": ["ERROR"],
+            "fields": ["level", "node"],
+        }
+
+        with tempfile.NamedTemporaryFile("w", suffix=".json") as filtered:
+            json.dump(config, filtered)
+            filtered.flush()
+            parser_manager = ParserManager(Path(filtered.name))
+
+        parser, path_groks = parser_manager.get_parser(
+            "bucket/emr-logs/j-1/node/i-1/applications/spark/spark-history-server.out.gz"
+        )
+        block, dropped = parser.prefilter(INFO + ERROR)
+
+        self.assertEqual({"node": "i-1"}, path_groks)
+        self.assertEqual(1, dropped)
+        self.assertEqual(
+            [
+                (
+                    0,
+                    {
+                        "level": "ERROR",
+                        "type": "spark-history",
+                        "@timestamp": "2020-04-27T19:14:45",
+                    },
+                )
+            ],
+            list(parser.parse_many(block)),
+        )
+        self.assertNotIn("message", parser.log_grok.regex_obj.groupindex)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -8,7 +8,52 @@ from unittest.mock import Mock, patch
 import boto3
 from moto import mock_s3
 
-from test.fixtures import stub_event, test_config_file
+from bench.memory_redis import MemoryRedis
+from s3_log_shipper.shipper import ShipResult
+from test.fixtures import stub_event, config_path, stub_context, stub_sqs_message
+
+
+def reset_clients(handler) -> None:
+    # The parse workers of the last shipper would otherwise be left running
+    if handler.get_parse_pool.cache_info().currsize:
+        parse_pool = handler.get_parse_pool()
+        if parse_pool is not None:
+            parse_pool.close()
+
+    # Built on first use, so the next use picks up the patched environment and redis client
+    for get_client in (
+        handler.get_s3_client,
+        handler.get_redis,
+        handler.get_shards,
+        handler.get_parser_manager,
+        handler.get_shipper,
+        handler.get_parse_pool,
+        handler.get_duplicate_filter,
+    ):
+        get_client.cache_clear()
+
+
+class ExpiringRedis(MemoryRedis):
+    """
+    Expires the values set with a TTL, on a clock the test moves on.
+    """
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.now: float = 0.0
+        self.expires = {}
+
+    def get(self, name):
+        if name in self.expires and self.expires[name] <= self.now:
+            self.values.pop(name, None)
+        return super().get(name)
+
+    def set(self, name, value, ex=None, nx=False):
+        self.get(name)
+        result = super().set(name, value, ex=ex, nx=nx)
+        if result and ex is not None:
+            self.expires[name] = self.now + ex
+        return result
 
 
 class LogHandlerSpec(TestCase):
@@ -18,7 +63,7 @@ class LogHandlerSpec(TestCase):
         {
             "REDIS_HOST": "localhost",
             "REDIS_PORT": "6579",
-            "CONFIG_FILE": test_config_file(),
+            "CONFIG_FILE": config_path(),
         },
     )
     @patch("redis.StrictRedis", autospec=True)
@@ -42,10 +87,417 @@ class LogHandlerSpec(TestCase):
                 s3.create_bucket(Bucket=bucket)
                 s3.Object(bucket, path).put(Body=log)
 
-                from handler import log_handler
+                import handler
+
+                reset_clients(handler)
+                redis_client.return_value.get.return_value = None
 
                 event: dict = stub_event(bucket, path)
-                log_handler(event=event, context=Mock())
+                handler.log_handler(event=event, context=stub_context())
+
+                q, data = redis_client.return_value.pipeline().rpush.call_args[0]
+                self.assertEqual("logstash", q)
+                self.assertEqual(expected, json.loads(data))
+
+    @patch.dict(
+        os.environ,
+        {
+            "REDIS_HOST": "localhost",
+            "REDIS_PORT": "6579",
+            "CONFIG_FILE": config_path(),
+        },
+    )
+    @patch("redis.StrictRedis", autospec=True)
+    @mock_s3
+    def test_log_handler_ships_every_record_before_failing(self, redis_client) -> None:
+        import handler
+
+        reset_clients(handler)
+
+        def ship(bucket, key, e_tag, should_stop, size=None):
+            if key == "bad-key":
+                raise ValueError(f"Parser not found for {bucket}/{key}")
+            return ShipResult(1, 1)
+
+        event: dict = stub_event("bucket", "good-key")
+        event["Records"] += stub_event("bucket", "bad-key")["Records"]
+        event["Records"] += stub_event("bucket", "other-key")["Records"]
+
+        with patch.object(handler, "get_shipper") as get_shipper:
+            shipper = get_shipper.return_value
+            shipper.ship.side_effect = ship
+
+            with self.assertRaises(handler.RecordsFailedError) as raised:
+                handler.log_handler(event=event, context=stub_context())
+
+        self.assertEqual(3, shipper.ship.call_count)
+        self.assertEqual(["bucket/bad-key"], [p for p, _ in raised.exception.failures])
+
+    @patch.dict(
+        os.environ,
+        {
+            "REDIS_HOST": "localhost",
+            "REDIS_PORT": "6579",
+            "CONFIG_FILE": config_path(),
+        },
+    )
+    @mock_s3
+    def test_retry_ships_an_object_whose_invocation_died_part_way(self) -> None:
+        import handler
+
+        reset_clients(handler)
+        redis = ExpiringRedis()
+        event: dict = stub_event("bucket", "key")
+        context = stub_context(remaining_time_in_millis=60000)
+
+        with patch.object(handler, "get_redis", return_value=redis), patch.object(
+            handler, "get_shipper"
+        ) as get_shipper:
+            ship = get_shipper.return_value.ship
+
+            # Killed, or timed out, after claiming the object, so nothing was released
+            handler.claim(handler.object_records(event), context)
+            ship.return_value = ShipResult(1, 1)
+            handler.log_handler(event=event, context=context)
+            ship.assert_not_called()
+
+            # The claim lasts no longer than the invocation could have run for
+            redis.now += 60
+            handler.log_handler(event=event, context=context)
+            self.assertEqual(1, ship.call_count)
+
+            # Raised something other than an Exception part way through the object
+            reset_clients(handler)
+            redis.clear()
+            ship.side_effect = [SystemExit(1), ShipResult(1, 1)]
+            with self.assertRaises(SystemExit):
+                handler.log_handler(event=event, context=context)
+            handler.log_handler(event=event, context=context)
+            self.assertEqual(3, ship.call_count)
+
+            # Shipped in full, so skipped from then on
+            redis.now += 60
+            handler.log_handler(event=event, context=context)
+            self.assertEqual(3, ship.call_count)
+
+    @patch.dict(
+        os.environ,
+        {
+            "REDIS_HOST": "localhost",
+            "REDIS_PORT": "6579",
+            "CONFIG_FILE": config_path(),
+        },
+    )
+    @mock_s3
+    def test_retry_ships_incomplete_records_when_they_cannot_be_continued(
+        self,
+    ) -> None:
+        import handler
+
+        reset_clients(handler)
+        redis = ExpiringRedis()
+        event: dict = stub_event("bucket", "short-key")
+        event["Records"] += stub_event("bucket", "long-key")["Records"]
+
+        def ship(bucket, key, e_tag, should_stop, size=None):
+            return ShipResult(1, 1, complete=key != "long-key")
+
+        with patch.object(handler, "get_redis", return_value=redis), patch.object(
+            handler, "get_shipper"
+        ) as get_shipper, patch.object(handler, "boto3") as boto3_module:
+            get_shipper.return_value.ship.side_effect = ship
+            boto3_module.client.return_value.invoke.side_effect = [
+                IOError("throttled"),
+                None,
+            ]
+
+            with self.assertRaises(IOError):
+                handler.log_handler(event=event, context=stub_context())
+            handler.log_handler(event=event, context=stub_context())
+
+        shipped = [c[0][1] for c in get_shipper.return_value.ship.call_args_list]
+        self.assertEqual(["long-key", "long-key", "short-key"], sorted(shipped))
+
+    @patch.dict(
+        os.environ,
+        {
+            "REDIS_HOST": "localhost",
+            "REDIS_PORT": "6579",
+            "CONFIG_FILE": config_path(),
+        },
+    )
+    @mock_s3
+    def test_retry_and_continuation_of_an_event_ship_each_object_once(self) -> None:
+        import handler
+
+        reset_clients(handler)
+        redis = ExpiringRedis()
+        event: dict = stub_event("bucket", "big")
+        event["Records"] += stub_event("bucket", "bad")["Records"]
+        shipped = []
+
+        def ship_part(bucket, key, e_tag, should_stop, size=None):
+            if key == "bad":
+                raise ValueError(f"Parser not found for {bucket}/{key}")
+            return ShipResult(1, 1, complete=False)
+
+        def ship_while_retried(bucket, key, e_tag, should_stop, size=None):
+            shipped.append(key)
+            # The event is retried while its continuation is still shipping
+            if len(shipped) == 1:
+                handler.log_handler(event=event, context=stub_context())
+            return ShipResult(1, 1)
+
+        with patch.object(handler, "get_redis", return_value=redis), patch.object(
+            handler, "get_shipper"
+        ) as get_shipper, patch.object(handler, "boto3") as boto3_module:
+            get_shipper.return_value.ship.side_effect = ship_part
+            with self.assertRaises(handler.RecordsFailedError):
+                handler.log_handler(event=event, context=stub_context())
+
+            continuation = json.loads(
+                boto3_module.client.return_value.invoke.call_args[1]["Payload"]
+            )
+            get_shipper.return_value.ship.side_effect = ship_while_retried
+            handler.log_handler(event=continuation, context=stub_context())
+
+        self.assertEqual(["big", "bad"], shipped)
+
+    @patch.dict(
+        os.environ,
+        {
+            "REDIS_HOST": "localhost",
+            "REDIS_PORT": "6579",
+            "CONFIG_FILE": config_path(),
+        },
+    )
+    @patch("redis.StrictRedis", autospec=True)
+    @mock_s3
+    def test_log_handler_continues_incomplete_records(self, redis_client) -> None:
+        import handler
+
+        reset_clients(handler)
+
+        def ship(bucket, key, e_tag, should_stop, size=None):
+            return ShipResult(1, 1, complete=key != "long-key")
+
+        event: dict = stub_event("bucket", "short-key")
+        event["Records"] += stub_event("bucket", "long-key")["Records"]
+
+        with patch.object(handler, "get_shipper") as get_shipper, patch.object(
+            handler, "boto3"
+        ) as boto3_module:
+            get_shipper.return_value.ship.side_effect = ship
+            handler.log_handler(event=event, context=stub_context())
+
+        invoke = boto3_module.client.return_value.invoke
+        invoke.assert_called_once()
+        payload = json.loads(invoke.call_args[1]["Payload"])
+        self.assertEqual(
+            ["long-key"], [r["s3"]["object"]["key"] for r in payload["Records"]]
+        )
+        self.assertEqual("Event", invoke.call_args[1]["InvocationType"])
+
+    @patch.dict(
+        os.environ,
+        {
+            "REDIS_HOST": "localhost",
+            "REDIS_PORT": "6579",
+            "CONFIG_FILE": config_path(),
+        },
+    )
+    @patch("redis.StrictRedis", autospec=True)
+    @mock_s3
+    def test_log_handler_skips_duplicate_records(self, redis_client) -> None:
+        import handler
+
+        reset_clients(handler)
+        event: dict = stub_event("bucket", "duplicate-key")
+
+        with patch.object(handler, "get_shipper") as get_shipper:
+            shipper = get_shipper.return_value
+            shipper.ship.return_value = ShipResult(1, 1)
+            handler.log_handler(event=event, context=stub_context())
+            handler.log_handler(event=event, context=stub_context())
+
+        self.assertEqual(1, shipper.ship.call_count)
+
+    @patch.dict(
+        os.environ,
+        {
+            "REDIS_HOST": "localhost",
+            "REDIS_PORT": "6579",
+            "CONFIG_FILE": config_path(),
+        },
+    )
+    @mock_s3
+    def test_log_handler_ships_records_without_an_etag_every_time(self) -> None:
+        import handler
+
+        reset_clients(handler)
+        redis = ExpiringRedis()
+        event: dict = stub_event("bucket", "rewritten-key")
+        del event["Records"][0]["s3"]["object"]["eTag"]
+
+        with patch.object(handler, "get_redis", return_value=redis), patch.object(
+            handler, "get_shipper"
+        ) as get_shipper:
+            shipper = get_shipper.return_value
+            shipper.ship.return_value = ShipResult(1, 1)
+            handler.log_handler(event=event, context=stub_context())
+            handler.log_handler(event=event, context=stub_context())
+
+        self.assertEqual(2, shipper.ship.call_count)
+        # Without an eTag, there is no checkpoint to resume from
+        self.assertIsNone(shipper.ship.call_args[0][2])
+        self.assertEqual({}, redis.values)
+
+    @patch.dict(
+        os.environ,
+        {
+            "REDIS_HOST": "localhost",
+            "REDIS_PORT": "6579",
+            "CONFIG_FILE": config_path(),
+        },
+    )
+    @patch("redis.StrictRedis", autospec=True)
+    @mock_s3
+    def test_parse_workers_start_with_the_first_large_object(
+        self, redis_client
+    ) -> None:
+        import handler
+
+        reset_clients(handler)
+        small: dict = stub_event("bucket", "small-key")
+        large: dict = stub_event("bucket", "large-key")
+        large["Records"][0]["s3"]["object"]["size"] = 100
+
+        with patch.object(handler, "cold_start", True), patch.object(
+            handler, "get_shipper"
+        ) as get_shipper, patch.object(handler, "get_parse_pool") as get_parse_pool:
+            shipper = get_shipper.return_value
+            shipper.ship.return_value = ShipResult(1, 1)
+            shipper.parse_pool = None
+            shipper.parallel_min_bytes = 100
+
+            handler.log_handler(event=small, context=stub_context())
+            get_parse_pool.assert_not_called()
+
+            handler.log_handler(event=large, context=stub_context())
+            get_parse_pool.assert_called_once()
+            self.assertEqual(get_parse_pool.return_value, shipper.parse_pool)
+
+    @patch.dict(
+        os.environ,
+        {
+            "REDIS_HOST": "localhost",
+            "REDIS_PORT": "6579",
+            "CONFIG_FILE": config_path(),
+        },
+    )
+    @patch("redis.StrictRedis", autospec=True)
+    @mock_s3
+    def test_first_invocation_reports_init_time(self, redis_client) -> None:
+        import handler
+
+        reset_clients(handler)
+
+        with patch.object(handler, "cold_start", True), patch.object(
+            handler, "metrics_log"
+        ) as metrics_log:
+            handler.log_handler(event={"Records": []}, context=stub_context())
+            handler.log_handler(event={"Records": []}, context=stub_context())
+
+        metrics_log.info.assert_called_once()
+        record = metrics_log.info.call_args[0][0]
+        self.assertEqual(1, record["ColdStart"])
+        self.assertIn("LazyInitTime", record)
+
+    @patch.dict(
+        os.environ,
+        {
+            "REDIS_HOST": "localhost",
+            "REDIS_PORT": "6579",
+            "CONFIG_FILE": config_path(),
+        },
+    )
+    @patch("redis.StrictRedis", autospec=True)
+    @mock_s3
+    def test_sqs_batch_reports_failed_messages(self, redis_client) -> None:
+        import handler
+
+        reset_clients(handler)
+
+        def ship(bucket, key, e_tag, should_stop, size=None):
+            if key == "bad-key":
+                raise ValueError(f"Parser not found for {bucket}/{key}")
+            return ShipResult(1, 1)
+
+        event = {
+            "Records": [
+                stub_sqs_message("direct", stub_event("bucket", "good-key")),
+                stub_sqs_message("sns", stub_event("bucket", "bad-key"), via_sns=True),
+                stub_sqs_message("malformed", "not json"),
+                stub_sqs_message("test", {"Event": "s3:TestEvent"}),
+            ]
+        }
+
+        with patch.object(handler, "get_shipper") as get_shipper:
+            shipper = get_shipper.return_value
+            shipper.ship.side_effect = ship
+            response = handler.log_handler(event=event, context=stub_context())
+
+        self.assertCountEqual(
+            ["good-key", "bad-key"], [c[0][1] for c in shipper.ship.call_args_list]
+        )
+        self.assertEqual(
+            {
+                "batchItemFailures": [
+                    {"itemIdentifier": "malformed"},
+                    {"itemIdentifier": "sns"},
+                ]
+            },
+            response,
+        )
+
+    @patch.dict(
+        os.environ,
+        {
+            "REDIS_HOST": "localhost",
+            "REDIS_PORT": "6579",
+            "CONFIG_FILE": config_path(),
+        },
+    )
+    @patch("redis.StrictRedis", autospec=True)
+    @mock_s3
+    def test_sqs_batch_retries_incomplete_messages(self, redis_client) -> None:
+        import handler
+
+        reset_clients(handler)
+
+        def ship(bucket, key, e_tag, should_stop, size=None):
+            return ShipResult(1, 1, complete=key != "long-key")
+
+        event = {
+            "Records": [
+                stub_sqs_message("short", stub_event("bucket", "short-key")),
+                stub_sqs_message("long", stub_event("bucket", "long-key")),
+            ]
+        }
+
+        with patch.object(handler, "get_shipper") as get_shipper, patch.object(
+            handler, "boto3"
+        ) as boto3_module:
+            shipper = get_shipper.return_value
+            shipper.ship.side_effect = ship
+            response = handler.log_handler(event=event, context=stub_context())
+
+            # Redelivered, only the incomplete object is shipped again
+            handler.log_handler(event=event, context=stub_context())
 
-                od = json.dumps(expected, sort_keys=True)
-                redis_client().rpush.assert_called_with("logstash", od)
+        boto3_module.client.return_value.invoke.assert_not_called()
+        self.assertEqual({"batchItemFailures": [{"itemIdentifier": "long"}]}, response)
+        self.assertCountEqual(
+            ["short-key", "long-key", "long-key"],
+            [c[0][1] for c in shipper.ship.call_args_list],
+        )
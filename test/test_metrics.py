@@ -0,0 +1,84 @@
+import json
+import logging
+import unittest
+from itertools import count
+
+from s3_log_shipper.metrics import ShipMetrics, EmfFormatter, process_uptime
+
+
+class ShipMetricsSpec(unittest.TestCase):
+    def setUp(self) -> None:
+        # Every reading of the clock is a second after the last
+        ticks = count()
+        self.under_test = ShipMetrics(sample_every=10, clock=lambda: next(ticks))
+
+    def test_sampled_stages_are_scaled_up_to_every_call(self):
+        encode = self.under_test.sampled("encode", str.upper)
+
+        self.assertEqual(["A"] * 25, [encode("a") for _ in range(25)])
+
+        # Calls 1, 11 and 21 were timed at a second each
+        self.assertEqual({"encode": 25.0}, self.under_test.timings())
+
+    def test_nested_stages_are_excluded(self):
+        convert = self.under_test.sampled("timestamp", str.strip)
+        with self.under_test.timer("grok"):
+            convert(" 2020 ")
+
+        timings = self.under_test.timings()
+        self.assertEqual(1.0, timings["timestamp"])
+        self.assertEqual(2.0, timings["grok"])
+
+    def test_emf(self):
+        with self.under_test.timer("redis"):
+            pass
+        self.under_test.count("bytes_out", 1024)
+        self.under_test.count("unmatched", 2)
+
+        record = self.under_test.emf({"Type": "oozie"}, {"Key": "oozie.log.gz"})
+
+        directive = record["_aws"]["CloudWatchMetrics"][0]
+        self.assertEqual("S3LogShipper", directive["Namespace"])
+        self.assertEqual([["Type"]], directive["Dimensions"])
+        self.assertEqual(
+            [
+                {"Name": "RedisTime", "Unit": "Milliseconds"},
+                {"Name": "BytesOut", "Unit": "Bytes"},
+                {"Name": "Unmatched", "Unit": "Count"},
+            ],
+            directive["Metrics"],
+        )
+        self.assertEqual(
+            ("oozie", "oozie.log.gz", 1000.0, 1024, 2),
+            (
+                record["Type"],
+                record["Key"],
+                record["RedisTime"],
+                record["BytesOut"],
+                record["Unmatched"],
+            ),
+        )
+
+    def test_emf_records_are_logged_unwrapped(self):
+        formatter = EmfFormatter()
+        record = self.under_test.emf({"Type": "oozie"})
+
+        def format_message(msg) -> dict:
+            log_record = logging.LogRecord(
+                "metrics", logging.INFO, "", 0, msg, (), None
+            )
+            return json.loads(formatter.format(log_record))
+
+        self.assertEqual(record, format_message(record))
+        self.assertEqual({"a": 1}, format_message({"a": 1})["message"])
+
+    def test_process_uptime(self):
+        uptime = process_uptime()
+
+        if uptime is not None:
+            self.assertGreaterEqual(uptime, 0.0)
+            self.assertLess(uptime, 24 * 60 * 60)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,98 @@
+import unittest
+from pathlib import Path
+
+from s3_log_shipper.metrics import ShipMetrics
+from s3_log_shipper.multiline import MultilineAssembler, SEPARATOR, unjoin
+from s3_log_shipper.parallel import parse_block
+from s3_log_shipper.parsers import ParserManager
+from test.fixtures import config_path
+
+START = r"\d{2}/\d{2}/\d{2} \d{2}:\d{2}:\d{2}"
+SPARK_HISTORY = (
+    "bucket/emr-logs/j-1/node/i-1/applications/spark/spark-history-server.out.gz"
+)
+
+INFO = "20/04/27 19:14:44 INFO SecurityManager: authentication disabled\n"
+ERROR = "20/04/27 19:14:45 ERROR FsHistoryProvider: Exception encountered\n"
+TRACE = (
+    "java.io.FileNotFoundException: File does not exist\n"
+    "\tat org.apache.hadoop.hdfs.DistributedFileSystem.getFileStatus(DistributedFileSystem.java:1500)\n"
+)
+
+
+class MultilineAssemblerSpec(unittest.TestCase):
+    def test_joins_continuation_lines_onto_their_event(self):
+        under_test = MultilineAssembler(START)
+
+        joined = under_test.join(INFO + ERROR + TRACE + INFO)
+
+        self.assertEqual(
+            INFO + (ERROR + TRACE).rstrip("\n").replace("\n", SEPARATOR) + "\n" + INFO,
+            joined,
+        )
+        self.assertEqual(
+            {"message": "Exception\njava.io", "level": "ERROR"},
+            MultilineAssembler.restore(
+                {"message": f"Exception{SEPARATOR}java.io", "level": "ERROR"}
+            ),
+        )
+
+    def test_never_splits_an_event_between_blocks(self):
+        under_test = MultilineAssembler(START)
+        lines = (INFO + ERROR + TRACE + INFO).splitlines(keepends=True)
+
+        blocks = list(under_test.blocks(lines))
+
+        self.assertEqual([INFO, ERROR + TRACE, INFO], blocks)
+
+    def test_cuts_events_longer_than_max_bytes(self):
+        under_test = MultilineAssembler(START, max_bytes=len(ERROR))
+        lines = (ERROR + TRACE + INFO).splitlines(keepends=True)
+
+        blocks = list(under_test.blocks(lines))
+
+        self.assertEqual(ERROR + TRACE + INFO, "".join(blocks))
+        self.assertEqual(ERROR + TRACE.splitlines(keepends=True)[0], blocks[0])
+
+    def test_rejects_bad_config(self):
+        self.assertIsNone(MultilineAssembler.from_config(None))
+        with self.assertRaises(ValueError):
+            MultilineAssembler.from_config({"pattern": START})
+        with self.assertRaises(ValueError):
+            MultilineAssembler.from_config({"start": START, "negate": True})
+
+    def test_ships_separators_in_the_log_as_they_were(self):
+        under_test = MultilineAssembler(START)
+        error = ERROR.replace("Exception", "Exception\x00\x01e\x01")
+
+        joined = under_test.join(INFO + error + TRACE)
+
+        self.assertEqual(2, joined.count("\n"))
+        self.assertEqual(INFO + error + TRACE, unjoin(joined))
+        self.assertEqual(
+            {"message": error + "java.io"},
+            MultilineAssembler.restore({"message": under_test.join(error + "java.io")}),
+        )
+
+    def test_parser_groks_each_event_once(self):
+        parser, _ = ParserManager(Path(config_path())).get_parser(SPARK_HISTORY)
+        parsed = list(parser.parse_many(parser.multiline.join(INFO + ERROR + TRACE)))
+
+        self.assertEqual(2, len(parsed))
+        self.assertEqual(
+            "FsHistoryProvider: Exception encountered\n" + TRACE.rstrip("\n"),
+            parsed[1][1]["message"],
+        )
+
+    def test_reports_unmatched_events_with_their_lines(self):
+        parser, _ = ParserManager(Path(config_path())).get_parser(SPARK_HISTORY)
+        unparseable = "20/04/27 19:14:46 not a level\n\x00" + TRACE
+
+        parsed = parse_block(parser, INFO + unparseable, dict, str, ShipMetrics())
+
+        self.assertEqual(1, len(parsed.records))
+        self.assertEqual([unparseable.rstrip("\n")], parsed.unmatched)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,98 @@
+import csv
+import json
+import os
+import re
+from unittest import TestCase
+
+from pygrok import Grok
+
+import s3_log_shipper
+from s3_log_shipper.optimiser import (
+    compile_optimised,
+    drop_unused_groups,
+    lazy_leading_greedydata,
+    mismatches,
+)
+
+GROKS_DIR = f"{os.path.dirname(s3_log_shipper.__file__)}/groks"
+CONFIG_FILE = f"{os.path.dirname(s3_log_shipper.__file__)}/../input_files.json"
+
+
+class GrokOptimiserSpec(TestCase):
+    def test_unused_groups_are_not_captured(self):
+        self.assertEqual(
+            r"(?:(?P<a>x)(?:y)[(](?:z))",
+            drop_unused_groups(r"((?P<a>x)(y)[(](?P<b>z))", keep={"a"}),
+        )
+        self.assertEqual(r"(x)\1", drop_unused_groups(r"(x)\1"))
+
+    def test_leading_greedydata_is_lazy_and_anchored(self):
+        self.assertEqual(
+            r"^(?:(?P<timestamp>.*?)\s{2}(?P<level>INFO))",
+            lazy_leading_greedydata(r"(?:(?P<timestamp>.*)\s{2}(?P<level>INFO))"),
+        )
+        self.assertEqual(
+            r"^(?P<timestamp>.*?)\s(?P<level>INFO)",
+            lazy_leading_greedydata(r"(?P<timestamp>.*?)\s(?P<level>INFO)", lazy=False),
+        )
+        self.assertEqual(
+            r"(?P<a>.*)(?P<b>.*)", lazy_leading_greedydata(r"(?P<a>.*)(?P<b>.*)")
+        )
+        self.assertEqual(
+            r"^(?P<timestamp>.*)\s(?P<level>INFO)",
+            lazy_leading_greedydata(r"(?P<timestamp>.*)\s(?P<level>INFO)", lazy=False),
+        )
+
+    def test_optimised_emr_groks_agree_with_pygrok(self):
+        with open(
+            f"{os.path.dirname(__file__)}/sample_logs.csv", "rt"
+        ) as sample_logs_file:
+            samples = [line[1] for line in csv.reader(sample_logs_file, delimiter="|")]
+
+        samples.append(
+            "\tat org.apache.oozie.service.StatusTransitService.run(StatusTransitService.java:520)"
+        )
+
+        for name in ["OOZIE", "SPARKHISTORY", "LIVY", "LIVYREQUESTS", "YARN"]:
+            grok = Grok("%%{%s}" % name, custom_patterns_dir=GROKS_DIR)
+            optimised = compile_optimised(grok.regex_obj, samples)
+
+            self.assertIsNotNone(optimised, name)
+            self.assertEqual([], mismatches(grok.regex_obj, optimised, samples), name)
+
+    def test_optimised_grok_stays_greedy_when_lazy_disagrees(self):
+        original = re.compile(
+            r"((?P<timestamp>.*)\s(?P<level>INFO|WARN)\s(?P<message>.*))"
+        )
+        sample = "12:00 INFO the WARN light is on"
+
+        optimised = compile_optimised(original, [sample])
+
+        self.assertEqual(
+            r"^(?:(?P<timestamp>.*)\s(?P<level>INFO|WARN)\s(?P<message>.*))",
+            optimised.pattern,
+        )
+        self.assertEqual("WARN", optimised.search(sample)["level"])
+
+    def test_configured_groks_agree_with_pygrok_on_level_words_in_messages(self):
+        with open(CONFIG_FILE, "rt") as config_file:
+            files = json.load(config_file)["files"]
+
+        for file in files:
+            name = file.get("grok", "%%{%s}" % file["type"].upper().replace("-", ""))
+            original = Grok(name, custom_patterns_dir=GROKS_DIR).regex_obj
+            with self.subTest(file["type"]):
+                optimised = compile_optimised(original, file["samples"])
+
+                self.assertIsNotNone(optimised)
+                for sample in file["samples"]:
+                    expected = original.search(sample)
+                    actual = optimised.search(sample)
+                    self.assertEqual(
+                        expected and expected.groupdict(),
+                        actual and actual.groupdict(),
+                        sample,
+                    )
+                    if expected is not None and "level" in expected.groupdict():
+                        # The level is the first level word, not one inside the message
+                        self.assertNotRegex(expected["timestamp"], r"[A-Za-z]{4}")
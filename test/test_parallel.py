@@ -0,0 +1,93 @@
+import unittest
+from pathlib import Path
+from unittest.mock import patch
+
+from pygrok import Grok
+
+from s3_log_shipper.metrics import ShipMetrics
+from s3_log_shipper.parallel import ParsePool, parse_block
+from s3_log_shipper.parsers import ParserManager
+from s3_log_shipper.serialisers import JsonSerialiser
+from test.fixtures import config_path
+
+PATH = (
+    "bucket/emr-logs/j-2QN8WF3UJZKK3/node/i-0c08a7e99b9985c73/applications/oozie/oozie.log-2020-04-28"
+    "-05.gz"
+)
+
+BLOCKS = [
+    "".join(
+        f"2020-04-28 05:58:{i % 60:02d},602  INFO Service:520 - block {b} line {i}\n"
+        if i % 7
+        else f"not a log line {b} {i}\n"
+        for i in range(200)
+    )
+    for b in range(9)
+]
+
+
+class ParsePoolSpec(unittest.TestCase):
+    def setUp(self) -> None:
+        self.parser_manager = ParserManager(Path(config_path()).absolute())
+        self.serialiser = JsonSerialiser()
+        self.under_test = ParsePool(self.parser_manager, self.serialiser, 3)
+
+    def tearDown(self) -> None:
+        self.under_test.close()
+
+    def serial(self, block: str):
+        parser, path_groks = self.parser_manager.get_parser(PATH)
+        return parse_block(
+            parser,
+            block,
+            self.serialiser.bind(path_groks),
+            parser.timestamp_converter,
+            ShipMetrics(),
+        )
+
+    def test_parses_blocks_in_order_as_they_are_parsed_serially(self):
+        metrics = ShipMetrics()
+
+        parsed = list(self.under_test.parse(PATH, enumerate(BLOCKS), metrics))
+
+        self.assertEqual(list(range(len(BLOCKS))), [tag for tag, _ in parsed])
+        self.assertEqual(
+            [self.serial(block) for block in BLOCKS], [p for _, p in parsed]
+        )
+        self.assertIn("grok", metrics.timings())
+
+    def test_workers_inherit_every_parser_built_before_forking(self):
+        with patch("s3_log_shipper.parsers.Grok", wraps=Grok) as grok:
+            self.parser_manager.get_parser(PATH)
+            self.parser_manager.parsers()
+
+        grok.assert_not_called()
+
+    def test_is_left_ready_for_the_next_object_when_stopped_or_failed(self):
+        results = self.under_test.parse(PATH, enumerate(BLOCKS))
+        next(results)
+        results.close()
+
+        with self.assertRaises(RuntimeError):
+            list(self.under_test.parse("bucket/unknown.log", enumerate(BLOCKS)))
+
+        parsed = list(self.under_test.parse(PATH, enumerate(BLOCKS[:2])))
+        self.assertEqual(
+            [self.serial(block) for block in BLOCKS[:2]], [p for _, p in parsed]
+        )
+
+    def test_is_reserved_by_one_object_at_a_time_and_broken_by_a_dead_worker(self):
+        self.assertTrue(self.under_test.reserve())
+        self.assertFalse(self.under_test.reserve())
+        self.under_test.release()
+
+        self.under_test._processes[1].terminate()
+        self.under_test._processes[1].join()
+
+        with self.assertRaises(RuntimeError):
+            list(self.under_test.parse(PATH, enumerate(BLOCKS)))
+        self.assertFalse(self.under_test.reserve())
+
+
+if __name__ == "__main__":
+    unittest.main()
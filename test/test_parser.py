@@ -5,16 +5,24 @@ import os
 from pathlib import Path
 from typing import Tuple
 from unittest import TestCase
+from unittest.mock import patch
 
-from s3_log_shipper.parsers import ParserManager, Parser
-from test.fixtures import test_config_file
+from pygrok import Grok
+
+from s3_log_shipper.parsers import (
+    ParserManager,
+    Parser,
+    split_path_grok,
+    literal_suffix,
+)
+from test.fixtures import config_path
 
 logging.basicConfig(level=logging.INFO)
 logger: logging.Logger = logging.getLogger(__name__)
 
 
 class LogParserSpec(TestCase):
-    _config_file = Path(test_config_file()).absolute()
+    _config_file = Path(config_path()).absolute()
 
     def test_parse_no_exceptions(self):
         parser_manager = ParserManager(self._config_file)
@@ -58,3 +66,99 @@ class LogParserSpec(TestCase):
                     json.dumps(expected, sort_keys=True),
                     json.dumps(actual, sort_keys=True),
                 )
+
+    def test_indexed_lookup_matches_every_parser(self):
+        parser_manager = ParserManager(self._config_file)
+        directory = (
+            "bucket/emr-logs/j-2QN8WF3UJZKK3/node/i-0c08a7e99b9985c73/applications"
+        )
+
+        paths = [
+            f"{directory}/oozie/oozie.log-2020-04-28-05.gz",
+            f"{directory}/spark/spark-history-server.out.gz",
+            f"{directory}/livy/livy-livy-server.out.1.gz",
+            f"{directory}/livy/a1b2.request.log.gz",
+            f"{directory}/hadoop-yarn/yarn-yarn-resourcemanager-ip-10-1-2-3.log.1.gz",
+            f"{directory}/hadoop-yarn/yarn-yarn-proxyserver-ip-10-1-2-3.log.1.gz",
+            f"{directory}/hadoop-yarn/yarn-yarn-timelineserver-ip-10-1-2-3.log.1.gz",
+            f"{directory}/hadoop-yarn/yarn-yarn-nodemanager-ip-10-1-2-3.log.1.gz",
+            f"{directory}/oozie/oozie.log-2020-04-28-05",
+            # The basename of a path grok matches across slashes, as the whole grok does
+            f"{directory}/oozie/oozie.log.1.gz/x",
+            f"{directory}/oozie/oozie.log-2020/04/28.gz",
+            f"{directory}/oozie2/oozie.log-2020-04-28-05.gz",
+            "bucket/other-logs/oozie.log-2020-04-28-05.gz",
+            "oozie.log-2020-04-28-05.gz",
+        ]
+
+        for path in paths + paths:
+            expected = next(
+                (
+                    (prs, prs.match_path(path))
+                    for prs in parser_manager.parsers()
+                    if prs.match_path(path)
+                ),
+                None,
+            )
+            self.assertEqual(expected, parser_manager.get_parser(path), path)
+
+    def test_parsers_are_built_on_demand(self):
+        parser_manager = ParserManager(self._config_file)
+
+        prs, _ = parser_manager.get_parser(
+            "bucket/emr-logs/j-1/node/i-1/applications/livy/livy-livy-server.out.1.gz"
+        )
+
+        self.assertEqual("livy", prs.type)
+        self.assertEqual([prs], [p for p in parser_manager._parsers if p is not None])
+        self.assertIs(prs, parser_manager.parsers()[2])
+
+    def test_only_the_groks_matched_are_built_with_pygrok(self):
+        with patch("s3_log_shipper.parsers.Grok", wraps=Grok) as grok:
+            parser_manager = ParserManager(self._config_file)
+            grok.assert_not_called()
+
+            prs, _ = parser_manager.get_parser(
+                "bucket/emr-logs/j-1/node/i-1/applications/livy/livy-livy-server.out.1.gz"
+            )
+
+        # The directory grok of the path matched, and the parser's log grok
+        self.assertEqual(2, grok.call_count)
+        self.assertEqual("%{LIVY}", grok.call_args[0][0])
+
+    def test_split_path_grok(self):
+        self.assertEqual(
+            ("%{GREEDYDATA:bucketname}/logs", "app.*.gz"),
+            split_path_grok("%{GREEDYDATA:bucketname}/logs\\/app.*.gz"),
+        )
+        self.assertIsNone(split_path_grok("%{GREEDYDATA:bucketname}/%{WORD:file}"))
+        self.assertIsNone(split_path_grok("logs/app|other/app"))
+        self.assertEqual(
+            "/applications/oozie", literal_suffix("%{X:y}/applications/oozie")
+        )
+        self.assertEqual("", literal_suffix("%{X:y}/applications/oozie?"))
+
+    def test_parse_many_agrees_with_parse_log(self):
+        parser_manager = ParserManager(self._config_file)
+
+        with open(
+            f"{os.path.dirname(__file__)}/sample_logs.csv", "rt"
+        ) as sample_logs_file:
+            for line in csv.reader(sample_logs_file, delimiter="|"):
+                prs, _ = parser_manager.get_parser(line[0])
+                lines = [
+                    line[1],
+                    "\tat org.apache.Foo.bar(Foo.java:1)",
+                    "",
+                    line[1],
+                    "20/04/28 07:48:37\n",
+                ]
+                buffer = "\n".join(lines)
+
+                expected = []
+                offset = 0
+                for entry in buffer.splitlines(keepends=True):
+                    expected.append((offset, prs.parse_log(entry)))
+                    offset += len(entry)
+
+                self.assertEqual(expected, list(prs.parse_many(buffer)))
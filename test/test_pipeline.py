@@ -0,0 +1,89 @@
+import gzip
+import io
+import unittest
+
+import boto3
+from moto import mock_s3
+
+from s3_log_shipper.metrics import ShipMetrics
+from s3_log_shipper.pipeline import ReadAhead, inflate, ranged_chunks
+
+TEXT = "".join(
+    f"2020-04-28 05:58:{i % 60:02d} INFO line {i} café\n" for i in range(500)
+)
+
+
+def chunked(data: bytes, size: int):
+    return iter([data[i:][:size] for i in range(0, len(data), size)])
+
+
+class PipelineSpec(unittest.TestCase):
+    def test_inflates_every_member_in_bounded_chunks(self):
+        data = TEXT.encode("utf-8")
+        compressed = gzip.compress(data[:1000]) + gzip.compress(data[1000:])
+
+        inflated = list(inflate(chunked(compressed, 7), 100))
+
+        self.assertEqual(data, b"".join(inflated))
+        self.assertLessEqual(max(len(chunk) for chunk in inflated), 100)
+
+    def test_truncated_stream_fails(self):
+        compressed = gzip.compress(TEXT.encode("utf-8"))
+
+        with self.assertRaises(EOFError):
+            list(inflate(chunked(compressed[:-20], 64), 1024))
+
+    def test_reads_ahead_across_split_characters(self):
+        # Every chunk of 7 bytes splits some "é" between two chunks
+        compressed = gzip.compress(TEXT.encode("utf-8"))
+
+        with ReadAhead(chunked(compressed, 7), True, 64, ShipMetrics(), 2) as stream:
+            text = "".join(iter(lambda: stream.read(64), ""))
+
+        self.assertEqual(TEXT, text)
+
+    def test_reads_gzipped_line_endings_as_newlines(self):
+        # Inflated 2 bytes at a time, which splits the first "\r\n" between two chunks
+        compressed = gzip.compress(b"a\r\nbc\r\nd\re\n")
+
+        with ReadAhead(iter([compressed]), True, 2, ShipMetrics(), 2) as stream:
+            text = "".join(iter(lambda: stream.read(2), ""))
+
+        with gzip.open(io.BytesIO(compressed), "rt") as text_mode:
+            self.assertEqual(text_mode.read(), text)
+        self.assertEqual("a\nbc\nd\ne\n", text)
+
+    def test_raises_errors_to_the_reader_and_stops_when_closed(self):
+        def failing():
+            yield b"ok\n"
+            raise IOError("connection reset")
+
+        with ReadAhead(failing(), False, 64, ShipMetrics()) as stream:
+            with self.assertRaises(IOError):
+                stream.read()
+            self.assertEqual("", stream.read())
+
+        # Closed long before the end, with the queue full
+        with ReadAhead(chunked(TEXT.encode("utf-8"), 8), False, 8, ShipMetrics(), 1):
+            pass
+
+    @mock_s3
+    def test_downloads_ranges_in_order(self):
+        s3 = boto3.client("s3", region_name="us-east-1")
+        s3.create_bucket(Bucket="logs")
+        s3.put_object(Bucket="logs", Key="app.log", Body=TEXT.encode("utf-8"))
+        s3.put_object(Bucket="logs", Key="empty.log", Body=b"")
+        metrics = ShipMetrics()
+
+        chunks = list(ranged_chunks(s3, "logs", "app.log", 1000, 300, metrics, 3))
+
+        self.assertEqual(TEXT.encode("utf-8"), b"".join(chunks))
+        self.assertLessEqual(max(len(chunk) for chunk in chunks), 300)
+        self.assertEqual(len(TEXT.encode("utf-8")), metrics.counts["bytes_in"])
+        self.assertEqual(
+            [], list(ranged_chunks(s3, "logs", "empty.log", 1000, 300, metrics))
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,7 +1,14 @@
 from typing import List
 from unittest import TestCase
 
-from s3_log_shipper.s3_event_models import Record, S3Event
+import dateutil.parser
+
+from s3_log_shipper.s3_event_models import (
+    Record,
+    S3Event,
+    from_datetime,
+    object_records,
+)
 from test.fixtures import stub_event
 
 
@@ -28,3 +35,41 @@ class S3EventsSpec(TestCase):
 
             self.assertEqual(first=head_record.s3.bucket.name, second=expected_bucket)
             self.assertEqual(first=head_record.s3.object.key, second=expected_key)
+
+    def test_event_time_parsed_as_dateutil_would(self) -> None:
+        for event_time in [
+            "2020-04-28T05:58:34.602Z",
+            "2020-04-28T05:58:34Z",
+            "2020-04-28T05:58:34.6Z",
+            "2020-04-28T05:58:34.602+01:00",
+        ]:
+            self.assertEqual(
+                dateutil.parser.parse(event_time), from_datetime(event_time)
+            )
+
+    def test_object_records_read_without_decoding_the_event(self) -> None:
+        event: dict = stub_event("foo-bucket-name", "bar-logs/ABC/xyzzy.gz")
+
+        (record,) = object_records(event)
+
+        self.assertEqual("foo-bucket-name", record.bucket)
+        self.assertEqual("bar-logs/ABC/xyzzy.gz", record.key)
+        self.assertEqual(10, record.size)
+        self.assertEqual("7e84df40f3510292a01311157c2d4234", record.e_tag)
+        self.assertEqual("005FA341389GA752AA", record.sequencer)
+        self.assertIsNone(record._record)
+        self.assertEqual(S3Event.from_dict(event).records[0], record.record)
+        self.assertIs(event["Records"][0], record.to_dict())
+
+    def test_object_keys_are_url_decoded(self) -> None:
+        encoded = "bar-logs/ABC+DEF/oozie.log-2020-04-28%3A05+%281%29.gz"
+        decoded = "bar-logs/ABC DEF/oozie.log-2020-04-28:05 (1).gz"
+        event: dict = stub_event("foo-bucket-name", encoded)
+
+        self.assertEqual(decoded, object_records(event)[0].key)
+
+        s3_event = S3Event.from_dict(event)
+        self.assertEqual(decoded, s3_event.records[0].s3.object.key)
+        self.assertEqual(
+            encoded, s3_event.to_dict()["Records"][0]["s3"]["object"]["key"]
+        )
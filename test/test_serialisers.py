@@ -0,0 +1,74 @@
+import json
+import unittest
+from unittest import TestCase
+from unittest.mock import patch
+
+from s3_log_shipper.serialisers import (
+    JsonSerialiser,
+    OrjsonSerialiser,
+    Serialiser,
+    make_serialiser,
+    orjson,
+)
+
+
+class SerialiserSpec(TestCase):
+    path_groks = {"bucketname": "bucket", "cluster": "j-2QN8WF3UJZKK3"}
+    log_groks = {"level": "INFO", "message": 'Said "hello" ☃', "type": "oozie"}
+
+    def assert_serialises(self, serialiser) -> None:
+        encode = serialiser.bind(self.path_groks)
+
+        expected = self.log_groks.copy()
+        expected.update(self.path_groks)
+        self.assertEqual(expected, json.loads(encode(self.log_groks.copy())))
+
+        overlapping = {"cluster": "from the line", "level": "WARN"}
+        self.assertEqual(
+            {"bucketname": "bucket", "cluster": "j-2QN8WF3UJZKK3", "level": "WARN"},
+            json.loads(encode(overlapping)),
+        )
+
+        self.assertEqual(self.path_groks, json.loads(encode({})))
+        self.assertEqual(
+            self.log_groks, json.loads(serialiser.bind(None)(self.log_groks))
+        )
+
+    def test_json_serialiser(self):
+        self.assert_serialises(JsonSerialiser())
+        self.assert_serialises(JsonSerialiser(as_bytes=True))
+        self.assertIsInstance(JsonSerialiser(as_bytes=True).encode({}), bytes)
+
+    def test_sorted_keys(self):
+        encode = JsonSerialiser(sort_keys=True).bind(self.path_groks)
+
+        self.assertEqual(
+            json.dumps(
+                {**self.log_groks, **self.path_groks},
+                sort_keys=True,
+                separators=(",", ":"),
+            ),
+            encode(self.log_groks.copy()),
+        )
+
+    @unittest.skipIf(orjson is None, "orjson is not installed")
+    def test_orjson_serialiser(self):
+        self.assert_serialises(OrjsonSerialiser())
+        self.assert_serialises(OrjsonSerialiser(sort_keys=True))
+        self.assertIsInstance(make_serialiser("orjson"), OrjsonSerialiser)
+
+    def test_json_is_used_unless_orjson_is_asked_for(self):
+        self.assertIsInstance(make_serialiser(), JsonSerialiser)
+
+        with patch("s3_log_shipper.serialisers.orjson", None):
+            self.assertIsInstance(make_serialiser("json"), JsonSerialiser)
+            with self.assertRaises(ImportError):
+                make_serialiser("orjson")
+
+    def test_serialiser_must_encode(self):
+        with self.assertRaises(TypeError):
+            Serialiser()
+
+    def test_unknown_serialiser(self):
+        with self.assertRaises(ValueError):
+            make_serialiser("pickle")
@@ -0,0 +1,53 @@
+import unittest
+from collections import Counter
+from unittest.mock import Mock
+
+from redis import StrictRedis
+
+from s3_log_shipper.sharding import HashRing, RedisShards, parse_endpoints
+
+
+class HashRingSpec(unittest.TestCase):
+    def test_keys_are_spread_evenly(self):
+        ring = HashRing(["a:6379", "b:6379", "c:6379"])
+
+        counts = Counter(ring.shard(f"j-{i}/i-{i}") for i in range(3000))
+
+        self.assertEqual({0, 1, 2}, set(counts))
+        self.assertTrue(all(700 < count < 1300 for count in counts.values()), counts)
+
+    def test_adding_a_shard_only_moves_keys_to_it(self):
+        before = HashRing(["a:6379", "b:6379"])
+        after = HashRing(["a:6379", "b:6379", "c:6379"])
+
+        for i in range(1000):
+            key = f"j-{i}/i-{i}"
+            if after.shard(key) != 2:
+                self.assertEqual(before.shard(key), after.shard(key), key)
+
+
+class RedisShardsSpec(unittest.TestCase):
+    def test_shards_by_path_grok_fields(self):
+        shards = RedisShards(
+            [Mock(StrictRedis), Mock(StrictRedis)],
+            ["a:6379", "b:6379"],
+            shard_by=["cluster", "node"],
+        )
+
+        groks = {"cluster": "j-1", "node": "i-1", "bucketname": "one"}
+        self.assertEqual(
+            shards.shard(groks), shards.shard({**groks, "bucketname": "two"})
+        )
+        self.assertIsNone(RedisShards([Mock(StrictRedis)], ["a:6379"]).shard(groks))
+
+    def test_parses_endpoints(self):
+        self.assertEqual(
+            [("redis-1", 6379), ("redis-2", 6380)],
+            parse_endpoints("redis-1:6379, redis-2:6380"),
+        )
+        with self.assertRaises(ValueError):
+            parse_endpoints("redis-1")
+
+
+if __name__ == "__main__":
+    unittest.main()
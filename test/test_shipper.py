@@ -1,16 +1,32 @@
+import gzip
 import io
 import json
 import unittest
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-from unittest.mock import Mock
+from unittest.mock import Mock, call
 
 import boto3
 from botocore.response import StreamingBody
 from botocore.stub import Stubber, ANY
-from redis import StrictRedis
+from redis import StrictRedis, ResponseError
 
+from s3_log_shipper.backpressure import FlowControl, SpillStore, SpillWriter
+from s3_log_shipper.checkpoints import CheckpointStore, Checkpoint
+from s3_log_shipper.multiline import MultilineAssembler
+from s3_log_shipper.parallel import ParsePool
 from s3_log_shipper.parsers import ParserManager, Parser
-from s3_log_shipper.shipper import RedisLogShipper
+from s3_log_shipper.serialisers import JsonSerialiser
+from s3_log_shipper.sharding import RedisShards
+from s3_log_shipper.shipper import (
+    RedisLogShipper,
+    RedisBatchWriter,
+    RedisStreamWriter,
+    ShardedWriter,
+    ShippingError,
+    QueueFullError,
+    read_blocks,
+)
 
 
 class RedisLogShipperSpec(unittest.TestCase):
@@ -26,30 +42,410 @@ class RedisLogShipperSpec(unittest.TestCase):
         )
 
     def test_ship(self):
-        parser = Mock(Parser)
+        parser = Mock(Parser, type="test", line_filter=None, multiline=None)
         timestamp = datetime.now().isoformat()
 
         path_groks = {"timestamp": timestamp, "message": "Hello", "level": "INFO"}
         log_groks = {"cluster": "foo12345", "node": "abc1234"}
 
-        parser.parse_log.return_value = path_groks
+        parser.parse_many.side_effect = lambda block, convert: iter(
+            [(0, path_groks.copy())]
+        )
         self.parser_manager.get_parser.return_value = parser, log_groks
         self.s3_client.add_response(
             method="get_object",
             service_response={"Body": StreamingBody(io.BytesIO(b"HELLO"), 5)},
             expected_params={"Bucket": ANY, "Key": ANY},
         )
+        self.redis_client.pipeline.return_value.execute.return_value = [1]
         self.s3_client.activate()
         self.under_test.ship("foo", "bar.log")
 
         expected = log_groks.copy()
         expected.update(path_groks)
 
-        for call in self.redis_client.rpush.call_args_list:
+        pipeline = self.redis_client.pipeline.return_value
+        for call in pipeline.rpush.call_args_list:
             q, data = call[0]
             self.assertEqual(q, "logstash")
             self.assertEqual(json.loads(data), expected)
 
+    def test_ship_closes_the_body_once_read(self):
+        parser = Mock(Parser, type="test", line_filter=None, multiline=None)
+        parser.parse_many.side_effect = lambda block, convert: iter([])
+        self.parser_manager.get_parser.return_value = parser, {}
+        self.s3_client.activate()
+
+        for read_ahead in (0, 2):
+            for key, body in (
+                ("bar.log", b"one\n"),
+                ("bar.log.gz", gzip.compress(b"one\n")),
+            ):
+                with self.subTest(read_ahead=read_ahead, key=key):
+                    raw = io.BytesIO(body)
+                    self.s3_client.add_response(
+                        method="get_object",
+                        service_response={"Body": StreamingBody(raw, len(body))},
+                        expected_params={"Bucket": ANY, "Key": ANY},
+                    )
+                    shipper = RedisLogShipper(
+                        self.redis_client,
+                        self.parser_manager,
+                        self.s3_client.client,
+                        read_ahead=read_ahead,
+                    )
+
+                    self.assertEqual(1, shipper.ship("foo", key).lines)
+                    self.assertTrue(raw.closed)
+
+    def ship_lines(
+        self,
+        body: bytes,
+        should_stop=None,
+        checkpointed_lines=0,
+        flow_control=None,
+        spills=None,
+        multiline=None,
+    ):
+        checkpoints = Mock(CheckpointStore)
+        checkpoint = checkpoints.checkpoint.return_value = Mock(Checkpoint)
+        checkpoint.get.return_value = checkpointed_lines
+
+        parsed = []
+
+        def parse_many(block, convert_timestamp=None):
+            parsed.append(block)
+            return iter([(0, {"message": block})])
+
+        parser = Mock(Parser, type="test", line_filter=None, multiline=multiline)
+        parser.parse_many.side_effect = parse_many
+        self.parser_manager.get_parser.return_value = parser, {}
+        self.redis_client.pipeline.return_value.execute.return_value = [1]
+        self.s3_client.add_response(
+            method="get_object",
+            service_response={"Body": StreamingBody(io.BytesIO(body), len(body))},
+            expected_params={"Bucket": ANY, "Key": ANY},
+        )
+        self.s3_client.activate()
+
+        shipper = RedisLogShipper(
+            self.redis_client,
+            self.parser_manager,
+            self.s3_client.client,
+            block_size=8,
+            checkpoints=checkpoints,
+            flow_control=flow_control,
+            spills=spills,
+        )
+        result = shipper.ship("foo", "bar.log", "etag", should_stop)
+
+        checkpoints.checkpoint.assert_called_with("foo", "bar.log", "etag")
+        return result, checkpoint, parsed
+
+    def test_ship_resumes_from_checkpoint(self):
+        result, checkpoint, parsed = self.ship_lines(
+            b"one\ntwo\nthree\nfour\n", checkpointed_lines=2
+        )
+
+        self.assertEqual(["three\n", "four\n"], parsed)
+        self.assertEqual(4, result.lines)
+        self.assertEqual(2, result.metrics.counts["matched"])
+        self.assertTrue(result.complete)
+        checkpoint.save.assert_called_with(4)
+        checkpoint.clear.assert_called_once()
+
+    def test_ship_replaces_undecodable_bytes(self):
+        result, _, parsed = self.ship_lines(b"one\n\xfftwo\nthree\n")
+
+        self.assertEqual("one\n\ufffdtwo\nthree\n", "".join(parsed))
+        self.assertEqual(1, result.metrics.counts["replacement_chars"])
+        self.assertEqual(3, result.lines)
+
+    def test_ship_assembles_events_split_between_blocks(self):
+        result, checkpoint, parsed = self.ship_lines(
+            b"one\n\ttwo\n\tthree\nfour\n", multiline=MultilineAssembler("[a-z]")
+        )
+
+        self.assertEqual(["one\x00\ttwo\x00\tthree\n", "four\n"], parsed)
+        self.assertEqual(4, result.lines)
+        checkpoint.save.assert_called_with(4)
+
+    def test_ship_parses_large_objects_in_the_parse_pool(self):
+        body = "".join(f"line {i}\n" for i in range(50)).encode("utf-8")
+        parser = Mock(Parser, type="test", line_filter=None, multiline=None)
+        parser.parse_many.side_effect = lambda block, convert: iter(
+            [(0, {"message": block})]
+        )
+        self.parser_manager.get_parser.return_value = parser, {}
+        self.redis_client.pipeline.return_value.execute.return_value = [1]
+        for _ in range(2):
+            self.s3_client.add_response(
+                method="get_object",
+                service_response={"Body": StreamingBody(io.BytesIO(body), len(body))},
+                expected_params={"Bucket": ANY, "Key": ANY},
+            )
+        self.s3_client.activate()
+        parse_pool = ParsePool(self.parser_manager, JsonSerialiser(), 2)
+        self.addCleanup(parse_pool.close)
+
+        shipper = RedisLogShipper(
+            self.redis_client,
+            self.parser_manager,
+            self.s3_client.client,
+            block_size=16,
+            parse_pool=parse_pool,
+            parallel_min_bytes=len(body),
+        )
+        # Only the larger object is parsed in the pool, by the worker processes
+        parsed = shipper.ship("foo", "bar.log", size=len(body))
+        parser.parse_many.assert_not_called()
+        serial = shipper.ship("foo", "bar.log", size=len(body) - 1)
+        parser.parse_many.assert_called()
+
+        messages = [
+            json.loads(record)["message"]
+            for args, _ in self.redis_client.pipeline.return_value.rpush.call_args_list
+            for record in args[1:]
+        ]
+        self.assertEqual(body.decode("utf-8") * 2, "".join(messages))
+        self.assertEqual((parsed.written, parsed.lines), (serial.written, serial.lines))
+
+    def test_ship_checkpoints_and_stops_when_asked(self):
+        result, checkpoint, parsed = self.ship_lines(
+            b"one\ntwo\nthree\nfour\n", should_stop=lambda: True
+        )
+
+        self.assertEqual(["one\ntwo\n"], parsed)
+        self.assertEqual(2, result.lines)
+        self.assertFalse(result.complete)
+        checkpoint.save.assert_called_once_with(2)
+        checkpoint.clear.assert_not_called()
+
+    def test_ship_drops_the_records_buffered_when_it_fails(self):
+        body = b"one\ntwo\nthree\nfour\n"
+        parser = Mock(Parser, type="test", line_filter=None, multiline=None)
+        parser.parse_many.side_effect = [
+            iter([(0, {"message": "one"})]),
+            ValueError("Unparseable block"),
+        ]
+        self.parser_manager.get_parser.return_value = parser, {}
+        self.redis_client.pipeline.return_value.execute.side_effect = ResponseError(
+            "down"
+        )
+        self.s3_client.add_response(
+            method="get_object",
+            service_response={"Body": StreamingBody(io.BytesIO(body), len(body))},
+            expected_params={"Bucket": ANY, "Key": ANY},
+        )
+        self.s3_client.activate()
+        shipper = RedisLogShipper(
+            self.redis_client, self.parser_manager, self.s3_client.client, block_size=8
+        )
+
+        # Rather than the error flushing them to redis, which is down, would raise
+        with self.assertRaises(ValueError):
+            shipper.ship("foo", "bar.log")
+
+        self.redis_client.pipeline.return_value.execute.assert_not_called()
+
+    def test_ship_fails_over_the_hard_limit_without_a_spill(self):
+        flow_control = Mock(FlowControl, hard_limit=10, metric="length")
+        flow_control.admit.return_value = False
+
+        with self.assertRaises(QueueFullError) as raised:
+            self.ship_lines(b"one\ntwo\nthree\nfour\n", flow_control=flow_control)
+
+        self.assertEqual(1, raised.exception.written)
+        self.redis_client.pipeline.return_value.rpush.assert_called_once_with(
+            "logstash", '{"message":"one\\ntwo\\n"}'
+        )
+
+    def test_ship_spills_over_the_hard_limit(self):
+        flow_control = Mock(FlowControl, hard_limit=10, metric="length")
+        flow_control.admit.return_value = False
+        spills = Mock(SpillStore)
+        spill = spills.spill.return_value = Mock(
+            SpillWriter, bucket="staging", key="spilled", written=1
+        )
+
+        result, checkpoint, parsed = self.ship_lines(
+            b"one\ntwo\nthree\nfour\n", flow_control=flow_control, spills=spills
+        )
+
+        spills.spill.assert_called_once_with("foo", "bar.log", 2)
+        self.assertEqual(
+            [call('{"message":"three\\n"}'), call('{"message":"four\\n"}')],
+            spill.write.call_args_list,
+        )
+        spill.close.assert_called_once()
+        flow_control.admit.assert_called_once()
+        self.assertEqual(
+            (1, 4, True, 1),
+            (result.written, result.lines, result.complete, result.spilled),
+        )
+        checkpoint.clear.assert_called_once()
+
+    def test_blocks_are_cut_at_line_ends(self):
+        log_file = io.StringIO("first line\nsecond\nthird line is long\nlast")
+
+        blocks = list(read_blocks(log_file, 8))
+
+        self.assertEqual(
+            ["first line\n", "second\n", "third line is long\n", "last"], blocks
+        )
+
+
+class RedisBatchWriterSpec(unittest.TestCase):
+    def setUp(self) -> None:
+        self.redis_client = Mock(StrictRedis)
+        self.pipeline = self.redis_client.pipeline.return_value
+
+    def test_records_are_pushed_in_batches(self):
+        under_test = RedisBatchWriter(self.redis_client, batch_size=2, batch_bytes=4)
+        self.pipeline.execute.return_value = [2, 4]
+
+        for record in ["a", "b", "c", "d", "e"]:
+            under_test.write(record)
+
+        self.pipeline.rpush.assert_any_call("logstash", "a", "b")
+        self.pipeline.rpush.assert_any_call("logstash", "c", "d")
+        self.assertEqual(4, under_test.written)
+
+        self.pipeline.execute.return_value = [5]
+        self.assertEqual(1, under_test.flush())
+        self.pipeline.rpush.assert_called_with("logstash", "e")
+        self.assertEqual(5, under_test.written)
+
+    def test_partly_failed_flush_reports_written_records(self):
+        under_test = RedisBatchWriter(self.redis_client, batch_size=2)
+        self.pipeline.execute.return_value = [2, ResponseError("OOM")]
+
+        for record in ["a", "b", "c"]:
+            under_test.write(record)
+
+        with self.assertRaises(ShippingError) as raised:
+            under_test.flush()
+
+        self.assertEqual(2, raised.exception.written)
+        self.assertEqual(2, under_test.written)
+        self.assertEqual(1, under_test.failed)
+
+
+class RedisStreamWriterSpec(unittest.TestCase):
+    def setUp(self) -> None:
+        self.redis_client = Mock(StrictRedis)
+        self.pipeline = self.redis_client.pipeline.return_value
+
+    def test_records_are_added_to_a_capped_stream(self):
+        under_test = RedisStreamWriter(self.redis_client, maxlen=100, batch_bytes=2)
+        self.pipeline.execute.return_value = [b"1-0", b"1-1"]
+
+        for record in ["a", "b"]:
+            under_test.write(record)
+
+        self.assertEqual(
+            [
+                call("logstash", {"event": "a"}, maxlen=100, approximate=True),
+                call("logstash", {"event": "b"}, maxlen=100, approximate=True),
+            ],
+            self.pipeline.xadd.call_args_list,
+        )
+        self.pipeline.rpush.assert_not_called()
+        self.assertEqual(2, under_test.written)
+
+    def test_partly_failed_flush_reports_written_records(self):
+        under_test = RedisStreamWriter(self.redis_client, maxlen=0)
+        self.pipeline.execute.return_value = [b"1-0", ResponseError("OOM"), b"1-2"]
+
+        for record in ["a", "b", "c"]:
+            under_test.write(record)
+
+        with self.assertRaises(ShippingError):
+            under_test.flush()
+
+        self.pipeline.xadd.assert_called_with(
+            "logstash", {"event": "c"}, maxlen=None, approximate=True
+        )
+        self.assertEqual(2, under_test.written)
+        self.assertEqual(1, under_test.failed)
+
+    def test_shipper_writes_to_the_configured_output(self):
+        shipper = RedisLogShipper(
+            self.redis_client,
+            Mock(ParserManager),
+            Mock(),
+            output="stream",
+            output_key="logs",
+            stream_maxlen=10,
+        )
+
+        writer = shipper.make_writer()
+
+        self.assertIsInstance(writer, RedisStreamWriter)
+        self.assertEqual(("logs", 10), (writer.list_key, writer.maxlen))
+        with self.assertRaises(ValueError):
+            RedisLogShipper(self.redis_client, Mock(), Mock(), output="pubsub")
+
+
+class ShardedWriterSpec(unittest.TestCase):
+    def setUp(self) -> None:
+        self.clients = [Mock(StrictRedis), Mock(StrictRedis)]
+        self.pool = ThreadPoolExecutor(max_workers=2)
+
+    def tearDown(self) -> None:
+        self.pool.shutdown()
+
+    def test_records_are_spread_round_robin_and_flushed_together(self):
+        for client in self.clients:
+            client.pipeline.return_value.execute.return_value = [2]
+        under_test = ShardedWriter(
+            [RedisBatchWriter(client) for client in self.clients],
+            self.pool,
+            batch_bytes=2,
+        )
+
+        for record in ["a", "b", "c", "d"]:
+            under_test.write(record)
+
+        self.clients[0].pipeline.return_value.rpush.assert_called_once_with(
+            "logstash", "a", "c"
+        )
+        self.clients[1].pipeline.return_value.rpush.assert_called_once_with(
+            "logstash", "b", "d"
+        )
+        self.assertEqual(4, under_test.written)
+        self.assertEqual(0, under_test.flush())
+
+    def test_failed_shard_reports_records_written_to_the_others(self):
+        self.clients[0].pipeline.return_value.execute.return_value = [1]
+        self.clients[1].pipeline.return_value.execute.return_value = [
+            ResponseError("OOM")
+        ]
+        under_test = ShardedWriter(
+            [RedisBatchWriter(client) for client in self.clients], self.pool
+        )
+
+        under_test.write("a")
+        under_test.write("b")
+        with self.assertRaises(ShippingError) as raised:
+            under_test.flush()
+
+        self.assertEqual(1, raised.exception.written)
+        self.assertEqual(1, under_test.failed)
+
+    def test_shipper_writes_each_object_to_its_shard(self):
+        shards = RedisShards(self.clients, ["a:6379", "b:6379"], shard_by=["node"])
+        shipper = RedisLogShipper(
+            self.clients[0], Mock(ParserManager), Mock(), shards=shards
+        )
+
+        writer = shipper.make_writer(path_groks={"node": "i-1"})
+
+        self.assertIs(
+            self.clients[shards.shard({"node": "i-1"})], writer.redis_endpoint
+        )
+        shards.pool.shutdown()
+
 
 if __name__ == "__main__":
     unittest.main()
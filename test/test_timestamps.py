@@ -0,0 +1,71 @@
+from datetime import datetime
+from unittest import TestCase
+
+from s3_log_shipper.timestamps import TimestampConverter
+
+
+class TimestampConverterSpec(TestCase):
+    def assert_same_as_strptime(self, pattern: str, timestamps) -> None:
+        under_test = TimestampConverter(pattern)
+
+        for timestamp in timestamps:
+            try:
+                expected = datetime.strptime(timestamp, pattern).isoformat()
+            except ValueError:
+                with self.assertRaises(ValueError, msg=timestamp):
+                    under_test(timestamp)
+                continue
+
+            self.assertEqual(expected, under_test(timestamp), timestamp)
+
+    def test_oozie_and_yarn_timestamps(self):
+        self.assert_same_as_strptime(
+            "%Y-%m-%d %H:%M:%S,%f",
+            [
+                "2020-04-28 05:58:34,602",
+                "2020-04-28 05:58:35,000",
+                "2020-04-28 23:59:59,1",
+                "2020-04-29 00:00:00,123456",
+                "2020-02-30 00:00:00,123",
+                "2020-04-28 24:00:00,123",
+                "2020-04-28 05:58:34,1234567",
+                "2020-4-28 05:58:34,602",
+                "2020-04-28 05:58:34",
+                "0000-04-28 05:58:34,602",
+            ],
+        )
+
+    def test_spark_and_livy_timestamps(self):
+        self.assert_same_as_strptime(
+            "%y/%m/%d %H:%M:%S",
+            [
+                "20/04/27 19:14:44",
+                "20/04/28 07:48:37",
+                "69/01/01 00:00:00",
+                "68/12/31 23:59:59",
+                "20/13/01 00:00:00",
+                "20/04/27 19:14:60",
+                "20/04/27 19:14:44 ",
+                "2０/04/27 19:14:44",
+            ],
+        )
+
+    def test_livy_request_timestamps(self):
+        self.assert_same_as_strptime(
+            "%d/%b/%Y:%H:%M:%S %z",
+            [
+                "28/Apr/2020:07:48:37 +0000",
+                "28/apr/2020:07:48:37 -0000",
+                "28/Apr/2020:07:48:37 +0530",
+                "28/Apr/2020:07:48:37 -1200",
+                "31/Apr/2020:07:48:37 +0000",
+                "28/Foo/2020:07:48:37 +0000",
+                "28/Apr/2020:07:48:37 +2500",
+                "28/Apr/2020:07:48:37 +00:00",
+            ],
+        )
+
+    def test_other_patterns_use_strptime(self):
+        self.assert_same_as_strptime(
+            "%Y-%m-%dT%H:%M:%S", ["2020-04-28T05:58:34", "2020-04-28 05:58:34"]
+        )
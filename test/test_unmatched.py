@@ -0,0 +1,60 @@
+import gzip
+import unittest
+from unittest.mock import Mock
+
+from s3_log_shipper.unmatched import DeadLetterStore, UnmatchedReporter
+
+
+class UnmatchedReporterSpec(unittest.TestCase):
+    def setUp(self) -> None:
+        self.uploaded = {}
+
+        def upload_fileobj(file, bucket, key):
+            self.uploaded[(bucket, key)] = gzip.decompress(file.read())
+
+        self.s3_client = Mock()
+        self.s3_client.upload_fileobj.side_effect = upload_fileobj
+
+    def test_logs_a_single_bounded_summary(self):
+        under_test = UnmatchedReporter("oozie", "logs", "oozie.log.gz", sample_size=2)
+        for i in range(1000):
+            under_test.report(f"line {i}")
+
+        with self.assertLogs("s3_log_shipper.unmatched", "ERROR") as logs:
+            under_test.close()
+
+        self.assertEqual(1, len(logs.output))
+        self.assertIn(
+            "Couldn't grok 1000 lines of oozie log logs/oozie.log.gz", logs.output[0]
+        )
+        self.assertIn("['line 0', 'line 1']", logs.output[0])
+
+    def test_writes_every_line_to_the_dead_letter_object(self):
+        dead_letters = DeadLetterStore(self.s3_client, "dead")
+        under_test = UnmatchedReporter(
+            "livy", "logs", "livy.out.gz", 42, sample_size=1, dead_letters=dead_letters
+        )
+        under_test.report("first")
+        under_test.report("second\n\tat trace")
+
+        with self.assertLogs("s3_log_shipper.unmatched", "ERROR") as logs:
+            under_test.close()
+
+        key = "s3-log-shipper-unmatched/logs/livy.out.gz.42.gz"
+        self.assertEqual({("dead", key): b"first\nsecond\n\tat trace\n"}, self.uploaded)
+        self.assertIn(f"s3://dead/{key}", logs.output[0])
+
+    def test_writes_nothing_without_unmatched_lines(self):
+        dead_letters = DeadLetterStore(self.s3_client, "dead")
+        under_test = UnmatchedReporter(
+            "livy", "logs", "livy.out.gz", dead_letters=dead_letters
+        )
+
+        under_test.close()
+        under_test.discard()
+
+        self.s3_client.upload_fileobj.assert_not_called()
+
+
+if __name__ == "__main__":
+    unittest.main()